@@ -0,0 +1,212 @@
+"""
+Admission control and load shedding for seminar endpoints.
+Limits how many seminars run at once, queues the rest, and rejects early when the
+projected queue wait would blow the deadline (or the request's own, if sooner). Some
+slots are reserved for signed-in users, batch work gets a few slots behind interactive
+requests, and speculative work only uses idle capacity.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional, Set
+
+from deadline import Deadline
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+AUTHENTICATED = "authenticated"
+ANONYMOUS = "anonymous"
+BATCH = "batch"
+SPECULATIVE = "speculative"
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of queued"""
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Request shed: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    def __init__(self):
+        self.max_concurrent = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+        self.reserved_slots = min(int(os.getenv("ADMISSION_RESERVED_SLOTS", "2")), self.max_concurrent - 1)
+        self.max_queue_wait = float(os.getenv("ADMISSION_MAX_QUEUE_WAIT", "20"))
+        self.max_queue_depth = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "50"))
+        self.speculative_slots = int(os.getenv("ADMISSION_SPECULATIVE_SLOTS", "1"))
+        # Batch items use at most this many slots, and may queue longer than interactive requests
+        self.batch_slots = max(1, min(int(os.getenv("ADMISSION_BATCH_SLOTS", "2")), self.max_concurrent - self.reserved_slots))
+        self.batch_max_queue_wait = float(os.getenv("ADMISSION_BATCH_MAX_QUEUE_WAIT", "300"))
+        self.ewma_alpha = 0.2
+
+        self.running = 0
+        # Batch items among the running requests
+        self.batch_running = 0
+        self.queues: Dict[str, Deque[asyncio.Future]] = {AUTHENTICATED: deque(), ANONYMOUS: deque(), BATCH: deque()}
+        # Tasks doing speculative work; not counted in running, and cancelled when real requests need the capacity
+        self.speculative: Set[asyncio.Task] = set()
+        # Smoothed duration of an admitted request and of the time spent queueing for it
+        self.service_time = float(os.getenv("ADMISSION_INITIAL_SERVICE_TIME", "15"))
+        self.queue_wait = 0.0
+
+    def _limit(self, lane: str) -> int:
+        """Anonymous callers and batch items cannot use the reserved slots"""
+        return self.max_concurrent if lane == AUTHENTICATED else self.max_concurrent - self.reserved_slots
+
+    def _has_slot(self, lane: str) -> bool:
+        if lane == BATCH and self.batch_running >= self.batch_slots:
+            return False
+        return self.running < self._limit(lane)
+
+    def queue_depth(self) -> int:
+        """Interactive requests waiting; queued batch items never count against them"""
+        return len(self.queues[AUTHENTICATED]) + len(self.queues[ANONYMOUS])
+
+    def projected_wait(self, lane: str) -> float:
+        """Expected queueing time for a new request in this lane"""
+        # Authenticated waiters are served first, so anonymous ones queue behind both lanes,
+        # and batch items behind all three. With every slot busy, a slot frees up every
+        # service_time / slots seconds on average.
+        slots = self.batch_slots if lane == BATCH else self._limit(lane)
+        return (self._waiters_ahead(lane) + 1) * self.service_time / slots
+
+    def _waiters_ahead(self, lane: str) -> int:
+        if lane == AUTHENTICATED:
+            return len(self.queues[AUTHENTICATED])
+        if lane == BATCH:
+            return self.queue_depth() + len(self.queues[BATCH])
+        return self.queue_depth()
+
+    @asynccontextmanager
+    async def admit(self, lane: str, deadline: Optional[Deadline] = None):
+        """
+        Hold a seminar slot for the duration of the block, queueing or shedding as needed.
+        A request with a `deadline` sooner than the queue's limit is shed if it cannot wait that long.
+        """
+        enqueued_at = time.monotonic()
+        if self._has_slot(lane) and not self._waiters_ahead(lane):
+            self._take_slot(lane)
+        else:
+            await self._wait_for_slot(lane, deadline)
+        if lane != BATCH:
+            # Batch items are expected to wait; only interactive waits feed brownout
+            self._record_queue_wait(time.monotonic() - enqueued_at)
+
+        started_at = time.monotonic()
+        self._publish()
+        try:
+            yield
+        finally:
+            self.service_time += self.ewma_alpha * (time.monotonic() - started_at - self.service_time)
+            self._release_slot(lane)
+            self._wake_next()
+            self._publish()
+
+    @asynccontextmanager
+    async def admit_speculative(self):
+        """
+        Run low-priority work in idle capacity for the duration of the block. It is never queued,
+        and is cancelled as soon as a real request needs the capacity. Raises AdmissionRejected
+        if nothing is idle.
+        """
+        if (self.queue_depth() or len(self.speculative) >= self.speculative_slots
+                or self.running + len(self.speculative) >= self._limit(ANONYMOUS)):
+            metrics.increment("admission_rejections_total", lane=SPECULATIVE, reason="no_idle_capacity")
+            raise AdmissionRejected("no idle capacity", self.service_time)
+        task = asyncio.current_task()
+        self.speculative.add(task)
+        self._publish()
+        try:
+            yield
+        finally:
+            self.speculative.discard(task)
+            self._publish()
+
+    def _preempt(self) -> None:
+        """Cancel speculative work that now stands in the way of admitted requests"""
+        while self.speculative and self.running + len(self.speculative) > self._limit(ANONYMOUS):
+            self.speculative.pop().cancel()
+            metrics.increment("admission_preemptions_total")
+
+    def _take_slot(self, lane: str) -> None:
+        self.running += 1
+        if lane == BATCH:
+            self.batch_running += 1
+        self._preempt()
+
+    def _release_slot(self, lane: str) -> None:
+        self.running -= 1
+        if lane == BATCH:
+            self.batch_running -= 1
+
+    async def _wait_for_slot(self, lane: str, deadline: Optional[Deadline]) -> None:
+        queue_limit = self.batch_max_queue_wait if lane == BATCH else self.max_queue_wait
+        max_wait = deadline.bound(queue_limit) if deadline is not None else queue_limit
+        projected = self.projected_wait(lane)
+        # The batch queue is bounded by the batch scheduler, not by the interactive queue depth
+        if projected > max_wait or (lane != BATCH and self.queue_depth() >= self.max_queue_depth):
+            metrics.increment("admission_rejections_total", lane=lane, reason="projected_wait")
+            logger.warning(f"Shedding {lane} request: projected wait {projected:.1f}s, queue depth {self.queue_depth()}")
+            raise AdmissionRejected("server busy", projected)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues[lane].append(waiter)
+        self._publish()
+        try:
+            # The slot is handed over by _wake_next, which takes it for us
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=max_wait)
+        except asyncio.TimeoutError:
+            self._abandon(lane, waiter)
+            metrics.increment("admission_rejections_total", lane=lane, reason="queue_timeout")
+            raise AdmissionRejected("queue wait exceeded deadline", self.projected_wait(lane))
+        except asyncio.CancelledError:
+            self._abandon(lane, waiter)
+            raise
+
+    def _abandon(self, lane: str, waiter: asyncio.Future) -> None:
+        """Leave the queue; if a slot was handed over in the meantime, pass it on"""
+        if waiter in self.queues[lane]:
+            self.queues[lane].remove(waiter)
+        elif waiter.done() and not waiter.cancelled():
+            self._release_slot(lane)
+            self._wake_next()
+        self._publish()
+
+    def _wake_next(self) -> None:
+        for lane in (AUTHENTICATED, ANONYMOUS, BATCH):
+            queue = self.queues[lane]
+            while queue and self._has_slot(lane):
+                waiter = queue.popleft()
+                if waiter.done():
+                    continue
+                self._take_slot(lane)
+                waiter.set_result(None)
+                return
+
+    def _record_queue_wait(self, seconds: float) -> None:
+        self.queue_wait += self.ewma_alpha * (seconds - self.queue_wait)
+
+    def _publish(self) -> None:
+        metrics.set_gauge("admission_running", self.running)
+        metrics.set_gauge("admission_queue_depth", self.queue_depth())
+        metrics.set_gauge("admission_batch_running", self.batch_running)
+        metrics.set_gauge("admission_batch_queue_depth", len(self.queues[BATCH]))
+        metrics.set_gauge("admission_speculative", len(self.speculative))
+        metrics.set_gauge("admission_queue_wait_seconds", round(self.queue_wait, 3))
+        metrics.set_gauge("admission_service_time_seconds", round(self.service_time, 3))
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "running": self.running,
+            "queue_depth": self.queue_depth(),
+            "queue_wait": self.queue_wait,
+            "service_time": self.service_time,
+            "max_concurrent": self.max_concurrent,
+        }
+
+# Global admission controller instance
+admission_controller = AdmissionController()
@@ -11,6 +11,7 @@ import logging
 from memory import memory_manager
 from agent_config import get_agent_params, get_few_shot_examples
 from huggingface_client import HuggingFaceClient, HuggingFaceError, retry_with_exponential_backoff
+from brownout import DegradationPolicy
 from websocket_manager import manager
 
 logger = logging.getLogger(__name__)
@@ -226,7 +227,9 @@ class AgentManager:
                           question: str, 
                           conversation_id: Optional[str] = None,
                           include_context: bool = True,
-                          custom_context: Optional[str] = None) -> Dict[str, str]:
+                          custom_context: Optional[str] = None,
+                          degradation: Optional[DegradationPolicy] = None,
+                          remember: bool = True) -> Dict[str, str]:
         """
         Get a response from an agent for a given question.
         
@@ -236,6 +239,8 @@ class AgentManager:
             conversation_id: Optional ID for the conversation (for memory)
             include_context: Whether to include conversation context
             custom_context: Optional custom context string to use instead of memory context
+            degradation: Optional brownout policy that shrinks max_tokens and memory depth
+            remember: Whether to store the exchange in memory (speculative answers are stored once served)
             
         Returns:
             Dictionary with agent ID and response
@@ -266,6 +271,10 @@ IMPORTANT INSTRUCTIONS FOR GROUP CHAT:
             max_tokens = params.get("max_tokens", 350)  # Reduced from 500 to encourage brevity
             top_p = params.get("top_p", 0.95)
             persona_strength = params.get("persona_strength", 1.0)
+            memory_depth = None
+            if degradation is not None and degradation.level > 0:
+                max_tokens = degradation.scale_max_tokens(max_tokens)
+                memory_depth = degradation.scale_memory_depth(params.get("memory_depth", 5))
             
             # Log agent parameters
             logger.debug(f"Using agent {agent_id} with params: model={model}, temp={temperature}, tokens={max_tokens}")
@@ -277,7 +286,7 @@ IMPORTANT INSTRUCTIONS FOR GROUP CHAT:
                 context = custom_context
             elif include_context:
                 logger.debug(f"Using memory context for agent {agent_id}")
-                context = memory_manager.get_context(conversation_id, agent_id)
+                context = memory_manager.get_context(conversation_id, agent_id, memory_depth=memory_depth)
                 
                 # Truncate context if it's too long to prevent token limit issues
                 if len(context) > 4000:  # Approx 1000 tokens
@@ -356,7 +365,8 @@ IMPORTANT INSTRUCTIONS FOR GROUP CHAT:
                 messages=messages,
                 max_tokens=max_tokens,
                 temperature=temperature,
-                top_p=top_p
+                top_p=top_p,
+                prefer_fallback=degradation is not None and degradation.prefer_fallback
             )
             
             # Extract and process the response
@@ -367,13 +377,16 @@ IMPORTANT INSTRUCTIONS FOR GROUP CHAT:
             logger.debug(f"Response preview: {answer[:70]}...")
             
             # Store in memory
-            memory_manager.add_exchange(conversation_id, agent_id, question, answer)
+            if remember:
+                memory_manager.add_exchange(conversation_id, agent_id, question, answer)
             
             return {
                 "agent": agent_id,
                 "response": answer,
-                "model": model,
-                "conversation_id": conversation_id
+                "model": response.get("model", model),
+                "conversation_id": conversation_id,
+                "usage": response.get("usage", {}),
+                "degradation_level": degradation.level if degradation is not None else 0
             }
             
         except Exception as e:
@@ -384,7 +397,8 @@ IMPORTANT INSTRUCTIONS FOR GROUP CHAT:
     async def get_multiple_responses(self, 
                                     agent_ids: List[str], 
                                     question: str,
-                                    conversation_id: Optional[str] = None) -> List[Dict[str, str]]:
+                                    conversation_id: Optional[str] = None,
+                                    degradation: Optional[DegradationPolicy] = None) -> List[Dict[str, str]]:
         """
         Get responses from multiple agents concurrently.
         
@@ -392,6 +406,7 @@ IMPORTANT INSTRUCTIONS FOR GROUP CHAT:
             agent_ids: List of agent IDs to query
             question: The question to send to all agents
             conversation_id: Optional ID for the conversation
+            degradation: Optional brownout policy applied to every agent
             
         Returns:
             List of dictionaries with agent responses
@@ -401,7 +416,7 @@ IMPORTANT INSTRUCTIONS FOR GROUP CHAT:
             
         tasks = []
         for agent_id in agent_ids:
-            tasks.append(self.get_response(agent_id, question, conversation_id))
+            tasks.append(self.get_response(agent_id, question, conversation_id, degradation=degradation))
             
         responses = await asyncio.gather(*tasks, return_exceptions=True)
         
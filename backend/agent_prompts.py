@@ -0,0 +1,43 @@
+"""
+Agent system prompts, loaded from the archetype files in prompts/.
+"""
+
+import json
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+PROMPTS_DIR = Path(__file__).parent / "prompts"
+# Markers used in the JSONL files: the prompt ends with "++++", the completion with "####"
+PROMPT_END = "++++"
+COMPLETION_END = "####"
+
+# Load agent prompts from different archetype files
+def load_prompts():
+    prompts = {}
+    # Load prompts from each JSONL file
+    for prompt_file in PROMPTS_DIR.glob("*.jsonl"):
+        agent_name = prompt_file.stem  # Get the filename without extension
+        
+        try:
+            with open(prompt_file, "r") as f:
+                # For JSONL files, we take the first line and use the completion as the prompt
+                first_line = f.readline().strip()
+                if first_line:
+                    data = json.loads(first_line)
+                    if "completion" in data:
+                        prompt_text = data["completion"].strip()
+                        # Remove the trailing #### if present
+                        if prompt_text.endswith(COMPLETION_END):
+                            prompt_text = prompt_text[:-len(COMPLETION_END)].strip()
+                        prompts[agent_name] = prompt_text
+                    else:
+                        logger.warning(f"No 'completion' field found in first line of {prompt_file}")
+        except json.JSONDecodeError:
+            logger.error(f"Error decoding JSON from first line of {prompt_file}")
+        except Exception as e:
+            logger.error(f"Error loading prompt for {agent_name} from {prompt_file}: {str(e)}")
+    
+    logger.info(f"Loaded prompts for agents: {list(prompts.keys())}")
+    return prompts
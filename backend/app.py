@@ -1,21 +1,34 @@
 import os
 import logging
-import json
-import time
-from fastapi import FastAPI, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect
+import math
+from fastapi import FastAPI, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import List, Dict, Optional, Any
-from pathlib import Path
 from dotenv import load_dotenv
-import random
 import asyncio
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime
 from websocket_manager import manager
 from starlette.websockets import WebSocketState
 from huggingface_client import HuggingFaceClient, HuggingFaceError
+from metrics import metrics
+from serialization import FastJSONResponse
+from warmup import warmup_manager
+from rate_limit import rate_limit_policy, rate_limit_key
+from admission import admission_controller, AdmissionRejected, AUTHENTICATED, ANONYMOUS
+from quotas import quota_engine, QuotaExceededError, QuotaReservation, estimate_seminar_tokens, total_usage
+from brownout import brownout_controller
+from google_auth import google_key_set
+from seminar import SeminarRunner, PublicSeminarRunner, RoundPolicy, SeminarFailed
+from event_stream import stream_response, NDJSON_MEDIA_TYPE
+from batch import batch_scheduler, BatchItem, BatchStats
+from jobs import job_manager, JobRejected, SeminarJob, SUCCEEDED, FAILED, CANCELLED
+from ws_commands import CommandSession
+from task_registry import conversation_tasks, SeminarCancelled, DELETED
+from deadline import Deadline, deadline_scope, request_deadline
+from idempotency import IdempotencyMiddleware
+from speculation import speculation_manager
 
 # Configure logging
 logging.basicConfig(
@@ -29,53 +42,34 @@ load_dotenv()
 
 # Import enhanced agent management
 from agent_manager import AgentManager
+from agent_prompts import load_prompts
 from memory import memory_manager
 # Import auth module
 from auth import GoogleSignInRequest, TokenResponse, UserResponse, verify_google_token, create_access_token, get_current_user, TokenData
 
-app = FastAPI(title="AI Socratic Seminar API")
+app = FastAPI(title="AI Socratic Seminar API", default_response_class=FastJSONResponse)
 
-# Simple rate limiter
-class RateLimiter:
-    def __init__(self):
-        self.requests = {}
-        self.MAX_REQUESTS = 60  # Max requests per hour per IP
-        self.WINDOW = timedelta(hours=1)
-        
-    def is_rate_limited(self, ip: str) -> bool:
-        now = datetime.now()
-        if ip not in self.requests:
-            self.requests[ip] = []
-        
-        # Remove old requests
-        self.requests[ip] = [time for time in self.requests[ip] 
-                            if now - time < self.WINDOW]
-        
-        # Check rate limit
-        if len(self.requests[ip]) >= self.MAX_REQUESTS:
-            return True
-        
-        # Add new request
-        self.requests[ip].append(now)
-        return False
-
-rate_limiter = RateLimiter()
+# Retries and double-submits carrying the same Idempotency-Key share one run. Added before
+# the rate limiter so it sits inside it: duplicates still count against the caller's limit.
+app.add_middleware(IdempotencyMiddleware, paths=["/seminar", "/continue", "/public/seminar", "/public/continue"])
 
 # Rate limiting middleware
 @app.middleware("http")
 async def rate_limit_middleware(request: Request, call_next):
-    # Get client IP
-    ip = request.client.host
-    
     # Rate limit only API endpoints
-    if "/seminar" in request.url.path or "/continue" in request.url.path:
-        if rate_limiter.is_rate_limited(ip):
-            raise HTTPException(
-                status_code=429,
-                detail="Rate limit exceeded. Please try again later."
-            )
-    
+    if "/seminar" not in request.url.path and "/continue" not in request.url.path:
+        return await call_next(request)
+
+    decision = rate_limit_policy.check(request)
+    if not decision.allowed:
+        return FastJSONResponse(
+            status_code=429,
+            content={"detail": "Rate limit exceeded. Please try again later."},
+            headers=decision.headers()
+        )
+
     response = await call_next(request)
+    response.headers.update(decision.headers())
     return response
 
 # Request models
@@ -86,16 +80,37 @@ class SeminarRequest(BaseModel):
     auto_conversation: Optional[bool] = False
     max_rounds: Optional[int] = 3
     direct_mention: Optional[str] = None
+    # Pre-generate the round a plain /continue would get next, while the user reads this one
+    speculate: Optional[bool] = False
 
 class ContinueRequest(BaseModel):
     conversation_id: str
     question: Optional[str] = None
     agent_ids: List[str]
+    speculate: Optional[bool] = False
+
+# What /continue asks the agents when the user has no new question
+CONTINUE_QUESTION = "Please continue the discussion, building on the previous exchanges."
 
 class AgentConfigRequest(BaseModel):
     agent_id: str
     parameters: Dict[str, Any]
 
+class BatchSeminarItem(BaseModel):
+    id: Optional[str] = None
+    question: str
+    # Either the agents themselves or the name of a panel defined on the batch
+    agent_ids: Optional[List[str]] = None
+    panel: Optional[str] = None
+    auto_conversation: Optional[bool] = False
+    max_rounds: Optional[int] = 3
+    direct_mention: Optional[str] = None
+
+class BatchSeminarRequest(BaseModel):
+    items: List[BatchSeminarItem]
+    panels: Optional[Dict[str, List[str]]] = None
+    concurrency: Optional[int] = None
+
 # Added ChatRequest model
 class ChatRequest(BaseModel):
     messages: List[Dict[str, str]]
@@ -145,80 +160,61 @@ logger.info(f"CORS middleware configured with origins: {allow_origins}")
 huggingface_client: Optional[HuggingFaceClient] = None
 agent_manager: Optional[AgentManager] = None
 
-# Load agent prompts from different archetype files
-def load_prompts():
-    prompts = {}
-    prompts_dir = Path(__file__).parent / "prompts"
-    
-    # Load prompts from each JSONL file
-    for prompt_file in prompts_dir.glob("*.jsonl"):
-        agent_name = prompt_file.stem  # Get the filename without extension
-        
+AGENT_PROMPTS = load_prompts()
+
+def create_services() -> None:
+    """Create the Hugging Face client and Agent Manager. Raises if configuration is missing."""
+    global huggingface_client, agent_manager
+    logger.info("Initializing Hugging Face client...")
+    # Re-read .env so a retry can pick up configuration that appeared after startup
+    load_dotenv()
+    hf_api_key = os.getenv("HUGGINGFACE_API_KEY")
+    if not hf_api_key:
+        logger.error("HUGGINGFACE_API_KEY environment variable is not set")
+        raise ValueError("HUGGINGFACE_API_KEY environment variable is not set")
+
+    client = HuggingFaceClient(api_key=hf_api_key)
+    logger.info("Initializing Agent Manager...")
+    agent_manager = AgentManager(client, AGENT_PROMPTS)
+    huggingface_client = client
+    brownout_controller.attach(client.latency, client.balancer.models())
+    logger.info("Agent Manager initialized successfully")
+
+async def initialize_with_retry():
+    """Keep trying to create services, then hand model loading to the warm-up manager."""
+    delay = 5
+    while True:
         try:
-            with open(prompt_file, "r") as f:
-                # For JSONL files, we take the first line and use the completion as the prompt
-                first_line = f.readline().strip()
-                if first_line:
-                    data = json.loads(first_line)
-                    if "completion" in data:
-                        prompt_text = data["completion"].strip()
-                        # Remove the trailing #### if present
-                        if prompt_text.endswith("####"):
-                            prompt_text = prompt_text[:-4].strip()
-                        prompts[agent_name] = prompt_text
-                    else:
-                        logger.warning(f"No 'completion' field found in first line of {prompt_file}")
-        except json.JSONDecodeError:
-            logger.error(f"Error decoding JSON from first line of {prompt_file}")
+            create_services()
+            break
         except Exception as e:
-            logger.error(f"Error loading prompt for {agent_name} from {prompt_file}: {str(e)}")
-    
-    logger.info(f"Loaded prompts for agents: {list(prompts.keys())}")
-    return prompts
+            logger.critical(f"Failed to initialize services, retrying in {delay}s: {str(e)}", exc_info=True)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 300)
 
-AGENT_PROMPTS = load_prompts()
+    warmup_manager.start(huggingface_client)
 
 # Consolidated startup event handler
 @app.on_event("startup")
 async def initialize_services():
-    """Initialize services like the Hugging Face client and Agent Manager on startup."""
-    global huggingface_client, agent_manager
-    try:
-        logger.info("Initializing Hugging Face client...")
-        hf_api_key = os.getenv("HUGGINGFACE_API_KEY")
-        if not hf_api_key:
-            logger.error("HUGGINGFACE_API_KEY environment variable is not set")
-            raise ValueError("HUGGINGFACE_API_KEY environment variable is not set")
-
-        huggingface_client = HuggingFaceClient(api_key=hf_api_key)
-        logger.info("Hugging Face client created. Testing connection...")
-
-        # Test the connection asynchronously
-        await huggingface_client.create_chat_completion(
-            messages=[{"role": "user", "content": "Connection test"}],
-            max_tokens=5
-        )
-        logger.info("Successfully connected to Hugging Face API")
-
-    except Exception as e:
-        logger.critical(f"Failed to initialize Hugging Face client: {str(e)}", exc_info=True)
-        # Depending on severity, you might want to prevent the app from starting fully
-        # For now, we log critical and agent_manager will remain None
-        huggingface_client = None # Ensure it's None if init failed
-
+    """Start service initialization and model warm-up in the background so startup never blocks on a cold model."""
+    app.state.init_task = asyncio.create_task(initialize_with_retry())
+
+    # Fetch Google's signing keys ahead of the first sign-in
+    google_key_set.start()
+    job_manager.start()
+    brownout_controller.start()
+
+@app.on_event("shutdown")
+async def shutdown_services():
+    """Stop background warm-up and release the upstream connection pool on shutdown."""
+    app.state.init_task.cancel()
+    warmup_manager.stop()
+    job_manager.stop()
+    brownout_controller.stop()
+    await google_key_set.aclose()
     if huggingface_client:
-        try:
-            logger.info("Initializing Agent Manager...")
-            agent_manager = AgentManager(huggingface_client, AGENT_PROMPTS)
-            logger.info("Agent Manager initialized successfully")
-        except Exception as e:
-            logger.critical(f"Failed to initialize Agent Manager: {str(e)}", exc_info=True)
-            agent_manager = None # Ensure it's None if init failed
-    else:
-        logger.critical("Agent Manager cannot be initialized because Hugging Face client failed to initialize.")
-
-    # Start heartbeat task regardless of client/manager status
-    asyncio.create_task(manager.send_heartbeat())
+        await huggingface_client.aclose()
 
 # Authentication endpoints
 @app.post("/api/auth/google", response_model=TokenResponse)
@@ -265,163 +261,111 @@ async def get_agent_manager():
         raise HTTPException(status_code=503, detail="AI service is currently unavailable. Please try again later.")
     return agent_manager
 
+# Header carrying the client's time budget for a seminar, in seconds
+DEADLINE_HEADER = "X-Request-Timeout"
+
+def seminar_deadline(http_request: Request) -> Deadline:
+    """The seminar's deadline: the client's budget (capped) or the configured default"""
+    try:
+        return request_deadline(http_request.headers.get(DEADLINE_HEADER))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{DEADLINE_HEADER}: {str(e)}")
+
+async def seminar_admission(http_request: Request, deadline: Deadline = Depends(seminar_deadline)):
+    """Hold an admission slot for the lifetime of a seminar request, or shed it early with 503"""
+    lane = AUTHENTICATED if rate_limit_key(http_request)[0] == "user" else ANONYMOUS
+    try:
+        # Queueing for a slot counts against the seminar's deadline
+        async with admission_controller.admit(lane, deadline):
+            yield
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=503,
+            detail="The service is busy. Please try again shortly.",
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
+
+def reserve_quota(http_request: Request, estimated_tokens: int) -> QuotaReservation:
+    """Charge a request's estimated token cost against the caller's quota, or reject with 429"""
+    kind, key = rate_limit_key(http_request)
+    try:
+        return quota_engine.reserve(kind, key, estimated_tokens)
+    except QuotaExceededError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"{str(e)}. Please try again later.",
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
+
 # Seminar endpoints - require authentication and initialized agent_manager
+def build_seminar_runner(runner_class, request: SeminarRequest, am: AgentManager,
+                         deadline: Optional[Deadline] = None) -> SeminarRunner:
+    """Set up a seminar from a request, under the current brownout policy and within `deadline`"""
+    # Use conversation ID if provided, otherwise generate a new one
+    conversation_id = request.conversation_id or str(uuid.uuid4())
+    # Under brownout the panel, rounds and completion length shrink; the snapshot covers the whole run
+    return runner_class(am, conversation_id, request.question, request.agent_ids, request.direct_mention,
+                        RoundPolicy(request.auto_conversation, request.max_rounds), brownout_controller.current_policy(),
+                        deadline=deadline)
+
+async def seminar_events(runner: SeminarRunner, reservation: QuotaReservation):
+    """A seminar's events for a streaming response, ending with a summary shaped like the non-streaming response"""
+    try:
+        # A newer question in the conversation, or deleting it, cancels the stream's remaining work
+        async for event in conversation_tasks.stream(runner.conversation_id, runner.run()):
+            yield event
+        yield dict(runner.summary(), type="seminar_summary")
+    except SeminarCancelled as e:
+        yield {"type": "seminar_cancelled", "reason": e.reason, "answers": len(runner.answers)}
+    except SeminarFailed as e:
+        yield {"type": "seminar_failed", "error": str(e)}
+    except Exception as e:
+        logger.error(f"Error in streamed seminar {runner.conversation_id}: {str(e)}")
+        yield {"type": "seminar_failed", "error": "An unexpected error occurred. Please try again later."}
+    finally:
+        quota_engine.reconcile(reservation, total_usage(runner.answers))
+
 @app.post("/seminar")
 async def create_seminar(
     request: SeminarRequest,
+    http_request: Request,
     current_user: TokenData = Depends(get_current_user),
-    am: AgentManager = Depends(get_agent_manager)
+    am: AgentManager = Depends(get_agent_manager),
+    _slot: None = Depends(seminar_admission),
+    deadline: Deadline = Depends(seminar_deadline),
+    run_async: bool = Query(False, alias="async")
 ):
+    runner = build_seminar_runner(SeminarRunner, request, am, deadline)
+    conversation_id = runner.conversation_id
+    policy = runner.degradation
+    # Charge the worst-case token cost up front: every agent once, then 2-3 agents per extra round
+    reservation = reserve_quota(http_request, runner.estimated_tokens())
+    if run_async:
+        # Jobs are for long runs: only a budget the client asked for applies to them
+        if not http_request.headers.get(DEADLINE_HEADER):
+            runner.deadline = None
+        return submit_seminar_job(f"user:{current_user.id}", runner, reservation)
     try:
         logger.info(f"Processing seminar request with input: {request.question[:50]}...")
-        
-        # Use conversation ID if provided, otherwise generate a new one
-        conversation_id = request.conversation_id or str(uuid.uuid4())
         logger.info(f"Using conversation ID: {conversation_id}")
-        
-        # Initial user message
-        conversation_context = [{"role": "user", "content": request.question, "agent": "user"}]
-        
-        # If a specific agent is mentioned, prioritize getting their response first
-        agent_ids = request.agent_ids.copy()
-        if request.direct_mention and request.direct_mention in agent_ids:
-            # Move the mentioned agent to the beginning of the list
-            agent_ids.remove(request.direct_mention)
-            agent_ids.insert(0, request.direct_mention)
-            logger.info(f"Direct mention detected for agent: {request.direct_mention}")
-        
-        # Get first round of responses from all agents
-        initial_responses = await am.get_multiple_responses(
-            agent_ids, 
-            request.question,
-            conversation_id
-        )
-        
-        all_responses = initial_responses.copy()
-        
-        # Store all responses in conversation context
-        for response in initial_responses:
-            agent_name = response["agent"]
-            response_text = response["response"]
-            conversation_context.append({
-                "role": "assistant", 
-                "content": f"{agent_name}: {response_text}",
-                "agent": agent_name
-            })
-        
-        # If auto_conversation is enabled, continue the conversation for max_rounds
-        if request.auto_conversation and len(request.agent_ids) > 1:
-            logger.info(f"Auto-conversation enabled for {request.max_rounds} rounds with {len(request.agent_ids)} agents")
-            
-            try:
-                for round_num in range(1, request.max_rounds):
-                    logger.info(f"Starting round {round_num + 1}")
-                    
-                    # In each round, randomly select a subset of agents to respond
-                    # This makes the conversation more natural (not everyone responds to everything)
-                    responding_agents = request.agent_ids.copy()
-                    
-                    # If we have more than 3 agents, randomly select a subset for each round
-                    # to make the conversation more natural
-                    if len(responding_agents) > 3:
-                        # Select 2-3 agents randomly
-                        num_to_select = min(random.randint(2, 3), len(responding_agents))
-                        responding_agents = random.sample(responding_agents, num_to_select)
-                    
-                    logger.info(f"Selected {len(responding_agents)} agents to respond in round {round_num + 1}")
-                    
-                    # If there's a direct mention, ensure those responses reference the mentioned agent
-                    mentioned_agent_context = ""
-                    if request.direct_mention and round_num == 0:
-                        # Find the response from the directly mentioned agent
-                        mentioned_response = next((r for r in all_responses if r["agent"] == request.direct_mention), None)
-                        if mentioned_response:
-                            mentioned_agent_context = f"\n\nMake sure to reference the points made by {request.direct_mention.replace('_', ' ').title()} in your response."
-                    
-                    for agent_id in responding_agents:
-                        # Skip the directly mentioned agent in subsequent rounds if it was mentioned in the first round
-                        if round_num == 0 and request.direct_mention and agent_id == request.direct_mention:
-                            continue
-                            
-                        try:
-                            # Build context for this agent
-                            agent_context = build_agent_context(conversation_context, agent_id)
-                            logger.debug(f"Built context for agent {agent_id} in round {round_num + 1}")
-                            
-                            # Generate prompt for continuing the conversation
-                            agent_name = agent_id.replace("_", " ").title()
-                            other_agents = [aid for aid in request.agent_ids if aid != agent_id]
-                            other_agent_names = [aid.replace("_", " ").title() for aid in other_agents]
-                            
-                            # Create a reference to other agents for the prompt
-                            agents_reference = ""
-                            if other_agent_names:
-                                if len(other_agent_names) == 1:
-                                    agents_reference = f"You may directly address {other_agent_names[0]} by name in your response."
-                                else:
-                                    formatted_names = ", ".join(other_agent_names[:-1]) + f" and {other_agent_names[-1]}"
-                                    agents_reference = f"You may directly address any of these participants by name in your response: {formatted_names}."
-                            
-                            # Improved prompt for more selective, focused replies
-                            continue_prompt = (
-                                f"You are {agent_name} in a group chat. Please respond to the ongoing discussion ONLY IF you have a valuable perspective or can challenge an idea constructively. "
-                                f"{agents_reference}\n\n"
-                                f"Be selective about which points you address - you don't need to respond to everything. "
-                                f"When appropriate, address specific agents by name. Keep your response brief and focused on making a single strong point. "
-                                f"Your response should be 2-3 short paragraphs at most.{mentioned_agent_context}"
-                            )
-                            
-                            # Get response for this agent
-                            logger.debug(f"Getting response for agent {agent_id} in round {round_num + 1}")
-                            response = await am.get_response(
-                                agent_id,
-                                continue_prompt,
-                                conversation_id,
-                                include_context=False,  # We're providing custom context
-                                custom_context=agent_context
-                            )
-                            
-                            # Add to all responses
-                            all_responses.append(response)
-                            
-                            # Add to conversation context
-                            conversation_context.append({
-                                "role": "assistant", 
-                                "content": f"{agent_id}: {response['response']}",
-                                "agent": agent_id
-                            })
-                            logger.debug(f"Added response for agent {agent_id} in round {round_num + 1}")
-                            
-                            # Add small random delay between responses to make it feel more natural
-                            await asyncio.sleep(random.uniform(0.5, 1.5))
-                            
-                        except Exception as agent_error:
-                            logger.error(f"Error processing agent {agent_id} in round {round_num + 1}: {str(agent_error)}")
-                            # Continue with other agents
-                    
-                # Add final message
-                all_responses.append({
-                    "agent": "system",
-                    "response": "The discussion has concluded. You may now respond or ask a follow-up question.",
-                    "model": "system",
-                    "conversation_id": conversation_id
-                })
-                logger.info(f"Auto-conversation completed with {len(all_responses)} total responses")
-            except Exception as auto_convo_error:
-                logger.error(f"Error in auto-conversation: {str(auto_convo_error)}")
-                # We'll still return the initial responses even if auto-conversation fails
-        
-        if all_responses:
-            logger.info(f"Successfully generated {len(all_responses)} responses")
-            return {"conversation_id": conversation_id, "answers": all_responses}
-        else:
-            raise HTTPException(status_code=500, detail="Failed to get any valid responses")
-            
+        if policy.level:
+            logger.info(f"Brownout level {policy.level}: {len(runner.agent_ids)} agent(s), {runner.follow_up_rounds()} follow-up round(s)")
+
+        # Cancelled if the client disconnects or a newer question supersedes it
+        await conversation_tasks.run(conversation_id, runner.run_to_end(), http_request)
+
+        logger.info(f"Successfully generated {len(runner.transcript())} responses")
+        if request.speculate and not runner.partial:
+            speculation_manager.schedule(am, conversation_id, CONTINUE_QUESTION, runner.agent_ids, runner.degradation)
+        return runner.summary()
+
+    except SeminarCancelled as e:
+        return seminar_cancelled_response(e, runner.summary())
     except Exception as e:
         logger.error(f"Unexpected error in create_seminar: {str(e)}",
                     extra={"error_type": type(e).__name__,
                           "conversation_id": request.conversation_id})
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=500,
             content={
                 "error": True,
@@ -429,47 +373,175 @@ async def create_seminar(
                 "conversation_id": request.conversation_id
             }
         )
+    finally:
+        quota_engine.reconcile(reservation, total_usage(runner.answers))
 
-# Helper function to build conversation context for an agent
-def build_agent_context(conversation_context, agent_id):
-    # Format the conversation context for the agent
-    formatted_context = "Previous conversation:\n\n"
-    
-    for message in conversation_context:
-        role = message.get("agent", message.get("role", "unknown"))
-        content = message.get("content", "")
-        formatted_context += f"{role.title()}: {content}\n\n"
-    
-    return formatted_context
+def seminar_cancelled_response(cancelled: SeminarCancelled, partial: Dict[str, Any]):
+    """409 with the answers given before the seminar was cancelled"""
+    logger.info(f"Seminar in conversation {partial['conversation_id']} cancelled: {cancelled.reason}")
+    return FastJSONResponse(status_code=409, content=dict(partial, cancelled=True, reason=cancelled.reason))
+
+def submit_seminar_job(owner: str, runner: SeminarRunner, reservation: QuotaReservation):
+    """Hand a seminar to the background workers and answer 202 with where to follow it"""
+    try:
+        job = job_manager.submit(owner, runner, reservation)
+    except JobRejected as e:
+        quota_engine.reconcile(reservation, 0)
+        raise HTTPException(
+            status_code=429,
+            detail=f"{str(e)}. Please try again later.",
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
+    content = dict(job.to_dict(),
+                   status_url=f"/jobs/{job.id}",
+                   result_url=f"/jobs/{job.id}/result",
+                   events_url=f"/jobs/{job.id}/events")
+    return FastJSONResponse(status_code=202, content=content, headers={"Location": f"/jobs/{job.id}"})
+
+def get_job(job_id: str, current_user: TokenData = Depends(get_current_user)) -> SeminarJob:
+    """The caller's job, or 404 (other users' jobs are not revealed)"""
+    job = job_manager.get(job_id, f"user:{current_user.id}")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job: SeminarJob = Depends(get_job)):
+    """Status and progress of a seminar job"""
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job: SeminarJob = Depends(get_job)):
+    """The finished seminar, shaped like the /seminar response; 202 while it is still running"""
+    if job.status == SUCCEEDED:
+        return job.runner.summary()
+    if job.status == FAILED:
+        return FastJSONResponse(status_code=500, content=dict(job.to_dict(), error=True, message=job.error))
+    if job.status == CANCELLED:
+        return FastJSONResponse(status_code=409, content=job.to_dict())
+    return FastJSONResponse(status_code=202, content=job.to_dict(), headers={"Retry-After": "2"})
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(http_request: Request, job: SeminarJob = Depends(get_job)):
+    """A job's events as Server-Sent Events (or NDJSON), from the start or after Last-Event-ID"""
+    last_event_id = http_request.headers.get("last-event-id", "")
+    after = int(last_event_id) if last_event_id.isdigit() else 0
+    return stream_response(http_request, job.follow(after), first_id=after + 1)
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job: SeminarJob = Depends(get_job)):
+    """Cancel a queued or running seminar job"""
+    job_manager.cancel(job)
+    return job.to_dict()
+
+@app.post("/seminar/stream")
+async def stream_seminar(
+    request: SeminarRequest,
+    http_request: Request,
+    current_user: TokenData = Depends(get_current_user),
+    am: AgentManager = Depends(get_agent_manager),
+    _slot: None = Depends(seminar_admission),
+    deadline: Deadline = Depends(seminar_deadline)
+):
+    """/seminar as Server-Sent Events (or NDJSON): each answer is sent as soon as it completes"""
+    runner = build_seminar_runner(SeminarRunner, request, am, deadline)
+    reservation = reserve_quota(http_request, runner.estimated_tokens())
+    logger.info(f"Streaming seminar {runner.conversation_id} with input: {request.question[:50]}...")
+    return stream_response(http_request, seminar_events(runner, reservation))
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+def build_batch_items(request: BatchSeminarRequest) -> List[BatchItem]:
+    """Resolve each item's panel; raises 400 for an oversized batch or an item without agents"""
+    if not request.items or len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch must have between 1 and {BATCH_MAX_ITEMS} items")
+    panels = request.panels or {}
+    items = []
+    for index, item in enumerate(request.items):
+        agent_ids = item.agent_ids or panels.get(item.panel or "")
+        if not agent_ids:
+            raise HTTPException(status_code=400, detail=f"Item {index} needs agent_ids or a known panel")
+        items.append(BatchItem(index, item.question, agent_ids, item.id, bool(item.auto_conversation),
+                               item.max_rounds or 3, item.direct_mention))
+    return items
+
+async def batch_events(am: AgentManager, items: List[BatchItem], concurrency: Optional[int], quota_key):
+    """Each item's result as it completes, then the batch's aggregate statistics"""
+    stats = BatchStats()
+    async for result in batch_scheduler.run(am, items, concurrency, quota_key):
+        stats.add(result)
+        yield dict(result, type="item_result")
+    summary = stats.to_dict()
+    logger.info(f"Batch of {summary['items']} finished in {summary['elapsed']}s ({summary['failed']} failed)")
+    yield dict(summary, type="batch_summary")
+
+@app.post("/seminar/batch")
+async def seminar_batch(
+    request: BatchSeminarRequest,
+    http_request: Request,
+    current_user: TokenData = Depends(get_current_user),
+    am: AgentManager = Depends(get_agent_manager)
+):
+    """
+    Run many seminars in one request, streaming NDJSON results as items complete.
+    Counts once against the rate limit; each item is charged against the token quota.
+    """
+    items = build_batch_items(request)
+    logger.info(f"Starting batch of {len(items)} seminars for user {current_user.id}")
+    return stream_response(http_request, batch_events(am, items, request.concurrency, ("user", f"user:{current_user.id}")),
+                           media_type=NDJSON_MEDIA_TYPE)
 
 @app.post("/continue")
 async def continue_conversation(
     request: ContinueRequest,
-    am: AgentManager = Depends(get_agent_manager)
+    http_request: Request,
+    am: AgentManager = Depends(get_agent_manager),
+    _slot: None = Depends(seminar_admission),
+    deadline: Deadline = Depends(seminar_deadline)
 ):
+    # Create a contextual prompt if no new question is provided
+    question = request.question
+    if not question:
+        question = CONTINUE_QUESTION
+
+    policy = brownout_controller.current_policy()
+    agent_ids = policy.limit_agents(request.agent_ids)
+    reservation = reserve_quota(http_request, estimate_seminar_tokens(question, agent_ids))
+    responses = []
     try:
         logger.info(f"Processing continue request for conversation: {request.conversation_id}")
-        
-        # Create a contextual prompt if no new question is provided
-        question = request.question
-        if not question:
-            question = "Please continue the discussion, building on the previous exchanges."
             
-        # Get responses from agents
-        responses = await am.get_multiple_responses(
-            request.agent_ids,
-            question,
-            request.conversation_id
-        )
-        
-        if responses:
-            return {"answers": responses, "conversation_id": request.conversation_id}
+        # A round generated speculatively for exactly this request is served straight away;
+        # any other request in the conversation discards it. Registered without superseding, so
+        # the speculation being waited on is left running
+        responses = await conversation_tasks.run(request.conversation_id, speculation_manager.claim(
+            request.conversation_id, question, agent_ids, deadline), http_request, supersede=False)
+        if responses is None:
+            # Get responses from agents
+            with deadline_scope(deadline):
+                responses = await conversation_tasks.run(request.conversation_id, am.get_multiple_responses(
+                    agent_ids,
+                    question,
+                    request.conversation_id,
+                    degradation=policy
+                ), http_request)
+        if request.speculate and responses and not deadline.expired:
+            speculation_manager.schedule(am, request.conversation_id, CONTINUE_QUESTION, agent_ids, policy)
+        
+        # Out of time, whatever answered is returned rather than an error
+        if responses or deadline.expired:
+            return {"answers": responses, "conversation_id": request.conversation_id, "degradation_level": policy.level,
+                    "partial": len(responses) < len(agent_ids) and deadline.expired}
         else:
             raise HTTPException(status_code=500, detail="Failed to get any valid responses")
-            
+
+    except SeminarCancelled as e:
+        return seminar_cancelled_response(e, {"answers": [], "conversation_id": request.conversation_id})
     except Exception as e:
         logger.error(f"Error in continue: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        quota_engine.reconcile(reservation, total_usage(responses))
 
 @app.get("/api/agents", response_model=List[Dict[str, Any]])
 async def get_available_agents(am: AgentManager = Depends(get_agent_manager)):
@@ -558,6 +630,9 @@ async def configure_agent(request: AgentConfigRequest):
 async def delete_conversation(conversation_id: str):
     """Delete a conversation from memory."""
     try:
+        # Nobody will read the answers of a seminar still running in it
+        conversation_tasks.cancel(conversation_id, DELETED)
+        speculation_manager.discard(conversation_id)
         memory_manager.clear_conversation(conversation_id)
         return {"status": "success", "message": f"Conversation {conversation_id} deleted"}
     except Exception as e:
@@ -568,97 +643,24 @@ async def delete_conversation(conversation_id: str):
 @app.post("/public/seminar")
 async def create_public_seminar(
     request: SeminarRequest,
-    am: AgentManager = Depends(get_agent_manager)
+    http_request: Request,
+    am: AgentManager = Depends(get_agent_manager),
+    _slot: None = Depends(seminar_admission),
+    deadline: Deadline = Depends(seminar_deadline)
 ):
+    runner = build_seminar_runner(PublicSeminarRunner, request, am, deadline)
+    # Charge the worst-case token cost up front: every agent answers in every round
+    reservation = reserve_quota(http_request, runner.estimated_tokens())
     try:
         logger.info(f"Processing public seminar request with input: {request.question[:50]}...")
+        logger.info(f"Using conversation ID: {runner.conversation_id}")
+
+        await conversation_tasks.run(runner.conversation_id, runner.run_to_end(), http_request)
         
-        # Use conversation ID if provided, otherwise generate a new one
-        conversation_id = request.conversation_id or str(uuid.uuid4())
-        logger.info(f"Using conversation ID: {conversation_id}")
-        
-        # Initial user message
-        conversation_context = [{"role": "user", "content": request.question, "agent": "user"}]
-        
-        # If a specific agent is mentioned, prioritize getting their response first
-        agent_ids = request.agent_ids.copy()
-        if request.direct_mention and request.direct_mention in agent_ids:
-            # Move the mentioned agent to the beginning of the list
-            agent_ids.remove(request.direct_mention)
-            agent_ids.insert(0, request.direct_mention)
-            logger.info(f"Direct mention detected for agent: {request.direct_mention}")
-        
-        # Get first round of responses from all agents
-        initial_responses = await am.get_multiple_responses(
-            agent_ids, 
-            request.question, 
-            conversation_id
-        )
-        
-        for resp in initial_responses:
-            conversation_context.append({
-                "role": "assistant", 
-                "content": resp["response"], 
-                "agent": resp["agent"]
-            })
-        
-        # If auto conversation is enabled, simulate an agent discussion
-        additional_rounds = []
-        if request.auto_conversation and len(agent_ids) > 1:
-            max_rounds = min(request.max_rounds, 5)  # Cap at 5 to prevent abuse
-            logger.info(f"Auto conversation enabled, generating {max_rounds} rounds")
-            
-            current_round = 0
-            while current_round < max_rounds:
-                current_round += 1
-                logger.info(f"Generating round {current_round} of auto conversation")
-                
-                round_responses = []
-                for i, agent_id in enumerate(agent_ids):
-                    # Prepare context from previous messages
-                    agent_context = "\n\n".join([
-                        f"{ctx['agent']}: {ctx['content']}" 
-                        for ctx in conversation_context
-                    ])
-                    
-                    # Formulate a question based on the context
-                    meta_prompt = f"""
-                    Based on this ongoing conversation, what would be an interesting and relevant point for you 
-                    to add as {agent_id}? It should be in response to what others have said.
-                    
-                    Conversation so far:
-                    {agent_context}
-                    """
-                    
-                    # Get the response from the agent
-                    response = await am.get_response(
-                        agent_id,
-                        meta_prompt,
-                        conversation_id,
-                        include_context=False  # We're providing our own context
-                    )
-                    
-                    round_responses.append(response)
-                    
-                    # Add to the overall conversation context
-                    conversation_context.append({
-                        "role": "assistant",
-                        "content": response["response"],
-                        "agent": response["agent"]
-                    })
-                
-                additional_rounds.append(round_responses)
-                
-                # Small delay to prevent rate limiting
-                await asyncio.sleep(0.5)
-        
-        return {
-            "question": request.question,
-            "conversation_id": conversation_id,
-            "responses": initial_responses,
-            "additional_rounds": additional_rounds
-        }
-        
+        return runner.summary()
+
+    except SeminarCancelled as e:
+        return seminar_cancelled_response(e, runner.summary())
     except Exception as e:
         logger.error(f"Error in public seminar request: {str(e)}")
         logger.error(f"Full error details: {repr(e)}")
@@ -666,24 +668,49 @@ async def create_public_seminar(
             status_code=500,
             detail=f"Error processing request: {str(e)}"
         )
+    finally:
+        quota_engine.reconcile(reservation, total_usage(runner.answers))
+
+@app.post("/public/seminar/stream")
+async def stream_public_seminar(
+    request: SeminarRequest,
+    http_request: Request,
+    am: AgentManager = Depends(get_agent_manager),
+    _slot: None = Depends(seminar_admission),
+    deadline: Deadline = Depends(seminar_deadline)
+):
+    """/public/seminar as Server-Sent Events (or NDJSON): each answer is sent as soon as it completes"""
+    runner = build_seminar_runner(PublicSeminarRunner, request, am, deadline)
+    reservation = reserve_quota(http_request, runner.estimated_tokens())
+    logger.info(f"Streaming public seminar {runner.conversation_id} with input: {request.question[:50]}...")
+    return stream_response(http_request, seminar_events(runner, reservation))
 
 # Anonymous continue conversation endpoint
 @app.post("/public/continue")
 async def continue_public_conversation(
     request: ContinueRequest,
-    am: AgentManager = Depends(get_agent_manager)
+    http_request: Request,
+    am: AgentManager = Depends(get_agent_manager),
+    _slot: None = Depends(seminar_admission),
+    deadline: Deadline = Depends(seminar_deadline)
 ):
+    policy = brownout_controller.current_policy()
+    agent_ids = policy.limit_agents(request.agent_ids)
+    reservation = reserve_quota(http_request, estimate_seminar_tokens(request.question or "", agent_ids))
+    responses = []
     try:
         logger.info(f"Continuing public conversation {request.conversation_id}")
         
         # Get responses from all agents
         if request.question:
             # If a new question is provided
-            responses = await am.get_multiple_responses(
-                request.agent_ids,
-                request.question,
-                request.conversation_id
-            )
+            with deadline_scope(deadline):
+                responses = await conversation_tasks.run(request.conversation_id, am.get_multiple_responses(
+                    agent_ids,
+                    request.question,
+                    request.conversation_id,
+                    degradation=policy
+                ), http_request)
         else:
             # If no new question, use the last exchange
             conversation = memory_manager.get_conversation(request.conversation_id)
@@ -706,23 +733,31 @@ async def continue_public_conversation(
                     detail="No previous user message found"
                 )
             
-            responses = await am.get_multiple_responses(
-                request.agent_ids,
-                last_user_message,
-                request.conversation_id
-            )
+            with deadline_scope(deadline):
+                responses = await conversation_tasks.run(request.conversation_id, am.get_multiple_responses(
+                    agent_ids,
+                    last_user_message,
+                    request.conversation_id,
+                    degradation=policy
+                ), http_request)
         
         return {
             "conversation_id": request.conversation_id,
-            "responses": responses
+            "responses": responses,
+            "degradation_level": policy.level,
+            "partial": len(responses) < len(agent_ids) and deadline.expired
         }
         
+    except SeminarCancelled as e:
+        return seminar_cancelled_response(e, {"conversation_id": request.conversation_id, "responses": []})
     except Exception as e:
         logger.error(f"Error in continue public conversation: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"Error processing request: {str(e)}"
         )
+    finally:
+        quota_engine.reconcile(reservation, total_usage(responses))
 
 # Anonymous available agents endpoint
 @app.get("/public/agents")
@@ -749,52 +784,87 @@ async def huggingface_exception_handler(request: Request, exc: HuggingFaceError)
          error_response = {"error": True, "message": "AI Service Error", "status_code": 503}
 
     status_code = getattr(exc, 'status_code', 500)
-    return JSONResponse(
+    headers = {"Retry-After": str(math.ceil(exc.retry_after))} if exc.retry_after is not None else None
+    return FastJSONResponse(
         status_code=status_code,
-        content=error_response
+        content=error_response,
+        headers=headers
     )
 
-# Simple debug endpoint to check if server is working
-@app.get("/debug")
-async def debug_endpoint():
-    """Simple endpoint to check if the server is working"""
-    global huggingface_client, agent_manager
-    hf_status = "Initialized" if huggingface_client else "Failed"
-    am_status = "Initialized" if agent_manager else "Failed"
-    return {
-        "status": "ok",
-        "message": "Server is running",
-        "huggingface_client_status": hf_status,
-        "agent_manager_status": am_status,
+# Health probes
+@app.get("/health/live")
+async def liveness_probe():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "ok", "timestamp": datetime.utcnow().isoformat()}
+
+@app.get("/health/ready")
+async def readiness_probe():
+    """Readiness: services are initialized and every configured model has answered"""
+    ready = agent_manager is not None and warmup_manager.is_ready()
+    content = {
+        "status": "ready" if ready else "not_ready",
+        "agent_manager_initialized": agent_manager is not None,
+        "models": warmup_manager.report(),
+        "circuits": huggingface_client.circuit_states() if huggingface_client else {},
+        "brownout_level": brownout_controller.level,
         "timestamp": datetime.utcnow().isoformat()
     }
+    return FastJSONResponse(status_code=200 if ready else 503, content=content)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Export in-process counters and gauges"""
+    return metrics.snapshot()
+
+async def serve_websocket(websocket: WebSocket, session: CommandSession) -> None:
+    """Read client frames until disconnect: subscriptions and pings first, then seminar commands"""
+    while True:
+        data = await manager.receive(websocket)  # Enforces the idle deadline
+        try:
+            message = manager.decode(websocket, data)
+        except ValueError as e:
+            manager.send_to(websocket, {"type": "error", "error": str(e)})
+            continue
+        if not isinstance(message, dict):
+            manager.send_to(websocket, {"type": "error", "error": "Messages must be objects"})
+        elif not await manager.handle_control(websocket, message) and not await session.handle(message):
+            manager.send_to(websocket, {"type": "error", "error": "Unsupported message type"})
+
+# Multiplexed WebSocket endpoint: one connection, many conversation subscriptions
+@app.websocket("/ws")
+async def multiplexed_websocket_endpoint(websocket: WebSocket):
+    """Clients subscribe to conversations and drive seminars with command messages"""
+    await manager.accept(websocket)
+    session = CommandSession(websocket, lambda: agent_manager)
+    try:
+        await serve_websocket(websocket, session)
+    except WebSocketDisconnect:
+        logger.info("Multiplexed WebSocket client disconnected")
+    except Exception as e:
+        logger.error(f"Error in multiplexed WebSocket connection: {str(e)}")
+        if websocket.client_state == WebSocketState.CONNECTED:
+            await websocket.close(code=1011)  # Internal server error
+    finally:
+        await manager.disconnect(websocket)
 
 # WebSocket endpoint for real-time updates
 @app.websocket("/ws/{conversation_id}")
 async def websocket_endpoint(websocket: WebSocket, conversation_id: str):
     """WebSocket endpoint for real-time conversation updates"""
     logger.info(f"WebSocket connection request received for conversation {conversation_id}")
-    await manager.connect(websocket, conversation_id)
+    # A reconnecting client passes the last sequence number it saw and is sent only what it missed
+    last_seq = websocket.query_params.get("last_seq")
+    await manager.connect(websocket, conversation_id, int(last_seq) if last_seq and last_seq.isdigit() else None)
+    session = CommandSession(websocket, lambda: agent_manager, default_conversation_id=conversation_id)
     try:
-        while True:
-            # Keep the connection alive
-            data = await websocket.receive_text() # Use receive_text for flexibility, parse JSON manually
-            logger.debug(f"Received WebSocket message: {data}")
-            
-            # Handle different message types from client
-            if data.get("type") == "ping":
-                logger.info(f"Sending pong response to conversation {conversation_id}")
-                await websocket.send_json({"type": "pong", "timestamp": datetime.utcnow().isoformat()})
-            
-            # You can handle other client-to-server messages here
-            
+        await serve_websocket(websocket, session)
     except WebSocketDisconnect:
         logger.info(f"WebSocket client disconnected from conversation {conversation_id}")
-        await manager.disconnect(websocket, conversation_id)
     except Exception as e:
         logger.error(f"Error in WebSocket connection: {str(e)}")
         if websocket.client_state == WebSocketState.CONNECTED:
             await websocket.close(code=1011)  # Internal server error
+    finally:
         await manager.disconnect(websocket, conversation_id)
 
 # Update the chat endpoint to use Hugging Face and Agent Manager dependency
@@ -813,11 +883,14 @@ async def chat(request: ChatRequest, hf_client: HuggingFaceClient = Depends(get_
     except Exception as e:
         logger.error(f"Unexpected error in chat endpoint: {str(e)}", exc_info=True)
         # Use a standard 500 response format
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=500,
             content={"error": True, "message": "An unexpected server error occurred."}
         )
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8002) 
\ No newline at end of file
+    # Protocol-level pings detect dead sockets without involving the application
+    uvicorn.run(app, host="0.0.0.0", port=8002,
+                ws_ping_interval=float(os.getenv("WS_PING_INTERVAL", "20")),
+                ws_ping_timeout=float(os.getenv("WS_PING_TIMEOUT", "20"))) 
\ No newline at end of file
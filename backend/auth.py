@@ -2,14 +2,16 @@ import os
 import jwt
 import json
 import time
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
-import httpx
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 import logging
 
+from google_auth import google_key_set
+from metrics import metrics
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,6 +24,14 @@ JWT_EXPIRATION_SECONDS = 86400  # 24 hours
 # Google OAuth configurations
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "")
 
+# Verified access tokens kept in memory
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+# Rejected tokens are remembered this long, so retries are neither decoded nor logged again
+REJECTED_TOKEN_TTL = float(os.getenv("AUTH_REJECTED_TOKEN_TTL", "60"))
+
+TOKEN_EXPIRED = "Token has expired"
+INVALID_CREDENTIALS = "Invalid authentication credentials"
+
 # Security scheme for JWT
 security = HTTPBearer()
 
@@ -45,38 +55,62 @@ class TokenResponse(BaseModel):
     token: str
     user: UserResponse
 
+class TokenCache:
+    """
+    LRU of already-verified access tokens; an entry is dropped once its token expires.
+    Rejected tokens are kept separately, with the reason, for a short while.
+    """
+    def __init__(self, max_entries: int, rejected_ttl: float):
+        self.max_entries = max_entries
+        self.rejected_ttl = rejected_ttl
+        self.entries: "OrderedDict[str, TokenData]" = OrderedDict()
+        # Structure: {token: (401 detail, monotonic time the entry lapses)}
+        self.rejected: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def get(self, token: str) -> Optional["TokenData"]:
+        token_data = self.entries.get(token)
+        if token_data is None:
+            return None
+        if time.time() >= token_data.exp:
+            del self.entries[token]
+            return None
+        self.entries.move_to_end(token)
+        return token_data
+
+    def put(self, token: str, token_data: "TokenData") -> None:
+        self.entries[token] = token_data
+        self.entries.move_to_end(token)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def rejection(self, token: str) -> Optional[str]:
+        """Why the token was rejected recently, or None"""
+        rejected = self.rejected.get(token)
+        if rejected is None:
+            return None
+        if time.monotonic() >= rejected[1]:
+            del self.rejected[token]
+            return None
+        return rejected[0]
+
+    def reject(self, token: str, detail: str) -> None:
+        self.rejected[token] = (detail, time.monotonic() + self.rejected_ttl)
+        self.rejected.move_to_end(token)
+        while len(self.rejected) > self.max_entries:
+            self.rejected.popitem(last=False)
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE, REJECTED_TOKEN_TTL)
+
 async def verify_google_token(token: str) -> Dict[str, Any]:
-    """Verify the Google ID token and return user info if valid."""
+    """Verify the Google ID token locally against Google's cached signing keys and return user info."""
     try:
-        # In a production environment, use the Google API client library
-        # For simplicity, we're using httpx to validate the token
-        url = f"https://oauth2.googleapis.com/tokeninfo?id_token={token}"
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
-            
-            if response.status_code != 200:
-                logger.error(f"Failed to verify Google token: {response.text}")
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Invalid authentication credentials",
-                )
-            
-            token_info = response.json()
-            
-            # Verify the audience (client ID)
-            if GOOGLE_CLIENT_ID and token_info.get("aud") != GOOGLE_CLIENT_ID:
-                logger.error(f"Token audience mismatch: {token_info.get('aud')} != {GOOGLE_CLIENT_ID}")
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Invalid token audience",
-                )
-            
-            return {
-                "id": token_info.get("sub"),
-                "email": token_info.get("email"),
-                "name": token_info.get("name"),
-                "picture": token_info.get("picture"),
-            }
+        token_info = await google_key_set.verify(token, GOOGLE_CLIENT_ID)
+        return {
+            "id": token_info.get("sub"),
+            "email": token_info.get("email"),
+            "name": token_info.get("name"),
+            "picture": token_info.get("picture"),
+        }
     except Exception as e:
         logger.error(f"Error verifying Google token: {str(e)}")
         raise HTTPException(
@@ -87,37 +121,55 @@ async def verify_google_token(token: str) -> Dict[str, Any]:
 def create_access_token(data: Dict[str, Any]) -> str:
     """Create a JWT access token for the authenticated user."""
     payload = data.copy()
-    expiration = datetime.utcnow() + timedelta(seconds=JWT_EXPIRATION_SECONDS)
-    payload.update({"exp": expiration.timestamp()})
+    payload.update({"exp": int(time.time()) + JWT_EXPIRATION_SECONDS})
     
     return jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
 
+def verify_access_token(token: str) -> Optional[TokenData]:
+    """Return the token's claims if it is valid, from the cache when possible, else None."""
+    try:
+        return decode_access_token(token)
+    except HTTPException:
+        return None
+
 def decode_access_token(token: str) -> TokenData:
-    """Decode and validate the JWT access token."""
+    """Decode and validate the JWT access token, raising a 401 that says whether it expired."""
+    token_data = token_cache.get(token)
+    if token_data is not None:
+        metrics.increment("auth_token_cache_total", outcome="hit")
+        return token_data
+    detail = token_cache.rejection(token)
+    if detail is not None:
+        metrics.increment("auth_token_cache_total", outcome="rejected")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
+
+    metrics.increment("auth_token_cache_total", outcome="miss")
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
         token_data = TokenData(**payload)
-        
-        # Check if token is expired
-        if datetime.utcnow().timestamp() > token_data.exp:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token has expired",
-            )
-        
-        return token_data
-    except jwt.PyJWTError as e:
+    except jwt.ExpiredSignatureError:
+        detail = TOKEN_EXPIRED
+    except (jwt.PyJWTError, ValueError) as e:
         logger.error(f"JWT decode error: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-        )
+        detail = INVALID_CREDENTIALS
+    else:
+        # Check if token is expired
+        if time.time() < token_data.exp:
+            token_cache.put(token, token_data)
+            return token_data
+        detail = TOKEN_EXPIRED
+
+    token_cache.reject(token, detail)
+    raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> TokenData:
     """FastAPI dependency to get the current authenticated user."""
     try:
         token = credentials.credentials
         return decode_access_token(token)
+    except HTTPException:
+        # Already logged when the token was first rejected
+        raise
     except Exception as e:
         logger.error(f"Authentication error: {str(e)}")
         raise HTTPException(
@@ -0,0 +1,192 @@
+"""
+Batch seminars for evaluation workloads.
+Runs many questions through agent panels with bounded concurrency, reporting each
+result as soon as it completes and aggregate latency and token statistics at the end.
+Used by the /seminar/batch endpoint and by the offline runner.
+"""
+
+import os
+import math
+import time
+import uuid
+import asyncio
+import logging
+from contextlib import nullcontext
+from typing import Dict, List, Optional, Any, AsyncGenerator, Iterable, Tuple
+
+from admission import AdmissionController, admission_controller, BATCH
+from agent_manager import AgentManager
+from brownout import brownout_controller
+from memory import memory_manager
+from metrics import metrics
+from quotas import quota_engine, QuotaExceededError
+from seminar import SeminarRunner, RoundPolicy
+
+logger = logging.getLogger(__name__)
+
+class BatchItem:
+    """One question and the panel that should discuss it"""
+    def __init__(self,
+                 index: int,
+                 question: str,
+                 agent_ids: List[str],
+                 item_id: Optional[str] = None,
+                 auto_conversation: bool = False,
+                 max_rounds: int = 3,
+                 direct_mention: Optional[str] = None):
+        self.index = index
+        self.id = item_id if item_id is not None else str(index)
+        self.question = question
+        self.agent_ids = agent_ids
+        self.auto_conversation = auto_conversation
+        self.max_rounds = max_rounds
+        self.direct_mention = direct_mention
+
+def answer_usage(answers: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Prompt, completion and total tokens reported on a seminar's answers"""
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    for answer in answers:
+        for field, tokens in answer.get("usage", {}).items():
+            if field in usage:
+                usage[field] += tokens
+    return usage
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+class BatchStats:
+    """Aggregate latency and token statistics of a batch"""
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.succeeded = 0
+        self.failed = 0
+        self.latencies: List[float] = []
+        self.usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+    def add(self, result: Dict[str, Any]) -> None:
+        if result["status"] == "succeeded":
+            self.succeeded += 1
+            self.latencies.append(result["latency"])
+        else:
+            self.failed += 1
+        for field, tokens in result["usage"].items():
+            self.usage[field] += tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "items": self.succeeded + self.failed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "elapsed": round(elapsed, 3),
+            "items_per_second": round((self.succeeded + self.failed) / elapsed, 3) if elapsed else 0.0,
+            "latency": {
+                "mean": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                "p50": round(percentile(latencies, 0.5), 3),
+                "p95": round(percentile(latencies, 0.95), 3),
+                "max": round(latencies[-1], 3) if latencies else 0.0,
+            },
+            "usage": dict(self.usage,
+                          mean_per_item=round(self.usage["total_tokens"] / self.succeeded) if self.succeeded else 0),
+        }
+
+class BatchScheduler:
+    """
+    Runs batch items with at most `max_concurrency` seminars in flight across every batch
+    sharing the scheduler. With `admission`, each item also takes a batch slot there, behind
+    interactive requests, so evaluation traffic cannot crowd out interactive users.
+    """
+    def __init__(self, max_concurrency: int, admission: Optional[AdmissionController] = None):
+        self.max_concurrency = max_concurrency
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.admission = admission
+        # Longest wait for token quota before an item is failed instead
+        self.max_quota_wait = float(os.getenv("BATCH_MAX_QUOTA_WAIT", "60"))
+
+    async def run(self,
+                  am: AgentManager,
+                  items: Iterable[BatchItem],
+                  concurrency: Optional[int] = None,
+                  quota_key: Optional[Tuple[str, str]] = None) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Yield one result per item in completion order. At most `concurrency` items of this batch
+        run at once. With `quota_key` (kind, key), each item is charged against that caller's quota.
+        """
+        window = max(1, min(concurrency or self.max_concurrency, self.max_concurrency))
+        pending_items = iter(items)
+        running = set()
+        try:
+            while True:
+                # Start items lazily, so a large batch never holds more than `window` tasks
+                while len(running) < window:
+                    item = next(pending_items, None)
+                    if item is None:
+                        break
+                    running.add(asyncio.create_task(self.run_item(am, item, quota_key)))
+                if not running:
+                    return
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def run_item(self, am: AgentManager, item: BatchItem,
+                       quota_key: Optional[Tuple[str, str]] = None) -> Dict[str, Any]:
+        """Run one seminar; failures are reported in the result rather than raised"""
+        result: Dict[str, Any] = {"index": item.index, "id": item.id, "question": item.question}
+        conversation_id = str(uuid.uuid4())
+        runner = self._runner(am, item, conversation_id)
+        reservation = None
+        started = time.monotonic()
+        try:
+            # Waiting for quota happens outside the slot, so it never holds up other batches
+            if quota_key is not None:
+                reservation = await self._reserve(quota_key, runner.estimated_tokens())
+            admission = self.admission.admit(BATCH) if self.admission is not None else nullcontext()
+            async with self.slots, admission:
+                # Like an interactive seminar, the item takes the brownout level it is admitted at
+                runner = self._runner(am, item, conversation_id)
+                started = time.monotonic()
+                await runner.run_to_end()
+            result.update(status="succeeded", result=runner.summary())
+        except Exception as e:
+            logger.warning(f"Batch item {item.id} failed: {str(e)}")
+            result.update(status="failed", error=str(e))
+        finally:
+            usage = answer_usage(runner.answers)
+            if reservation is not None:
+                quota_engine.reconcile(reservation, usage["total_tokens"])
+            # Nobody continues a batch conversation, so its memory is dropped once summarised
+            memory_manager.clear_conversation(runner.conversation_id)
+        result.update(latency=round(time.monotonic() - started, 3), usage=usage)
+        metrics.increment("batch_items_total", outcome=result["status"])
+        return result
+
+    @staticmethod
+    def _runner(am: AgentManager, item: BatchItem, conversation_id: str) -> SeminarRunner:
+        return SeminarRunner(am, conversation_id, item.question, item.agent_ids, item.direct_mention,
+                             RoundPolicy(item.auto_conversation, item.max_rounds),
+                             brownout_controller.current_policy(), paced=False)
+
+    async def _reserve(self, quota_key: Tuple[str, str], tokens: int):
+        """Reserve quota, waiting for the budget to refill if that takes no longer than max_quota_wait"""
+        kind, key = quota_key
+        waited = 0.0
+        while True:
+            try:
+                return quota_engine.reserve(kind, key, tokens)
+            except QuotaExceededError as e:
+                if waited + e.retry_after > self.max_quota_wait:
+                    raise
+                await asyncio.sleep(e.retry_after)
+                waited += e.retry_after
+
+# Global batch scheduler instance, shared by all /seminar/batch requests
+batch_scheduler = BatchScheduler(int(os.getenv("BATCH_MAX_CONCURRENCY", "4")), admission_controller)
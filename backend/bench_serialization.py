@@ -0,0 +1,77 @@
+"""
+Benchmark payload encoding: the standard-library path used before (JSONResponse /
+send_json) against the fast JSON encoder and MessagePack.
+
+Usage: python bench_serialization.py [--rounds 5] [--agents 5] [--chars 1200] [--iterations 200]
+"""
+
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+import serialization
+
+def seminar_payload(rounds: int, agents: int, chars: int) -> Dict[str, Any]:
+    """A /seminar response shaped like the real one: every agent answers in every round"""
+    conversation_id = str(uuid.uuid4())
+    sentence = "The unexamined claim deserves a closer look — ¿no es así? "
+    text = (sentence * (chars // len(sentence) + 1))[:chars]
+    answers = [
+        {
+            "agent": f"agent_{agent}",
+            "response": text,
+            "model": "meta-llama/Llama-3.1-8B-Instruct",
+            "conversation_id": conversation_id,
+            "usage": {"prompt_tokens": 900, "completion_tokens": chars // 4, "total_tokens": 900 + chars // 4},
+            "degradation_level": 0,
+        }
+        for _ in range(rounds)
+        for agent in range(agents)
+    ]
+    return {"conversation_id": conversation_id, "answers": answers, "degradation_level": 0}
+
+def stdlib_json(payload: Any) -> bytes:
+    # What Starlette's JSONResponse does
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def time_encoder(encode: Callable[[Any], Any], payload: Any, iterations: int) -> Tuple[float, int]:
+    """Best-of-three mean encode time in microseconds, and encoded size in bytes"""
+    size = len(encode(payload))
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            encode(payload)
+        best = min(best, (time.perf_counter() - started) / iterations)
+    return best * 1e6, size
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--agents", type=int, default=5)
+    parser.add_argument("--chars", type=int, default=1200, help="characters per answer")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    seminar = seminar_payload(args.rounds, args.agents, args.chars)
+    frame = {"type": "agent_response", "agent_id": "agent_0", "content": seminar["answers"][0]["response"],
+             "message_id": str(uuid.uuid4()), "timestamp": datetime.utcnow().isoformat(), "is_complete": True}
+
+    encoders: List[Tuple[str, Callable[[Any], Any]]] = [("stdlib json", stdlib_json)]
+    encoders.append(("orjson" if serialization.orjson else "json (orjson not installed)", serialization.dumps))
+    if serialization.msgpack is not None:
+        encoders.append(("msgpack", serialization.pack))
+
+    for label, payload in (("/seminar response", seminar), ("WebSocket agent_response frame", frame)):
+        print(f"{label}: {len(seminar['answers']) if payload is seminar else 1} answer(s)")
+        baseline = None
+        for name, encode in encoders:
+            micros, size = time_encoder(encode, payload, args.iterations)
+            baseline = baseline or micros
+            print(f"  {name:<28} {micros:10.1f} us {size:10d} bytes {baseline / micros:6.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Automatic brownout: degrade seminar cost while the upstream is saturated.
+A controller turns live queue and latency signals into a degradation level, and each
+level caps agents, rounds, completion length and memory depth a little further.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Optional, List
+
+from admission import AdmissionController, admission_controller
+from hedging import LatencyTracker
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class DegradationPolicy:
+    """Limits applied to one seminar. None means unlimited."""
+    def __init__(self,
+                 level: int,
+                 max_agents: Optional[int] = None,
+                 max_agents_per_follow_up: Optional[int] = None,
+                 max_follow_up_rounds: Optional[int] = None,
+                 max_tokens_scale: float = 1.0,
+                 memory_depth_scale: float = 1.0,
+                 prefer_fallback: bool = False):
+        self.level = level
+        self.max_agents = max_agents
+        self.max_agents_per_follow_up = max_agents_per_follow_up
+        self.max_follow_up_rounds = max_follow_up_rounds
+        self.max_tokens_scale = max_tokens_scale
+        self.memory_depth_scale = memory_depth_scale
+        self.prefer_fallback = prefer_fallback
+
+    def limit_agents(self, agent_ids: List[str]) -> List[str]:
+        """Cap the first-round panel, keeping the front of the list (direct mentions go first)"""
+        return agent_ids if self.max_agents is None else agent_ids[:self.max_agents]
+
+    def limit_follow_up_agents(self, agent_ids: List[str]) -> List[str]:
+        if self.max_agents_per_follow_up is None:
+            return agent_ids
+        return agent_ids[:self.max_agents_per_follow_up]
+
+    def limit_follow_up_rounds(self, rounds: int) -> int:
+        return rounds if self.max_follow_up_rounds is None else min(rounds, self.max_follow_up_rounds)
+
+    def scale_max_tokens(self, max_tokens: int) -> int:
+        return max(64, int(max_tokens * self.max_tokens_scale))
+
+    def scale_memory_depth(self, memory_depth: int) -> int:
+        return max(1, int(memory_depth * self.memory_depth_scale))
+
+# Progressively cheaper seminars; index is the degradation level
+DEGRADATION_LEVELS = [
+    DegradationPolicy(0),
+    DegradationPolicy(1, max_agents_per_follow_up=2, max_follow_up_rounds=2,
+                      max_tokens_scale=0.75),
+    DegradationPolicy(2, max_agents=4, max_agents_per_follow_up=2, max_follow_up_rounds=1,
+                      max_tokens_scale=0.6, memory_depth_scale=0.5),
+    DegradationPolicy(3, max_agents=2, max_agents_per_follow_up=1, max_follow_up_rounds=0,
+                      max_tokens_scale=0.5, memory_depth_scale=0.3, prefer_fallback=True),
+]
+
+class BrownoutController:
+    """
+    Pressure is the worst of: smoothed queue wait against its target, queue depth against
+    slot count, and upstream p95 latency against its target. Pressure N or more selects
+    level N. Levels rise immediately but only fall after pressure stays low for a cool-down.
+    """
+    def __init__(self, admission: AdmissionController):
+        self.admission = admission
+        self.latency: Optional[LatencyTracker] = None
+        self.models: List[str] = []
+        self.enabled = os.getenv("BROWNOUT_ENABLED", "true").lower() == "true"
+        self.target_queue_wait = float(os.getenv("BROWNOUT_TARGET_QUEUE_WAIT", "5"))
+        self.target_latency = float(os.getenv("BROWNOUT_TARGET_LATENCY", "20"))
+        self.cooldown = float(os.getenv("BROWNOUT_COOLDOWN_SECONDS", "30"))
+        # Only latencies this recent count; a model with none (all traffic on the fallback) is ignored
+        self.latency_window = float(os.getenv("BROWNOUT_LATENCY_WINDOW_SECONDS", "120"))
+        # The level is also re-evaluated this often, so it recovers while traffic is idle
+        self.evaluate_interval = float(os.getenv("BROWNOUT_EVALUATE_INTERVAL", "5"))
+        # Pressure must drop this far below a level's threshold before stepping down
+        self.recovery_margin = 0.7
+
+        self.level = 0
+        self._low_since: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def attach(self, latency: LatencyTracker, models: List[str]) -> None:
+        """Use the inference client's latency window as an upstream signal"""
+        self.latency = latency
+        self.models = models
+
+    def start(self) -> None:
+        self.stop()
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.evaluate_interval)
+            self.current_policy()
+
+    def pressure(self) -> float:
+        # The smoothed queue wait only moves when a request is admitted, so it is stale once the queue empties
+        queue_depth = self.admission.queue_depth()
+        signals = [
+            self.admission.queue_wait / self.target_queue_wait if queue_depth else 0.0,
+            queue_depth / self.admission.max_concurrent,
+        ]
+        if self.latency is not None:
+            for model in self.models:
+                p95 = self.latency.quantile(model, 0.95, max_age=self.latency_window)
+                if p95 is not None:
+                    signals.append(p95 / self.target_latency)
+        return max(signals)
+
+    def current_policy(self) -> DegradationPolicy:
+        """Re-evaluate the level from live signals and return its policy"""
+        if not self.enabled:
+            return DEGRADATION_LEVELS[0]
+
+        pressure = self.pressure()
+        target = min(int(pressure), len(DEGRADATION_LEVELS) - 1)
+        now = time.monotonic()
+
+        if target > self.level:
+            self._set_level(target, pressure)
+            self._low_since = None
+        elif self.level > 0 and pressure < self.level * self.recovery_margin:
+            if self._low_since is None:
+                self._low_since = now
+            elif now - self._low_since >= self.cooldown:
+                self._set_level(self.level - 1, pressure)
+                self._low_since = now
+        else:
+            self._low_since = None
+
+        metrics.set_gauge("brownout_pressure", round(pressure, 3))
+        return DEGRADATION_LEVELS[self.level]
+
+    def _set_level(self, level: int, pressure: float) -> None:
+        logger.warning(f"Brownout level {self.level} -> {level} (pressure {pressure:.2f})")
+        self.level = level
+        metrics.set_gauge("brownout_level", level)
+        metrics.increment("brownout_level_changes_total", level=level)
+
+# Global brownout controller instance
+brownout_controller = BrownoutController(admission_controller)
@@ -0,0 +1,155 @@
+"""
+Per-endpoint circuit breakers for upstream inference calls.
+A breaker trips open when the failure rate inside a rolling window gets too high,
+so callers can fail over immediately instead of stacking retries on a dead endpoint.
+"""
+
+import os
+import time
+import logging
+from collections import deque
+from enum import Enum
+from typing import Deque, Dict, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker driven by a rolling failure-rate window"""
+    def __init__(self,
+                 name: str,
+                 failure_rate_threshold: float = 0.5,
+                 window_seconds: float = 60.0,
+                 minimum_calls: int = 5,
+                 open_seconds: float = 30.0,
+                 half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.window_seconds = window_seconds
+        self.minimum_calls = minimum_calls
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        # Rolling window of (timestamp, failed) outcomes plus running totals
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._failures = 0
+        self._publish_state()
+
+    @property
+    def state(self) -> CircuitState:
+        """Current state, moving from open to half-open once the cool-down elapses"""
+        if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition(CircuitState.HALF_OPEN)
+        return self._state
+
+    def allow_request(self) -> bool:
+        """Return True if a call may be sent to this endpoint right now"""
+        state = self.state
+        if state == CircuitState.CLOSED:
+            return True
+        if state == CircuitState.HALF_OPEN and self._half_open_in_flight < self.half_open_max_calls:
+            self._half_open_in_flight += 1
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self._state == CircuitState.HALF_OPEN:
+            self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+            self._reset_window()
+            self._transition(CircuitState.CLOSED)
+            return
+        self._record(failed=False)
+
+    def record_failure(self) -> None:
+        if self._state == CircuitState.HALF_OPEN:
+            self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+            self._trip()
+            return
+        self._record(failed=True)
+        if self._state == CircuitState.CLOSED and self._should_trip():
+            self._trip()
+
+    def release(self) -> None:
+        """Give back a half-open probe slot for a call that was cancelled before finishing"""
+        if self._state == CircuitState.HALF_OPEN:
+            self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+
+    def failure_rate(self) -> float:
+        self._prune(time.monotonic())
+        if not self._outcomes:
+            return 0.0
+        return self._failures / len(self._outcomes)
+
+    def _record(self, failed: bool) -> None:
+        now = time.monotonic()
+        self._outcomes.append((now, failed))
+        if failed:
+            self._failures += 1
+        self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            _, failed = self._outcomes.popleft()
+            if failed:
+                self._failures -= 1
+
+    def _should_trip(self) -> bool:
+        if len(self._outcomes) < self.minimum_calls:
+            return False
+        return self._failures / len(self._outcomes) >= self.failure_rate_threshold
+
+    def _trip(self) -> None:
+        self._opened_at = time.monotonic()
+        self._reset_window()
+        self._transition(CircuitState.OPEN)
+        metrics.increment("circuit_breaker_trips_total", endpoint=self.name)
+
+    def _reset_window(self) -> None:
+        self._outcomes.clear()
+        self._failures = 0
+
+    def _transition(self, new_state: CircuitState) -> None:
+        if new_state == self._state:
+            return
+        logger.warning(f"Circuit for {self.name} moved from {self._state.value} to {new_state.value}")
+        self._state = new_state
+        self._half_open_in_flight = 0
+        self._publish_state()
+
+    def _publish_state(self) -> None:
+        for state in CircuitState:
+            metrics.set_gauge("circuit_breaker_state", 1 if state == self._state else 0,
+                              endpoint=self.name, state=state.value)
+
+class CircuitBreakerRegistry:
+    """Holds one breaker per upstream endpoint, created lazily with shared settings"""
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.settings = {
+            "failure_rate_threshold": float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5")),
+            "window_seconds": float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60")),
+            "minimum_calls": int(os.getenv("CIRCUIT_MINIMUM_CALLS", "5")),
+            "open_seconds": float(os.getenv("CIRCUIT_OPEN_SECONDS", "30")),
+            "half_open_max_calls": int(os.getenv("CIRCUIT_HALF_OPEN_CALLS", "1")),
+        }
+
+    def get(self, name: str) -> CircuitBreaker:
+        if name not in self.breakers:
+            self.breakers[name] = CircuitBreaker(name, **self.settings)
+        return self.breakers[name]
+
+    def states(self) -> Dict[str, str]:
+        return {name: breaker.state.value for name, breaker in self.breakers.items()}
+
+# Global circuit breaker registry instance
+circuit_breakers = CircuitBreakerRegistry()
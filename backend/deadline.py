@@ -0,0 +1,68 @@
+"""
+Deadlines for seminars.
+Each seminar carries a time budget, supplied by the client or configured. It travels in a
+context variable into admission, retries and upstream timeouts, so no layer keeps waiting
+once the budget is spent, and the seminar returns whatever finished in time.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Union
+
+# Budget for a seminar when the client does not ask for one
+DEFAULT_DEADLINE = float(os.getenv("SEMINAR_DEADLINE_SECONDS", "120"))
+# Longest budget a client may ask for
+MAX_DEADLINE = float(os.getenv("SEMINAR_MAX_DEADLINE_SECONDS", "600"))
+
+class Deadline:
+    """A point in time after which nobody is waiting for the answer"""
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def bound(self, timeout: float) -> float:
+        """`timeout`, shortened so it ends no later than the deadline"""
+        return min(timeout, self.remaining())
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("seminar_deadline", default=None)
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]):
+    """Make `deadline` the current one for the block, and for tasks created inside it"""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+def bounded_timeout(timeout: float) -> float:
+    """`timeout`, shortened to the current deadline if there is one"""
+    deadline = current_deadline()
+    return deadline.bound(timeout) if deadline is not None else timeout
+
+def request_deadline(timeout: Union[str, float, None] = None) -> Deadline:
+    """
+    A deadline `timeout` seconds from now, capped at MAX_DEADLINE, or DEFAULT_DEADLINE if
+    not given. Raises ValueError for anything that isn't a positive number.
+    """
+    if timeout is None or timeout == "":
+        return Deadline(DEFAULT_DEADLINE)
+    try:
+        seconds = float(timeout)
+    except (TypeError, ValueError):
+        raise ValueError("timeout must be a number of seconds")
+    if not seconds > 0:
+        raise ValueError("timeout must be a positive number of seconds")
+    return Deadline(min(seconds, MAX_DEADLINE))
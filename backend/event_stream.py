@@ -0,0 +1,89 @@
+"""
+Streaming HTTP responses for long-running endpoints.
+Events from an async iterator are written as Server-Sent Events, or as newline-delimited
+JSON when the client asks for it, with heartbeats while nothing else is being sent.
+"""
+
+import os
+import asyncio
+import logging
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from serialization import dumps_text
+
+logger = logging.getLogger(__name__)
+
+SSE_MEDIA_TYPE = "text/event-stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Seconds without an event before a heartbeat keeps proxies from closing the stream
+HEARTBEAT_INTERVAL = float(os.getenv("STREAM_HEARTBEAT_INTERVAL", "15"))
+
+def negotiate_media_type(request: Request) -> str:
+    """NDJSON if the client accepts it (and not SSE), otherwise Server-Sent Events"""
+    accept = request.headers.get("accept", "")
+    return NDJSON_MEDIA_TYPE if NDJSON_MEDIA_TYPE in accept and SSE_MEDIA_TYPE not in accept else SSE_MEDIA_TYPE
+
+def format_event(event: Dict[str, Any], media_type: str, event_id: int) -> str:
+    data = dumps_text(event)
+    if media_type == NDJSON_MEDIA_TYPE:
+        return data + "\n"
+    return f"id: {event_id}\nevent: {event['type']}\ndata: {data}\n\n"
+
+def format_heartbeat(media_type: str) -> str:
+    if media_type == NDJSON_MEDIA_TYPE:
+        return dumps_text({"type": "heartbeat"}) + "\n"
+    # SSE comment lines are ignored by EventSource
+    return ": heartbeat\n\n"
+
+async def encode_events(events: AsyncGenerator[Dict[str, Any], None], media_type: str,
+                        heartbeat_interval: float = HEARTBEAT_INTERVAL, first_id: int = 1) -> AsyncIterator[str]:
+    """
+    Write each event as soon as it is produced, and a heartbeat after every quiet interval.
+    If the client goes away, the event source is cancelled so it stops doing work.
+    """
+    event_id = first_id - 1
+    next_event = None
+    try:
+        while True:
+            if next_event is None:
+                next_event = asyncio.ensure_future(events.__anext__())
+            done, _ = await asyncio.wait({next_event}, timeout=heartbeat_interval)
+            if not done:
+                yield format_heartbeat(media_type)
+                continue
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            finally:
+                next_event = None
+            event_id += 1
+            yield format_event(event, media_type, event_id)
+    finally:
+        if next_event is not None:
+            next_event.cancel()
+            try:
+                await next_event
+            except (asyncio.CancelledError, Exception):
+                pass
+        await events.aclose()
+
+def stream_response(request: Request,
+                    events: AsyncGenerator[Dict[str, Any], None],
+                    first_id: int = 1,
+                    media_type: Optional[str] = None) -> StreamingResponse:
+    """
+    `first_id` numbers the first SSE event, for streams resumed from a Last-Event-ID.
+    `media_type` fixes the format instead of negotiating it.
+    """
+    media_type = media_type or negotiate_media_type(request)
+    return StreamingResponse(
+        encode_events(events, media_type, first_id=first_id),
+        media_type=media_type,
+        # Stop proxies (nginx in particular) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,137 @@
+"""
+Local verification of Google ID tokens.
+Google's signing keys (JWKS) are fetched once, cached for as long as Google's cache
+headers allow and refreshed in the background, so a sign-in only costs a signature check.
+"""
+
+import os
+import re
+import time
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Any, Mapping
+
+import httpx
+import jwt
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+# Tolerated clock difference between us and Google when checking exp/iat
+CLOCK_SKEW_SECONDS = 30
+
+class GoogleKeySet:
+    def __init__(self):
+        self.certs_url = os.getenv("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v3/certs")
+        self.default_max_age = float(os.getenv("GOOGLE_JWKS_DEFAULT_MAX_AGE", "3600"))
+        self.min_refresh_interval = float(os.getenv("GOOGLE_JWKS_MIN_REFRESH_INTERVAL", "60"))
+        # Structure: {kid: PyJWK}
+        self.keys: Dict[str, jwt.PyJWK] = {}
+        self.expires_at = 0.0
+        self.last_fetch = 0.0
+        self.http_client: Optional[httpx.AsyncClient] = None
+        self._refresh_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _max_age(self, headers: Mapping[str, str]) -> float:
+        """Cache lifetime from Cache-Control max-age, falling back to Expires"""
+        match = re.search(r"max-age=(\d+)", headers.get("cache-control", ""))
+        if match:
+            return float(match.group(1))
+        expires = headers.get("expires")
+        if expires:
+            try:
+                return max(0.0, parsedate_to_datetime(expires).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+        return self.default_max_age
+
+    async def refresh(self) -> None:
+        """Fetch the current key set; concurrent callers share one fetch"""
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        fetch_started = time.monotonic()
+        async with self._refresh_lock:
+            if self.last_fetch > fetch_started:
+                return  # Another caller refreshed while we waited
+            if self.http_client is None:
+                self.http_client = httpx.AsyncClient(timeout=10.0)
+            try:
+                response = await self.http_client.get(self.certs_url)
+                response.raise_for_status()
+                key_set = jwt.PyJWKSet.from_dict(response.json())
+            except Exception:
+                metrics.increment("google_jwks_refreshes_total", outcome="failure")
+                raise
+            self.keys = {key.key_id: key for key in key_set.keys if key.key_id}
+            self.last_fetch = time.monotonic()
+            self.expires_at = self.last_fetch + self._max_age(response.headers)
+            metrics.increment("google_jwks_refreshes_total", outcome="success")
+            logger.info(f"Loaded {len(self.keys)} Google signing key(s), valid for {self.expires_at - self.last_fetch:.0f}s")
+
+    async def get_key(self, kid: str) -> jwt.PyJWK:
+        """Signing key by ID, refreshing when the cache is empty, expired or missing a rotated-in key"""
+        now = time.monotonic()
+        stale = now >= self.expires_at
+        unknown = kid not in self.keys and now - self.last_fetch >= self.min_refresh_interval
+        if not self.keys or stale or unknown:
+            try:
+                await self.refresh()
+            except Exception as e:
+                if not self.keys:
+                    raise
+                # Google overlaps its key rotations, so stale keys are still better than none
+                logger.warning(f"Google JWKS refresh failed, using cached keys: {str(e)}")
+        if kid not in self.keys:
+            raise jwt.InvalidTokenError(f"Unknown signing key {kid}")
+        return self.keys[kid]
+
+    async def verify(self, token: str, audience: str = "") -> Dict[str, Any]:
+        """Check signature, expiry, issuer and (if configured) audience; return the claims"""
+        header = jwt.get_unverified_header(token)
+        key = await self.get_key(header.get("kid", ""))
+        claims = jwt.decode(
+            token,
+            key.key,
+            algorithms=["RS256"],
+            audience=audience or None,
+            options={"verify_aud": bool(audience)},
+            leeway=CLOCK_SKEW_SECONDS,
+        )
+        if claims.get("iss") not in GOOGLE_ISSUERS:
+            raise jwt.InvalidIssuerError(f"Unexpected issuer {claims.get('iss')}")
+        return claims
+
+    def start(self) -> None:
+        """Prefetch the keys and keep them fresh ahead of expiry"""
+        self.stop()
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def aclose(self) -> None:
+        self.stop()
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+                # Renew shortly before Google's cache lifetime runs out
+                lifetime = self.expires_at - time.monotonic()
+                delay = max(self.min_refresh_interval, lifetime * 0.9)
+            except Exception as e:
+                logger.warning(f"Google JWKS refresh failed, retrying in {self.min_refresh_interval:.0f}s: {str(e)}")
+                delay = self.min_refresh_interval
+            await asyncio.sleep(delay)
+
+# Global Google key set instance
+google_key_set = GoogleKeySet()
@@ -0,0 +1,84 @@
+"""
+Hedged upstream requests.
+Tracks per-model latency and decides when a slow request deserves a duplicate,
+keeping the extra load inside a fixed budget.
+"""
+
+import os
+import math
+import time
+import logging
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class LatencyTracker:
+    """Bounded window of recent successful latencies per model"""
+    def __init__(self, window_size: int = 200):
+        self.window_size = window_size
+        # Structure: {model: deque of (monotonic time recorded, seconds)}
+        self.samples: Dict[str, Deque[Tuple[float, float]]] = {}
+
+    def record(self, model: str, seconds: float) -> None:
+        if model not in self.samples:
+            self.samples[model] = deque(maxlen=self.window_size)
+        self.samples[model].append((time.monotonic(), seconds))
+
+    def count(self, model: str) -> int:
+        return len(self.samples.get(model, ()))
+
+    def quantile(self, model: str, q: float, max_age: Optional[float] = None) -> Optional[float]:
+        """
+        Nearest-rank quantile of the recorded latencies, only those from the last `max_age`
+        seconds if given, or None without samples
+        """
+        samples = self.samples.get(model, ())
+        if max_age is not None:
+            cutoff = time.monotonic() - max_age
+            samples = [sample for sample in samples if sample[0] >= cutoff]
+        if not samples:
+            return None
+        ordered = sorted(seconds for _, seconds in samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return ordered[index]
+
+class HedgePolicy:
+    """Opt-in hedging: duplicate a request once it outlives the model's observed p95"""
+    def __init__(self, latency_tracker: LatencyTracker):
+        self.latency = latency_tracker
+        self.enabled = os.getenv("HF_HEDGING_ENABLED", "false").lower() == "true"
+        self.quantile = float(os.getenv("HF_HEDGE_QUANTILE", "0.95"))
+        self.budget_ratio = float(os.getenv("HF_HEDGE_BUDGET", "0.05"))
+        self.min_samples = int(os.getenv("HF_HEDGE_MIN_SAMPLES", "20"))
+        self.min_delay = float(os.getenv("HF_HEDGE_MIN_DELAY", "0.5"))
+        # Every primary request earns budget_ratio hedge credits; a hedge spends one
+        self.max_credits = 10.0
+        self.credits = 0.0
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """Seconds to wait before hedging a request to this model, or None to never hedge"""
+        if not self.enabled or self.latency.count(model) < self.min_samples:
+            return None
+        return max(self.min_delay, self.latency.quantile(model, self.quantile))
+
+    def record_request(self) -> None:
+        self.credits = min(self.max_credits, self.credits + self.budget_ratio)
+        metrics.increment("hedge_primary_requests_total")
+
+    def try_acquire(self) -> bool:
+        """Spend one hedge credit if the budget allows it"""
+        if self.credits < 1.0:
+            metrics.increment("hedge_budget_exhausted_total")
+            return False
+        self.credits -= 1.0
+        metrics.increment("hedge_requests_total")
+        return True
+
+    def record_outcome(self, hedge_won: bool) -> None:
+        metrics.increment("hedge_wins_total" if hedge_won else "hedge_losses_total")
+        sent = metrics.get_counter("hedge_requests_total")
+        if sent:
+            metrics.set_gauge("hedge_win_rate", metrics.get_counter("hedge_wins_total") / sent)
@@ -1,12 +1,19 @@
-from typing import Any, Dict, Optional, Callable, List
+from typing import Any, Dict, Optional, Callable, List, Tuple
 import time
+import json
 import asyncio
 import logging
 from functools import wraps
-import requests
+import httpx
 from fastapi import HTTPException
 import os
 
+from circuit_breaker import circuit_breakers
+from deadline import current_deadline, bounded_timeout
+from hedging import HedgePolicy, LatencyTracker
+from load_balancer import Endpoint, LoadBalancer, model_url
+from metrics import metrics
+
 logger = logging.getLogger(__name__)
 
 class HuggingFaceError(Exception):
@@ -16,6 +23,22 @@ class HuggingFaceError(Exception):
         self.status_code = status_code
         self.original_error = original_error
         self.message = message
+        # Filled in when the error was classified from a real upstream response
+        self.classification: Optional["ErrorClassification"] = None
+
+    @property
+    def retryable(self) -> bool:
+        if self.classification is not None:
+            return self.classification.retryable
+        return isinstance(self, (RateLimitError, ModelNotAvailableError, UpstreamServerError))
+
+    @property
+    def retry_after(self) -> Optional[float]:
+        return self.classification.retry_after if self.classification else None
+
+    @property
+    def estimated_time(self) -> Optional[float]:
+        return self.classification.estimated_time if self.classification else None
 
 class RateLimitError(HuggingFaceError):
     """Raised when Hugging Face API rate limit is hit"""
@@ -37,42 +60,148 @@ class ModelNotAvailableError(HuggingFaceError):
     def __init__(self, message: str = "Model not available", original_error: Optional[Exception] = None):
         super().__init__(message, status_code=503, original_error=original_error)
 
-def map_huggingface_error(error: Exception) -> HuggingFaceError:
-    """Maps Hugging Face exceptions to our custom exception types"""
-    error_str = str(error).lower()
-    
-    if "rate limit" in error_str:
-        return RateLimitError(original_error=error)
-    elif any(phrase in error_str for phrase in [
-            "maximum context length", 
-            "token", 
-            "too many tokens", 
-            "exceed", 
-            "context window", 
-            "input is too long"
-        ]):
-        return TokenLimitError(f"Token limit exceeded: {error_str}", original_error=error)
-    elif "authentication" in error_str or "api key" in error_str or "invalid key" in error_str:
-        return AuthenticationError(original_error=error)
-    elif "model" in error_str and any(phrase in error_str for phrase in [
-            "not found", 
-            "currently unavailable", 
-            "overloaded", 
-            "capacity"
+class UpstreamServerError(HuggingFaceError):
+    """Raised on upstream 5xx responses, timeouts and connection failures"""
+    def __init__(self, message: str = "Upstream server error", original_error: Optional[Exception] = None):
+        super().__init__(message, status_code=502, original_error=original_error)
+
+class CircuitOpenError(HuggingFaceError):
+    """Raised when every configured endpoint has an open circuit"""
+    def __init__(self, message: str = "All model endpoints are temporarily unavailable", original_error: Optional[Exception] = None):
+        super().__init__(message, status_code=503, original_error=original_error)
+
+class DeadlineExceeded(HuggingFaceError):
+    """Raised when the seminar's deadline leaves no time for an upstream call or retry"""
+    def __init__(self, message: str = "Deadline exceeded", original_error: Optional[Exception] = None):
+        super().__init__(message, status_code=504, original_error=original_error)
+
+class ErrorClassification:
+    """Typed result of classifying a failed upstream response"""
+    def __init__(self,
+                 error_class: type,
+                 retryable: bool,
+                 message: str,
+                 status_code: Optional[int] = None,
+                 retry_after: Optional[float] = None,
+                 estimated_time: Optional[float] = None,
+                 error_type: Optional[str] = None):
+        self.error_class = error_class
+        self.retryable = retryable
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.estimated_time = estimated_time
+        self.error_type = error_type
+
+    def to_error(self) -> HuggingFaceError:
+        error = self.error_class(self.message)
+        error.classification = self
+        return error
+
+def _parse_seconds(value: Any) -> Optional[float]:
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    return seconds if seconds >= 0 else None
+
+def classify_upstream_response(status_code: int, headers: Dict[str, str], body: str) -> ErrorClassification:
+    """
+    Classify a non-200 upstream response from its HTTP status, headers and JSON error
+    payload (``error``, ``error_type``, ``estimated_time``) rather than its message text.
+    """
+    payload: Dict[str, Any] = {}
+    try:
+        parsed = json.loads(body) if body else {}
+        if isinstance(parsed, dict):
+            payload = parsed
+    except ValueError:
+        pass
+
+    detail = payload.get("error", body)
+    if isinstance(detail, list):
+        detail = "; ".join(str(item) for item in detail)
+    detail = str(detail)[:500]
+    error_type = payload.get("error_type")
+    estimated_time = _parse_seconds(payload.get("estimated_time"))
+    retry_after = _parse_seconds(headers.get("retry-after"))
+    lowered = detail.lower()
+
+    if status_code in (401, 403):
+        classification = ErrorClassification(AuthenticationError, False, f"Authentication failed: {detail}",
+                                             status_code, error_type=error_type)
+    elif status_code == 429:
+        classification = ErrorClassification(RateLimitError, True, f"Rate limit exceeded: {detail}",
+                                             status_code, retry_after=retry_after, error_type=error_type)
+    elif status_code == 404:
+        classification = ErrorClassification(ModelNotAvailableError, False, f"Model not found: {detail}",
+                                             status_code, error_type=error_type)
+    elif status_code == 503 or estimated_time is not None or error_type == "overloaded":
+        # Model loading or overloaded: come back once it is expected to be ready
+        classification = ErrorClassification(ModelNotAvailableError, True, f"Model unavailable: {detail}",
+                                             status_code, retry_after=retry_after or estimated_time,
+                                             estimated_time=estimated_time, error_type=error_type)
+    elif status_code >= 500:
+        classification = ErrorClassification(UpstreamServerError, True, f"Upstream server error: {detail}",
+                                             status_code, retry_after=retry_after, error_type=error_type)
+    elif status_code in (400, 413, 422) and any(phrase in lowered for phrase in [
+            "maximum context length",
+            "too many tokens",
+            "context window",
+            "input is too long",
+            "input validation error"
         ]):
-        return ModelNotAvailableError(f"Model unavailable: {error_str}", original_error=error)
+        classification = ErrorClassification(TokenLimitError, False, f"Token limit exceeded: {detail}",
+                                             status_code, error_type=error_type)
+    else:
+        classification = ErrorClassification(HuggingFaceError, False, f"Hugging Face API error ({status_code}): {detail}",
+                                             status_code, error_type=error_type)
+
+    metrics.increment("upstream_errors_total", error_class=classification.error_class.__name__,
+                      status=status_code, retryable=classification.retryable)
+    return classification
+
+def map_huggingface_error(error: Exception) -> HuggingFaceError:
+    """Maps exceptions that did not come from an upstream HTTP response to our custom exception types"""
+    if isinstance(error, HuggingFaceError):
+        return error
+
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+        mapped_error = UpstreamServerError(f"Upstream connection failed: {type(error).__name__}: {error}", original_error=error)
     else:
-        return HuggingFaceError(f"Hugging Face API error: {str(error)}", original_error=error)
+        error_str = str(error).lower()
+        if any(phrase in error_str for phrase in [
+                "maximum context length",
+                "too many tokens",
+                "context window",
+                "input is too long"
+            ]):
+            mapped_error = TokenLimitError(f"Token limit exceeded: {error_str}", original_error=error)
+        else:
+            mapped_error = HuggingFaceError(f"Hugging Face API error: {str(error)}", original_error=error)
+
+    metrics.increment("upstream_errors_total", error_class=type(mapped_error).__name__,
+                      status="none", retryable=mapped_error.retryable)
+    return mapped_error
+
+def is_endpoint_failure(error: HuggingFaceError) -> bool:
+    """
+    Whether an error says something about endpoint health (as opposed to a bad request).
+    A 429 throttles one API key, not the URL; the balancer pauses that key instead.
+    """
+    return error.retryable and not isinstance(error, (CircuitOpenError, RateLimitError))
 
 def retry_with_exponential_backoff(
     max_retries: int = 5,
     initial_delay: float = 1,
     max_delay: float = 60,
     exponential_base: float = 2,
-    retry_on: tuple = (RateLimitError, ModelNotAvailableError)
+    retry_on: tuple = (RateLimitError, ModelNotAvailableError, UpstreamServerError)
 ):
     """
-    Decorator that implements exponential backoff for Hugging Face API calls
+    Decorator that implements exponential backoff for Hugging Face API calls.
+    Only errors classified as retryable are retried, and an upstream Retry-After or
+    model-loading ETA stretches the wait. No retry is attempted past the current deadline.
     """
     def decorator(func: Callable):
         @wraps(func)
@@ -87,7 +216,7 @@ def retry_with_exponential_backoff(
                     mapped_error = map_huggingface_error(e)
                     last_exception = mapped_error
 
-                    if not isinstance(mapped_error, retry_on):
+                    if not isinstance(mapped_error, retry_on) or not mapped_error.retryable:
                         raise mapped_error
 
                     if attempt == max_retries - 1:
@@ -95,10 +224,20 @@ def retry_with_exponential_backoff(
                                    extra={"error": str(mapped_error), "attempt": attempt + 1})
                         raise mapped_error
 
-                    wait_time = min(delay * (exponential_base ** attempt), max_delay)
+                    wait_time = delay * (exponential_base ** attempt)
+                    if mapped_error.retry_after is not None:
+                        wait_time = max(wait_time, mapped_error.retry_after)
+                    wait_time = min(wait_time, max_delay)
+                    deadline = current_deadline()
+                    if deadline is not None and wait_time >= deadline.remaining():
+                        metrics.increment("deadline_exceeded_total", stage="retry")
+                        logger.warning(f"Not retrying Hugging Face API call: {deadline.remaining():.2f}s left before the deadline",
+                                       extra={"error": str(mapped_error), "attempt": attempt + 1})
+                        raise mapped_error
+                    metrics.increment("upstream_retries_total", error_class=type(mapped_error).__name__)
                     logger.warning(f"Hugging Face API call failed. Retrying in {wait_time:.2f} seconds...",
                                  extra={"error": str(mapped_error), "attempt": attempt + 1})
-                    time.sleep(wait_time)
+                    await asyncio.sleep(wait_time)
 
             raise last_exception
 
@@ -110,11 +249,20 @@ class HuggingFaceClient:
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.model = os.getenv("HF_MODEL", "meta-llama/Llama-3.1-8B-Instruct")
-        self.api_url = f"https://api-inference.huggingface.co/models/{self.model}"
-        self.headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+        self.api_url = model_url(self.model)
+        # Degraded fallback used while the primary endpoint's circuit is open
+        self.fallback_model = os.getenv("HF_FALLBACK_MODEL")
+        self.fallback_api_url = os.getenv("HF_FALLBACK_URL") or (
+            model_url(self.fallback_model) if self.fallback_model else None
+        )
+        # Every configured endpoint paired with every configured API key
+        self.balancer = LoadBalancer.from_env(self.model, api_key, self.fallback_model, self.fallback_api_url)
+        # Shared connection pool; created on first use so it binds to the running loop
+        self.http_client: Optional[httpx.AsyncClient] = None
+        self.request_timeout = float(os.getenv("HF_REQUEST_TIMEOUT", "60"))
+        self.max_connections = int(os.getenv("HF_MAX_CONNECTIONS", "100"))
+        self.latency = LatencyTracker()
+        self.hedge_policy = HedgePolicy(self.latency)
         self.default_retry_config = {
             "max_retries": 5,
             "initial_delay": 1,
@@ -122,6 +270,20 @@ class HuggingFaceClient:
             "exponential_base": 2
         }
         logger.info(f"Initialized HuggingFaceClient with model: {self.model}")
+        if self.fallback_api_url:
+            logger.info(f"Fallback endpoint configured: {self.fallback_api_url}")
+
+    def _select_endpoint(self, exclude: Optional[Endpoint] = None, prefer_fallback: bool = False) -> Endpoint:
+        """Pick an endpoint/key pair through the load balancer"""
+        endpoint = self.balancer.select(exclude=exclude, prefer_fallback=prefer_fallback)
+        if endpoint is None:
+            metrics.increment("upstream_circuit_rejections_total")
+            raise CircuitOpenError()
+        return endpoint
+
+    def circuit_states(self) -> Dict[str, str]:
+        """Circuit state of every configured endpoint"""
+        return {url: circuit_breakers.get(url).state.value for url in self.balancer.urls()}
 
     def _format_messages(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
         """Format messages for Llama-3.1 chat format"""
@@ -144,58 +306,183 @@ class HuggingFaceClient:
         logger.debug(f"Formatted {len(messages)} messages into {len(formatted_messages)} messages for Llama-3.1")
         return formatted_messages
 
-    @retry_with_exponential_backoff()
-    async def create_chat_completion(self, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
-        """
-        Create a chat completion with enhanced error handling and retry logic
-        """
-        try:
-            formatted_messages = self._format_messages(messages)
-            
-            # Build payload according to Llama-3.1 requirements
-            payload = {
-                "inputs": formatted_messages,
-                "parameters": {
-                    "max_new_tokens": kwargs.get("max_tokens", 500),
-                    "temperature": kwargs.get("temperature", 0.7),
-                    "top_p": kwargs.get("top_p", 0.95),
-                    "repetition_penalty": kwargs.get("frequency_penalty", 1.0) + 0.3,  # Convert frequency_penalty to repetition_penalty
-                    "do_sample": True,
-                    "return_full_text": False,
-                    "stop": ["<|endoftext|>"]  # Llama 3.1 stop token
-                }
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Shared keep-alive connection pool, created lazily inside the running event loop"""
+        if self.http_client is None or self.http_client.is_closed:
+            self.http_client = httpx.AsyncClient(
+                timeout=self.request_timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections)
+            )
+        return self.http_client
+
+    async def aclose(self) -> None:
+        """Close the shared connection pool"""
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+
+    def _build_payload(self, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
+        """Build the request payload according to Llama-3.1 requirements"""
+        formatted_messages = self._format_messages(messages)
+        payload = {
+            "inputs": formatted_messages,
+            "parameters": {
+                "max_new_tokens": kwargs.get("max_tokens", 500),
+                "temperature": kwargs.get("temperature", 0.7),
+                "top_p": kwargs.get("top_p", 0.95),
+                "repetition_penalty": kwargs.get("frequency_penalty", 1.0) + 0.3,  # Convert frequency_penalty to repetition_penalty
+                "do_sample": True,
+                "return_full_text": False,
+                "stop": ["<|endoftext|>"]  # Llama 3.1 stop token
             }
-            
-            # Filter out parameters with None values
-            parameters = payload["parameters"]
-            payload["parameters"] = {k: v for k, v in parameters.items() if v is not None}
+        }
 
-            logger.debug(f"Sending request to {self.api_url} with {len(formatted_messages)} messages")
-            response = await asyncio.to_thread(
-                lambda: requests.post(self.api_url, headers=self.headers, json=payload, timeout=60)
-            )
+        # Filter out parameters with None values
+        parameters = payload["parameters"]
+        payload["parameters"] = {k: v for k, v in parameters.items() if v is not None}
+        return payload
+
+    async def _post(self, endpoint: Endpoint, payload: Dict[str, Any]) -> Any:
+        """Send one request to one endpoint, feeding its circuit breaker, balancer and latency stats"""
+        # The upstream timeout never runs past the seminar's deadline
+        timeout = bounded_timeout(self.request_timeout)
+        breaker = circuit_breakers.get(endpoint.url)
+        if timeout <= 0:
+            # Nothing was sent; give back the probe slot select() may have taken
+            breaker.release()
+            metrics.increment("deadline_exceeded_total", stage="upstream")
+            raise DeadlineExceeded()
+        start_time = time.monotonic()
+        self.balancer.acquire(endpoint)
+        try:
+            response = await self._get_http_client().post(endpoint.url, headers=endpoint.headers, json=payload,
+                                                          timeout=timeout)
+            latency = time.monotonic() - start_time
+            self.balancer.record_response(endpoint, response.status_code, response.headers, latency)
 
             if response.status_code != 200:
                 logger.error(f"API request failed with status {response.status_code}: {response.text}")
-                raise Exception(f"API request failed with status {response.status_code}: {response.text}")
+                raise classify_upstream_response(response.status_code, response.headers, response.text).to_error()
 
             result = response.json()
+        except asyncio.CancelledError:
+            # Lost a hedge race or the caller went away; says nothing about endpoint health
+            breaker.release()
+            raise
+        except httpx.TimeoutException as e:
+            if timeout < self.request_timeout:
+                # Cut short by the deadline, not by a slow endpoint
+                breaker.release()
+                metrics.increment("deadline_exceeded_total", stage="upstream")
+                raise DeadlineExceeded(original_error=e)
+            breaker.record_failure()
+            raise map_huggingface_error(e)
+        except Exception as e:
+            mapped_error = map_huggingface_error(e)
+            if is_endpoint_failure(mapped_error):
+                breaker.record_failure()
+            else:
+                # The request itself was bad; the endpoint answered, so give back any probe slot
+                breaker.release()
+            raise mapped_error
+        finally:
+            self.balancer.release(endpoint)
+
+        breaker.record_success()
+        self.latency.record(endpoint.model, latency)
+        return result
+
+    async def ping(self, url: str) -> None:
+        """
+        Send a one-token completion straight to one endpoint URL, bypassing retries,
+        to load a cold model or keep a serverless endpoint warm
+        """
+        now = time.monotonic()
+        candidates = self.balancer.endpoints_for_url(url)
+        endpoint = min(candidates, key=lambda candidate: (not candidate.key_state.has_headroom(now), candidate.outstanding))
+        payload = self._build_payload([{"role": "user", "content": "ping"}], max_tokens=1)
+        await self._post(endpoint, payload)
+
+    def _alternate_endpoint(self, endpoint: Endpoint) -> Optional[Endpoint]:
+        """Another endpoint/key pair to hedge to, or None if there is no other"""
+        return self.balancer.select(exclude=endpoint)
+
+    async def _dispatch(self, endpoint: Endpoint, payload: Dict[str, Any]) -> Tuple[Endpoint, Any]:
+        """
+        Send a request, hedging it to an alternate endpoint or key once it outlives the
+        model's observed p95 latency. The first successful result wins and the other is cancelled.
+        """
+        delay = self.hedge_policy.hedge_delay(endpoint.model)
+        if delay is None:
+            return endpoint, await self._post(endpoint, payload)
+
+        self.hedge_policy.record_request()
+        primary = asyncio.create_task(self._post(endpoint, payload))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            # Hedging to the pair that is already slow would only double its load
+            alternate = None if done else self._alternate_endpoint(endpoint)
+            if alternate is None or not self.hedge_policy.try_acquire():
+                if alternate is not None:
+                    # Not sent after all; give back any probe slot select() took
+                    circuit_breakers.get(alternate.url).release()
+                pending = set()
+                return endpoint, await primary
+
+            logger.info(f"Request to {endpoint.name} exceeded {delay:.2f}s, hedging to {alternate.name}")
+            hedge = asyncio.create_task(self._post(alternate, payload))
+            targets = {primary: endpoint, hedge: alternate}
+            pending = {primary, hedge}
+
+            first_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.hedge_policy.record_outcome(hedge_won=task is hedge)
+                        return targets[task], task.result()
+                    first_error = first_error or task.exception()
+            raise first_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @retry_with_exponential_backoff()
+    async def create_chat_completion(self, messages: List[Dict[str, str]], prefer_fallback: bool = False,
+                                     **kwargs) -> Dict[str, Any]:
+        """
+        Create a chat completion with enhanced error handling and retry logic.
+        `prefer_fallback` routes to the smaller fallback model first (used under brownout).
+        """
+        try:
+            endpoint = self._select_endpoint(prefer_fallback=prefer_fallback)
+            payload = self._build_payload(messages, **kwargs)
+
+            logger.debug(f"Sending request to {endpoint.name} with {len(payload['inputs'])} messages")
+            endpoint, result = await self._dispatch(endpoint, payload)
             logger.debug(f"Received response of length {len(str(result))} bytes")
+            generated_text = result[0]["generated_text"] if isinstance(result, list) else result["generated_text"]
+
+            # Token counts are not provided by Hugging Face API; estimate them (4 chars ≈ 1 token)
+            prompt_tokens = sum(len(message["content"]) for message in payload["inputs"]) // 4
+            completion_tokens = len(generated_text) // 4
             
             # Format the response in a standard structure similar to OpenAI for compatibility
             return {
                 "choices": [{
                     "message": {
                         "role": "assistant",
-                        "content": result[0]["generated_text"] if isinstance(result, list) else result["generated_text"]
+                        "content": generated_text
                     },
                     "finish_reason": "stop"
                 }],
-                "model": self.model,
+                "model": endpoint.model,
                 "usage": {
-                    "prompt_tokens": 0,  # Not provided by Hugging Face API
-                    "completion_tokens": 0,
-                    "total_tokens": 0
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
                 }
             }
 
@@ -246,6 +533,27 @@ class HuggingFaceClient:
                     "Try with a different agent or fewer agents",
                     "Check Hugging Face status page for any ongoing issues"
                 ]
+            },
+            UpstreamServerError: {
+                "message": "The AI service had a temporary problem.",
+                "suggestions": [
+                    "Try again in a few moments",
+                    "Try with fewer agents if this persists"
+                ]
+            },
+            CircuitOpenError: {
+                "message": "The AI service is recovering from an outage.",
+                "suggestions": [
+                    "Try again in a minute",
+                    "Check Hugging Face status page for any ongoing issues"
+                ]
+            },
+            DeadlineExceeded: {
+                "message": "The AI service could not answer within the time allowed.",
+                "suggestions": [
+                    "Try again with a longer timeout",
+                    "Try with fewer agents or rounds"
+                ]
             }
         }
         
@@ -261,13 +569,16 @@ class HuggingFaceClient:
         
         error_info = error_messages.get(error_type, default_response)
         
-        return {
+        response = {
             "error": True,
             "message": error_info["message"],
             "suggestions": error_info["suggestions"],
             "status_code": error.status_code,
             "error_type": error_type.__name__
         }
+        if error.retry_after is not None:
+            response["retry_after"] = error.retry_after
+        return response
 
     def handle_api_error(self, error: Exception) -> Dict[str, Any]:
         """
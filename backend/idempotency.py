@@ -0,0 +1,207 @@
+"""
+Idempotency keys for seminar and continue requests.
+A client that sends an Idempotency-Key header can retry or double-submit safely: a
+duplicate attaches to the run already in progress, or gets its stored response, instead
+of starting another multi-agent run and appending the exchange to memory again.
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Iterable
+
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from metrics import metrics
+from rate_limit import rate_limit_key
+from serialization import FastJSONResponse
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+MAX_KEY_LENGTH = 255
+
+class IdempotentRun:
+    """One request made under a key: in progress until its response is stored"""
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        # Set once the response is stored; the TTL runs from here
+        self.stored_at: Optional[float] = None
+        # Structure: (status, headers, body), once the original request has succeeded
+        self.response: Optional[Tuple[int, List[Tuple[bytes, bytes]], bytes]] = None
+        self.done = asyncio.Event()
+
+class IdempotencyStore:
+    def __init__(self):
+        # Stored responses are replayed for this long after the original request completes
+        self.ttl = float(os.getenv("IDEMPOTENCY_TTL", "3600"))
+        self.max_keys = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+        # Larger responses are not kept; a duplicate then runs again
+        self.max_response_bytes = int(os.getenv("IDEMPOTENCY_MAX_RESPONSE_BYTES", "1048576"))
+        # Structure: {(caller, key): IdempotentRun}; stored runs in the order they were stored
+        self.runs: "OrderedDict[Tuple[str, str], IdempotentRun]" = OrderedDict()
+
+    def begin(self, scope_key: Tuple[str, str], fingerprint: str) -> Tuple[IdempotentRun, bool]:
+        """The run for a key, and whether the caller is the one to carry it out"""
+        self._evict()
+        run = self.runs.get(scope_key)
+        if run is not None:
+            return run, False
+        run = self.runs[scope_key] = IdempotentRun(fingerprint)
+        metrics.set_gauge("idempotency_keys", len(self.runs))
+        return run, True
+
+    def complete(self, scope_key: Tuple[str, str], run: IdempotentRun,
+                 response: Optional[Tuple[int, List[Tuple[bytes, bytes]], bytes]]) -> None:
+        """Store the original's response, or forget the key so a retry can run (response None)"""
+        if response is not None and len(response[2]) <= self.max_response_bytes:
+            run.response = response
+            run.stored_at = time.monotonic()
+            if self.runs.get(scope_key) is run:
+                self.runs.move_to_end(scope_key)
+        elif self.runs.get(scope_key) is run:
+            del self.runs[scope_key]
+            metrics.set_gauge("idempotency_keys", len(self.runs))
+        run.done.set()
+
+    def _evict(self) -> None:
+        """Drop expired keys, then the oldest ones while over max_keys"""
+        cutoff = time.monotonic() - self.ttl
+        evicted = []
+        for scope_key, run in self.runs.items():
+            if len(self.runs) - len(evicted) < self.max_keys:
+                if run.stored_at is None:
+                    # Still in progress; runs in progress are few, so skipping them stays cheap
+                    continue
+                if run.stored_at >= cutoff:
+                    break
+            evicted.append(scope_key)
+        for scope_key in evicted:
+            # Duplicates still waiting on an evicted run carry it out themselves
+            self.runs.pop(scope_key).done.set()
+        metrics.set_gauge("idempotency_keys", len(self.runs))
+
+class IdempotencyMiddleware:
+    """
+    Deduplicates POSTs to `paths` that carry an Idempotency-Key. Keys are scoped to the caller,
+    and reusing one with a different request body is rejected with 422. Only successful
+    responses are stored, so a request that failed can be retried with the same key.
+    """
+    def __init__(self, app: ASGIApp, paths: Iterable[str], store: Optional["IdempotencyStore"] = None):
+        self.app = app
+        self.paths = set(paths)
+        self.store = store or idempotency_store
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        connection = HTTPConnection(scope)
+        key = connection.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            await FastJSONResponse(status_code=400, content={
+                "detail": f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters"})(scope, receive, send)
+            return
+
+        body = await self._read_body(receive)
+        scope_key = (rate_limit_key(connection)[1], key)
+        fingerprint = hashlib.sha256(scope["path"].encode() + scope.get("query_string", b"") + b"\n" + body).hexdigest()
+        while True:
+            run, is_new = self.store.begin(scope_key, fingerprint)
+            if run.fingerprint != fingerprint:
+                metrics.increment("idempotency_requests_total", outcome="conflict")
+                await FastJSONResponse(status_code=422, content={
+                    "detail": "Idempotency-Key was already used for a different request"})(scope, receive, send)
+                return
+            if is_new:
+                metrics.increment("idempotency_requests_total", outcome="new")
+                await self._run(scope_key, run, scope, body, receive, send)
+                return
+            if not run.done.is_set():
+                metrics.increment("idempotency_requests_total", outcome="attached")
+                logger.info(f"Request with Idempotency-Key {key} attached to the run in progress")
+                if not await self._wait(run, receive):
+                    # Our own client went away; the original carries on for whoever else is waiting
+                    metrics.increment("idempotency_requests_total", outcome="abandoned")
+                    return
+            if run.response is not None:
+                metrics.increment("idempotency_requests_total", outcome="replayed")
+                await self._replay(run.response, send)
+                return
+            # The original failed or was evicted: try to carry it out ourselves
+
+    async def _run(self, scope_key: Tuple[str, str], run: IdempotentRun, scope: Scope,
+                   body: bytes, receive: Receive, send: Send) -> None:
+        """Pass the request on, keeping a copy of a successful response"""
+        body_sent = False
+
+        async def replay_body() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # After the body, the app only listens for the client disconnecting
+            return await receive()
+
+        status = 500
+        headers: List[Tuple[bytes, bytes]] = []
+        chunks: List[bytes] = []
+
+        async def capture(message: Message) -> None:
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status, headers = message["status"], list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        response = None
+        try:
+            await self.app(scope, replay_body, capture)
+            if 200 <= status < 300:
+                response = (status, headers, b"".join(chunks))
+        finally:
+            self.store.complete(scope_key, run, response)
+
+    @staticmethod
+    async def _wait(run: IdempotentRun, receive: Receive) -> bool:
+        """Wait for the original to finish; False if the client disconnects first"""
+        async def disconnected() -> None:
+            # The body has been read, so all that can arrive now is the disconnect
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        done = asyncio.ensure_future(run.done.wait())
+        watcher = asyncio.ensure_future(disconnected())
+        try:
+            await asyncio.wait({done, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            done.cancel()
+            watcher.cancel()
+        return run.done.is_set()
+
+    @staticmethod
+    async def _read_body(receive: Receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    @staticmethod
+    async def _replay(response: Tuple[int, List[Tuple[bytes, bytes]], bytes], send: Send) -> None:
+        status, headers, body = response
+        await send({"type": "http.response.start", "status": status,
+                    "headers": headers + [(b"idempotent-replayed", b"true")]})
+        await send({"type": "http.response.body", "body": body})
+
+# Global idempotency store instance
+idempotency_store = IdempotencyStore()
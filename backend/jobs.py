@@ -0,0 +1,221 @@
+"""
+Asynchronous seminar jobs.
+A submitted seminar is queued and run by a bounded pool of background workers, so it
+outlives the request that started it. Clients poll for status and results, or follow
+progress over Server-Sent Events or the conversation's WebSocket channel.
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Any, AsyncGenerator
+
+from metrics import metrics
+from quotas import quota_engine, QuotaReservation, total_usage
+from seminar import SeminarRunner
+from task_registry import conversation_tasks
+from websocket_manager import manager
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+class JobRejected(Exception):
+    """Raised when a job cannot be accepted right now"""
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+class SeminarJob:
+    """One queued or running seminar, with the events it has produced so far"""
+    def __init__(self, owner: str, runner: SeminarRunner, reservation: QuotaReservation):
+        self.id = str(uuid.uuid4())
+        self.owner = owner
+        self.runner = runner
+        self.reservation = reservation
+        self.status = QUEUED
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.finished_monotonic: Optional[float] = None
+        self.rounds_completed = 0
+        # Every event, for SSE clients that connect late or reconnect
+        self.events: List[Dict[str, Any]] = []
+        self._changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def conversation_id(self) -> str:
+        return self.runner.conversation_id
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def record(self, event: Dict[str, Any]) -> None:
+        self.events.append(event)
+        if event["type"] == "round_completed":
+            self.rounds_completed = event["round"]
+        # Wake everyone following the job, then start a fresh wait for the next event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self, after: int = 0) -> AsyncGenerator[Dict[str, Any], None]:
+        """Events after the first `after`, then new ones as they happen, until the job finishes"""
+        position = after
+        while True:
+            changed = self._changed
+            while position < len(self.events):
+                yield self.events[position]
+                position += 1
+            if self.finished:
+                return
+            await changed.wait()
+
+    def to_dict(self) -> Dict[str, Any]:
+        status = {
+            "job_id": self.id,
+            "status": self.status,
+            "conversation_id": self.conversation_id,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "progress": {"rounds_completed": self.rounds_completed, "answers": len(self.runner.answers)},
+        }
+        if self.error:
+            status["error"] = self.error
+        return status
+
+class JobManager:
+    def __init__(self):
+        self.worker_count = int(os.getenv("SEMINAR_JOB_WORKERS", "4"))
+        self.queue_size = int(os.getenv("SEMINAR_JOB_QUEUE_SIZE", "100"))
+        self.max_per_user = int(os.getenv("SEMINAR_JOB_MAX_PER_USER", "2"))
+        # Finished jobs (and their results) are kept this long for polling
+        self.result_ttl = float(os.getenv("SEMINAR_JOB_RESULT_TTL", "3600"))
+        # Structure: {job_id: SeminarJob}, in submission order
+        self.jobs: "OrderedDict[str, SeminarJob]" = OrderedDict()
+        # Structure: {owner: number of queued or running jobs}
+        self.in_flight: Dict[str, int] = {}
+        self.queue: Optional[asyncio.Queue] = None
+        self.workers: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self.stop()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.workers = [asyncio.create_task(self._work()) for _ in range(self.worker_count)]
+
+    def stop(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+
+    def submit(self, owner: str, runner: SeminarRunner, reservation: QuotaReservation) -> SeminarJob:
+        """Queue a seminar. Raises JobRejected if the owner has too many in flight or the queue is full."""
+        self._evict_expired()
+        if self.in_flight.get(owner, 0) >= self.max_per_user:
+            metrics.increment("seminar_jobs_rejected_total", reason="per_user_limit")
+            raise JobRejected(f"Too many seminar jobs in progress (at most {self.max_per_user})", 30)
+        job = SeminarJob(owner, runner, reservation)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            metrics.increment("seminar_jobs_rejected_total", reason="queue_full")
+            raise JobRejected("The job queue is full", 30)
+        self.jobs[job.id] = job
+        self.in_flight[owner] = self.in_flight.get(owner, 0) + 1
+        self._publish()
+        logger.info(f"Queued seminar job {job.id} for conversation {job.conversation_id}")
+        return job
+
+    def get(self, job_id: str, owner: str) -> Optional[SeminarJob]:
+        """A job, if it exists and belongs to `owner`"""
+        self._evict_expired()
+        job = self.jobs.get(job_id)
+        return job if job is not None and job.owner == owner else None
+
+    def cancel(self, job: SeminarJob) -> None:
+        if job.finished:
+            return
+        if job.task is not None:
+            conversation_tasks.cancel_task(job.task, CANCELLED)
+        else:
+            # Still queued: the worker skips it
+            self._finish(job, CANCELLED)
+
+    async def _work(self) -> None:
+        while True:
+            job = await self.queue.get()
+            if job.finished:
+                continue
+            job.task = asyncio.create_task(self._run(job))
+            try:
+                await asyncio.shield(job.task)
+            except asyncio.CancelledError:
+                if not job.task.done():
+                    # The worker itself is stopping
+                    job.task.cancel()
+                    raise
+
+    async def _run(self, job: SeminarJob) -> None:
+        job.status = RUNNING
+        job.started_at = datetime.utcnow()
+        self._publish()
+        try:
+            await self._broadcast_status(job)
+            # Jobs outlive their clients, so only a newer seminar, deletion or DELETE /jobs cancels them
+            with conversation_tasks.track(job.conversation_id):
+                async for event in job.runner.run():
+                    job.record(event)
+                    await manager.publish_seminar_event(job.conversation_id, event)
+            job.record(dict(job.runner.summary(), type="seminar_summary"))
+            self._finish(job, SUCCEEDED)
+        except asyncio.CancelledError:
+            self._finish(job, CANCELLED, conversation_tasks.cancel_reason())
+        except Exception as e:
+            logger.error(f"Seminar job {job.id} failed: {str(e)}")
+            self._finish(job, FAILED, str(e))
+        await self._broadcast_status(job)
+
+    def _finish(self, job: SeminarJob, status: str, error: Optional[str] = None) -> None:
+        job.status = status
+        job.error = error
+        job.finished_at = datetime.utcnow()
+        job.finished_monotonic = time.monotonic()
+        quota_engine.reconcile(job.reservation, total_usage(job.runner.answers))
+        remaining = self.in_flight.get(job.owner, 1) - 1
+        if remaining > 0:
+            self.in_flight[job.owner] = remaining
+        else:
+            self.in_flight.pop(job.owner, None)
+        job.record({"type": "job_status", **job.to_dict()})
+        metrics.increment("seminar_jobs_total", outcome=status)
+        self._publish()
+        logger.info(f"Seminar job {job.id} {status}")
+
+    async def _broadcast_status(self, job: SeminarJob) -> None:
+        await manager.broadcast_to_conversation(job.conversation_id, {"type": "job_status", **job.to_dict()})
+
+    def _evict_expired(self) -> None:
+        """Drop finished jobs whose results have been kept long enough"""
+        cutoff = time.monotonic() - self.result_ttl
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job.finished and job.finished_monotonic < cutoff]:
+            del self.jobs[job_id]
+
+    def _publish(self) -> None:
+        metrics.set_gauge("seminar_jobs_queued", sum(1 for job in self.jobs.values() if job.status == QUEUED))
+        metrics.set_gauge("seminar_jobs_running", sum(1 for job in self.jobs.values() if job.status == RUNNING))
+
+# Global job manager instance
+job_manager = JobManager()
@@ -0,0 +1,194 @@
+"""
+Load balancing across inference endpoints and API keys.
+Spreads upstream calls over every configured (endpoint, key) pair, tracks per-key
+rate-limit headroom and temporarily ejects pairs that return 429 or 5xx.
+"""
+
+import os
+import time
+import logging
+from typing import List, Optional, Mapping
+
+from circuit_breaker import circuit_breakers
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+HF_INFERENCE_URL = "https://api-inference.huggingface.co/models/{model}"
+
+def model_url(model: str) -> str:
+    return HF_INFERENCE_URL.format(model=model)
+
+class KeyState:
+    """Rate-limit headroom for one API key, shared by every endpoint using it"""
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.remaining: Optional[int] = None
+        self.limited_until = 0.0
+
+    def has_headroom(self, now: float) -> bool:
+        if now < self.limited_until:
+            return False
+        return self.remaining is None or self.remaining > 0
+
+    def update_from_headers(self, headers: Mapping[str, str], now: float) -> None:
+        remaining = headers.get("x-ratelimit-remaining")
+        if remaining is not None and remaining.isdigit():
+            self.remaining = int(remaining)
+            reset = headers.get("x-ratelimit-reset")
+            if self.remaining == 0 and reset is not None and reset.isdigit():
+                self.limited_until = max(self.limited_until, now + int(reset))
+
+    def throttle(self, seconds: float, now: float) -> None:
+        self.remaining = 0
+        self.limited_until = max(self.limited_until, now + seconds)
+
+class Endpoint:
+    """One (URL, API key) pair the client can send requests to"""
+    def __init__(self, model: str, url: str, key_state: KeyState, fallback: bool = False):
+        self.model = model
+        self.url = url
+        self.key_state = key_state
+        self.fallback = fallback
+        self.headers = {
+            "Authorization": f"Bearer {key_state.api_key}",
+            "Content-Type": "application/json"
+        }
+        # Short label that never exposes the full key
+        self.name = f"{url}#{key_state.api_key[-4:]}"
+
+        self.outstanding = 0
+        self.ewma_latency: Optional[float] = None
+        self.ejected_until = 0.0
+        self.consecutive_ejections = 0
+        self.last_success = 0.0
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+class LoadBalancer:
+    """Least-outstanding-requests or EWMA-latency selection over endpoint/key pairs"""
+    def __init__(self, endpoints: List[Endpoint]):
+        self.endpoints = endpoints
+        self.strategy = os.getenv("HF_BALANCER_STRATEGY", "least_outstanding")
+        self.ewma_alpha = float(os.getenv("HF_BALANCER_EWMA_ALPHA", "0.3"))
+        self.base_ejection = float(os.getenv("HF_BALANCER_EJECT_SECONDS", "10"))
+        self.max_ejection = float(os.getenv("HF_BALANCER_MAX_EJECT_SECONDS", "300"))
+        self.rate_limit_cooldown = float(os.getenv("HF_BALANCER_RATE_LIMIT_SECONDS", "30"))
+        logger.info(f"Load balancer initialized with {len(endpoints)} endpoint/key pairs ({self.strategy})")
+
+    @classmethod
+    def from_env(cls, primary_model: str, primary_key: str,
+                 fallback_model: Optional[str] = None, fallback_url: Optional[str] = None) -> "LoadBalancer":
+        """
+        Build the pool from HF_ENDPOINTS (model IDs or URLs) and HF_API_KEYS, both
+        comma-separated. Every endpoint is paired with every key.
+        """
+        keys = [primary_key] + [key.strip() for key in os.getenv("HF_API_KEYS", "").split(",") if key.strip()]
+        key_states = [KeyState(key) for key in dict.fromkeys(keys)]
+
+        targets = [target.strip() for target in os.getenv("HF_ENDPOINTS", "").split(",") if target.strip()]
+        primary = [cls._resolve_target(target, primary_model) for target in targets] or [(primary_model, model_url(primary_model))]
+
+        endpoints = [Endpoint(model, url, key_state) for model, url in primary for key_state in key_states]
+        if fallback_url:
+            endpoints.extend(Endpoint(fallback_model or primary_model, fallback_url, key_state, fallback=True)
+                             for key_state in key_states)
+        return cls(endpoints)
+
+    @staticmethod
+    def _resolve_target(target: str, default_model: str):
+        if target.startswith("http://") or target.startswith("https://"):
+            return default_model, target
+        return target, model_url(target)
+
+    def urls(self) -> List[str]:
+        return list(dict.fromkeys(endpoint.url for endpoint in self.endpoints))
+
+    def models(self) -> List[str]:
+        return list(dict.fromkeys(endpoint.model for endpoint in self.endpoints))
+
+    def endpoints_for_url(self, url: str) -> List[Endpoint]:
+        return [endpoint for endpoint in self.endpoints if endpoint.url == url]
+
+    def last_success(self, url: str) -> float:
+        """Monotonic time of the most recent successful response from any key on this URL"""
+        return max((endpoint.last_success for endpoint in self.endpoints_for_url(url)), default=0.0)
+
+    def _score(self, endpoint: Endpoint) -> float:
+        if self.strategy == "ewma":
+            # Expected wait: observed latency scaled by the queue already in front of us
+            return (endpoint.ewma_latency or 0.0) * (endpoint.outstanding + 1)
+        return endpoint.outstanding
+
+    def _rank(self, endpoint: Endpoint):
+        return (self._score(endpoint), endpoint.ewma_latency or 0.0)
+
+    def select(self, exclude: Optional[Endpoint] = None, prefer_fallback: bool = False) -> Optional[Endpoint]:
+        """
+        Pick the best endpoint whose circuit is not open. Healthy primaries win over
+        fallbacks (the other way round with `prefer_fallback`); ejected or rate-limited
+        pairs are only used when nothing else is left, soonest-recovering first.
+        Returns None when every circuit is open.
+        """
+        now = time.monotonic()
+        tiers = (True, False) if prefer_fallback else (False, True)
+        candidates = [endpoint for endpoint in self.endpoints if endpoint is not exclude]
+        healthy = [endpoint for endpoint in candidates
+                   if not endpoint.is_ejected(now) and endpoint.key_state.has_headroom(now)]
+        degraded = [endpoint for endpoint in candidates if endpoint not in healthy]
+        # Every healthy pair, tier by tier, before any degraded one of either tier
+        ranked = [endpoint for fallback in tiers
+                  for endpoint in sorted((endpoint for endpoint in healthy if endpoint.fallback == fallback),
+                                         key=self._rank)]
+        ranked += sorted(degraded, key=lambda endpoint: (max(endpoint.ejected_until, endpoint.key_state.limited_until),
+                                                         tiers.index(endpoint.fallback)))
+
+        open_urls = set()
+        for candidate in ranked:
+            if candidate.url in open_urls:
+                continue
+            if not circuit_breakers.get(candidate.url).allow_request():
+                open_urls.add(candidate.url)
+                continue
+            if candidate.fallback:
+                metrics.increment("upstream_fallback_requests_total", endpoint=candidate.url)
+            return candidate
+        return None
+
+    def acquire(self, endpoint: Endpoint) -> None:
+        endpoint.outstanding += 1
+        metrics.set_gauge("upstream_outstanding_requests", endpoint.outstanding, endpoint=endpoint.name)
+
+    def release(self, endpoint: Endpoint) -> None:
+        endpoint.outstanding = max(0, endpoint.outstanding - 1)
+        metrics.set_gauge("upstream_outstanding_requests", endpoint.outstanding, endpoint=endpoint.name)
+
+    def record_response(self, endpoint: Endpoint, status_code: int, headers: Mapping[str, str],
+                        latency: Optional[float] = None) -> None:
+        """Feed an upstream response back into latency, headroom and ejection state"""
+        now = time.monotonic()
+        endpoint.key_state.update_from_headers(headers, now)
+
+        if status_code == 429:
+            retry_after = headers.get("retry-after")
+            cooldown = float(retry_after) if retry_after and retry_after.isdigit() else self.rate_limit_cooldown
+            endpoint.key_state.throttle(cooldown, now)
+            self._eject(endpoint, now)
+        elif status_code >= 500:
+            self._eject(endpoint, now)
+        elif status_code < 400:
+            endpoint.consecutive_ejections = 0
+            endpoint.last_success = now
+            if latency is not None:
+                if endpoint.ewma_latency is None:
+                    endpoint.ewma_latency = latency
+                else:
+                    endpoint.ewma_latency += self.ewma_alpha * (latency - endpoint.ewma_latency)
+
+    def _eject(self, endpoint: Endpoint, now: float) -> None:
+        endpoint.consecutive_ejections += 1
+        duration = min(self.max_ejection, self.base_ejection * 2 ** (endpoint.consecutive_ejections - 1))
+        endpoint.ejected_until = now + duration
+        metrics.increment("upstream_ejections_total", endpoint=endpoint.name)
+        logger.warning(f"Ejected {endpoint.name} for {duration:.0f}s")
@@ -24,7 +24,8 @@ class MemoryManager:
             "response": response
         })
     
-    def get_context(self, conversation_id: str, agent_id: str, other_agents: bool = True) -> str:
+    def get_context(self, conversation_id: str, agent_id: str, other_agents: bool = True,
+                    memory_depth: Optional[int] = None) -> str:
         """
         Get conversation context for an agent.
         
@@ -32,6 +33,7 @@ class MemoryManager:
             conversation_id: Unique identifier for the conversation
             agent_id: The agent requesting context
             other_agents: Whether to include exchanges from other agents
+            memory_depth: Optional override of the agent's configured memory depth
             
         Returns:
             Formatted context string
@@ -41,7 +43,8 @@ class MemoryManager:
             
         # Get agent-specific parameters
         params = get_agent_params(agent_id)
-        memory_depth = params.get("memory_depth", 5)
+        if memory_depth is None:
+            memory_depth = params.get("memory_depth", 5)
         
         # Collect relevant exchanges
         exchanges = []
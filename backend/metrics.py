@@ -0,0 +1,53 @@
+"""
+Lightweight in-process metrics registry.
+Collects counters and gauges that are exported through the /metrics endpoint.
+"""
+
+import threading
+from typing import Dict, Tuple, Any
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+class MetricsRegistry:
+    def __init__(self):
+        # Structure: {metric_name: {label_key: value}}
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _label_key(labels: Dict[str, Any]) -> LabelKey:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def increment(self, name: str, amount: float = 1, **labels) -> None:
+        """Increase a counter, creating it on first use."""
+        key = self._label_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        """Set a gauge to an absolute value."""
+        key = self._label_key(labels)
+        with self._lock:
+            self.gauges.setdefault(name, {})[key] = value
+
+    def get_counter(self, name: str, **labels) -> float:
+        """Read the current value of a counter (0 if never incremented)."""
+        key = self._label_key(labels)
+        with self._lock:
+            return self.counters.get(name, {}).get(key, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a JSON-serializable copy of every metric."""
+        def render(metrics: Dict[str, Dict[LabelKey, float]]) -> Dict[str, Any]:
+            return {
+                name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                for name, series in metrics.items()
+            }
+
+        with self._lock:
+            return {"counters": render(self.counters), "gauges": render(self.gauges)}
+
+# Global metrics registry instance
+metrics = MetricsRegistry()
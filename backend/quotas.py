@@ -0,0 +1,146 @@
+"""
+Token-cost quotas.
+Charges each caller the estimated upstream tokens of a request at admission, then
+reconciles with the tokens actually used, against per-minute and per-day budgets.
+"""
+
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Any
+
+from agent_config import get_agent_params
+from rate_limit import TokenBucket
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Rough per-call prompt overhead: system prompt, group-chat instructions, few-shot examples and memory
+PROMPT_OVERHEAD_TOKENS = int(os.getenv("QUOTA_PROMPT_OVERHEAD_TOKENS", "1000"))
+# Conversation context carried into follow-up rounds (the agent manager truncates near this size)
+FOLLOW_UP_CONTEXT_TOKENS = int(os.getenv("QUOTA_FOLLOW_UP_CONTEXT_TOKENS", "1500"))
+
+def estimate_tokens(text: str) -> int:
+    """Rough estimate: 4 chars ≈ 1 token"""
+    return len(text) // 4
+
+def estimate_seminar_tokens(question: str,
+                            agent_ids: List[str],
+                            follow_up_rounds: int = 0,
+                            agents_per_follow_up: int = 0) -> int:
+    """
+    Upper-bound cost of a seminar: every agent answers the question once, then
+    `agents_per_follow_up` agents answer in each of `follow_up_rounds` further rounds.
+    Each call costs its prompt plus the agent's full `max_tokens` completion.
+    """
+    if not agent_ids:
+        return 0
+    completions = [get_agent_params(agent_id).get("max_tokens", 500) for agent_id in agent_ids]
+    first_round = sum(estimate_tokens(question) + PROMPT_OVERHEAD_TOKENS + completion for completion in completions)
+    follow_up_call = PROMPT_OVERHEAD_TOKENS + FOLLOW_UP_CONTEXT_TOKENS + max(completions)
+    return first_round + follow_up_rounds * agents_per_follow_up * follow_up_call
+
+def total_usage(responses: List[Dict[str, Any]]) -> int:
+    """Sum the upstream tokens reported on agent responses"""
+    return sum(response.get("usage", {}).get("total_tokens", 0) for response in responses)
+
+class QuotaExceededError(Exception):
+    """Raised when a request would exceed the caller's token budget"""
+    def __init__(self, budget: str, retry_after: float):
+        super().__init__(f"Token quota exceeded ({budget} budget)")
+        self.budget = budget
+        self.retry_after = retry_after
+
+class QuotaReservation:
+    """Tokens charged at admission, waiting to be reconciled with actual usage"""
+    def __init__(self, key: str, kind: str, estimated_tokens: int):
+        self.key = key
+        self.kind = kind
+        self.estimated_tokens = estimated_tokens
+        self.reconciled = False
+
+class TokenBudget:
+    """Per-key token buckets for one budget period; buckets may go into debt"""
+    def __init__(self, name: str, capacity: int, period_seconds: float, max_keys: int = 100000):
+        self.name = name
+        self.capacity = capacity
+        self.refill_rate = capacity / period_seconds
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def _bucket(self, key: str, now: float) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self.buckets.popitem(last=False)
+            bucket = TokenBucket(self.capacity, now)
+            self.buckets[key] = bucket
+        else:
+            bucket.refill(self.capacity, self.refill_rate, now)
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def shortfall_wait(self, key: str, tokens: int, now: float) -> float:
+        """
+        Seconds until the request can be admitted. A request larger than the whole
+        budget only needs a full bucket, and then runs the bucket into debt.
+        """
+        bucket = self._bucket(key, now)
+        needed = min(tokens, self.capacity)
+        if bucket.tokens >= needed:
+            return 0.0
+        return (needed - bucket.tokens) / self.refill_rate
+
+    def adjust(self, key: str, tokens: int, now: float) -> None:
+        """Charge (positive) or refund (negative) tokens"""
+        bucket = self._bucket(key, now)
+        bucket.tokens = min(self.capacity, bucket.tokens - tokens)
+
+class QuotaEngine:
+    """Per-minute and per-day token budgets for authenticated users and anonymous IPs"""
+    def __init__(self):
+        self.enabled = os.getenv("QUOTA_ENABLED", "true").lower() == "true"
+        self.budgets: Dict[str, List[TokenBudget]] = {
+            "user": [
+                TokenBudget("minute", int(os.getenv("QUOTA_USER_TOKENS_PER_MINUTE", "60000")), 60),
+                TokenBudget("day", int(os.getenv("QUOTA_USER_TOKENS_PER_DAY", "1000000")), 86400),
+            ],
+            "ip": [
+                TokenBudget("minute", int(os.getenv("QUOTA_IP_TOKENS_PER_MINUTE", "20000")), 60),
+                TokenBudget("day", int(os.getenv("QUOTA_IP_TOKENS_PER_DAY", "200000")), 86400),
+            ],
+        }
+
+    def reserve(self, kind: str, key: str, estimated_tokens: int) -> QuotaReservation:
+        """Charge the estimated cost up front, or raise QuotaExceededError"""
+        reservation = QuotaReservation(key, kind, estimated_tokens)
+        if not self.enabled:
+            return reservation
+
+        now = time.monotonic()
+        for budget in self.budgets[kind]:
+            wait = budget.shortfall_wait(key, estimated_tokens, now)
+            if wait > 0:
+                metrics.increment("quota_rejections_total", key_type=kind, budget=budget.name)
+                logger.warning(f"Token quota ({budget.name}) exceeded for {key}: needs {estimated_tokens} tokens")
+                raise QuotaExceededError(budget.name, wait)
+
+        for budget in self.budgets[kind]:
+            budget.adjust(key, estimated_tokens, now)
+        metrics.increment("quota_reserved_tokens_total", estimated_tokens, key_type=kind)
+        return reservation
+
+    def reconcile(self, reservation: QuotaReservation, actual_tokens: int) -> None:
+        """Replace the admission estimate with the tokens actually used"""
+        if not self.enabled or reservation.reconciled:
+            return
+        reservation.reconciled = True
+        now = time.monotonic()
+        difference = actual_tokens - reservation.estimated_tokens
+        for budget in self.budgets[reservation.kind]:
+            budget.adjust(reservation.key, difference, now)
+        metrics.increment("quota_used_tokens_total", actual_tokens, key_type=reservation.kind)
+
+# Global quota engine instance
+quota_engine = QuotaEngine()
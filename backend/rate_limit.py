@@ -0,0 +1,125 @@
+"""
+Token-bucket rate limiting for the API.
+Each client key (user ID from the JWT, or IP address) gets a bucket that refills
+continuously, so every check is O(1) and idle buckets are reclaimed in LRU order.
+"""
+
+import os
+import math
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from starlette.requests import HTTPConnection
+
+from auth import verify_access_token
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Bucket holding up to `capacity` tokens, refilled at `refill_rate` tokens per second"""
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated_at = now
+
+    def refill(self, capacity: float, refill_rate: float, now: float) -> None:
+        self.tokens = min(capacity, self.tokens + (now - self.updated_at) * refill_rate)
+        self.updated_at = now
+
+class RateLimitDecision:
+    """Outcome of a rate-limit check, with everything needed for the response headers"""
+    def __init__(self, allowed: bool, limit: int, remaining: int, reset_after: float, retry_after: float):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_after = reset_after
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+class RateLimiter:
+    """
+    Token buckets keyed by client. `capacity` requests may burst at once and the bucket
+    refills to full over `window_seconds`, which matches the old "N requests per hour".
+    """
+    def __init__(self, capacity: int, window_seconds: float, max_keys: int = 100000):
+        self.capacity = capacity
+        self.window_seconds = window_seconds
+        self.refill_rate = capacity / window_seconds
+        self.max_keys = max_keys
+        # Least recently used keys first, so idle buckets are reclaimed from the front
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def check(self, key: str, cost: float = 1.0) -> RateLimitDecision:
+        now = time.monotonic()
+        self._reclaim(now)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.capacity, now)
+            self.buckets[key] = bucket
+        else:
+            bucket.refill(self.capacity, self.refill_rate, now)
+            self.buckets.move_to_end(key)
+
+        allowed = bucket.tokens >= cost
+        if allowed:
+            bucket.tokens -= cost
+        retry_after = 0.0 if allowed else (cost - bucket.tokens) / self.refill_rate
+        reset_after = (self.capacity - bucket.tokens) / self.refill_rate
+        return RateLimitDecision(allowed, self.capacity, int(bucket.tokens), reset_after, retry_after)
+
+    def _reclaim(self, now: float) -> None:
+        """Drop buckets that have refilled completely (indistinguishable from new ones) or exceed the key cap"""
+        while self.buckets:
+            key, bucket = next(iter(self.buckets.items()))
+            idle_full = bucket.tokens + (now - bucket.updated_at) * self.refill_rate >= self.capacity
+            if not idle_full and len(self.buckets) <= self.max_keys:
+                break
+            del self.buckets[key]
+
+def rate_limit_key(request: HTTPConnection) -> Tuple[str, str]:
+    """
+    Identify the caller: the user ID from a valid bearer token, otherwise the client IP.
+    WebSocket clients, which cannot set headers from a browser, pass the token as `access_token`.
+    Returns (kind, key).
+    """
+    authorization = request.headers.get("authorization", "")
+    token = authorization[7:] if authorization.lower().startswith("bearer ") else request.query_params.get("access_token")
+    if token:
+        token_data = verify_access_token(token)
+        if token_data is not None:
+            return "user", f"user:{token_data.id}"
+    ip = request.client.host if request.client else "unknown"
+    return "ip", f"ip:{ip}"
+
+class RateLimitPolicy:
+    """Separate limits for authenticated users and anonymous IPs"""
+    def __init__(self):
+        window = float(os.getenv("RATE_LIMIT_WINDOW_SECONDS", "3600"))
+        self.limiters: Dict[str, RateLimiter] = {
+            "ip": RateLimiter(int(os.getenv("RATE_LIMIT_IP_REQUESTS", "60")), window),
+            "user": RateLimiter(int(os.getenv("RATE_LIMIT_USER_REQUESTS", "120")), window),
+        }
+
+    def check(self, request: HTTPConnection) -> RateLimitDecision:
+        kind, key = rate_limit_key(request)
+        decision = self.limiters[kind].check(key)
+        if not decision.allowed:
+            metrics.increment("rate_limit_rejections_total", key_type=kind)
+            logger.warning(f"Rate limit exceeded for {key}")
+        return decision
+
+# Global rate limit policy instance
+rate_limit_policy = RateLimitPolicy()
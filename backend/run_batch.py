@@ -0,0 +1,142 @@
+"""
+Run seminars offline, in-process, for dataset generation and regression runs.
+
+Reads questions from a JSONL file in the prompts/*.jsonl format ({"prompt": "... ++++",
+"completion": "... ####"}; the completion, if any, is kept as the reference answer). A line
+may also set "id", "agent_ids", "auto_conversation" and "max_rounds". Results are appended
+to the output as each seminar finishes, and a checkpoint file records finished items so an
+interrupted run picks up where it stopped.
+
+Usage: python run_batch.py questions.jsonl results.jsonl --agents socrates,einstein [--concurrency 8]
+"""
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+import logging
+from typing import Dict, Iterator, Optional, TextIO
+
+from dotenv import load_dotenv
+
+from agent_manager import AgentManager
+from agent_prompts import load_prompts, PROMPT_END, COMPLETION_END
+from batch import BatchScheduler, BatchItem, BatchStats
+from huggingface_client import HuggingFaceClient
+
+logger = logging.getLogger(__name__)
+
+def strip_marker(text: str, marker: str) -> str:
+    text = text.strip()
+    return text[:-len(marker)].strip() if text.endswith(marker) else text
+
+def read_checkpoint(path: str) -> Dict[str, str]:
+    """Finished items as {item_id: status}; later lines win"""
+    finished: Dict[str, str] = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                item_id, _, status = line.rstrip("\n").partition("\t")
+                if item_id:
+                    finished[item_id] = status
+    return finished
+
+def read_items(path: str, args: argparse.Namespace, finished: Dict[str, str],
+               references: Dict[str, str]) -> Iterator[BatchItem]:
+    """Items still to run, read lazily so large inputs are never held in memory"""
+    default_agents = [agent for agent in (args.agents or "").split(",") if agent]
+    with open(path) as f:
+        for line_number, line in enumerate(f):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            item_id = str(record.get("id", line_number))
+            status = finished.get(item_id)
+            if status == "succeeded" or (status and not args.retry_failed):
+                continue
+            agent_ids = record.get("agent_ids") or default_agents
+            if not agent_ids:
+                raise ValueError(f"Line {line_number + 1} has no agent_ids and --agents was not given")
+            if record.get("completion"):
+                references[item_id] = strip_marker(record["completion"], COMPLETION_END)
+            yield BatchItem(line_number, strip_marker(record["prompt"], PROMPT_END), agent_ids, item_id,
+                            record.get("auto_conversation", args.auto_conversation),
+                            record.get("max_rounds", args.max_rounds))
+
+def write_result(output: TextIO, result: Dict, reference: Optional[str], output_format: str) -> None:
+    if output_format == "prompts":
+        # One training pair per answer, in the same format as prompts/*.jsonl
+        for answer in result.get("result", {}).get("answers", []):
+            if answer["agent"] != "system":
+                output.write(json.dumps({
+                    "prompt": f"{result['question']} {PROMPT_END}",
+                    "completion": f" {answer['response']} {COMPLETION_END}",
+                    "agent": answer["agent"],
+                    "id": result["id"],
+                }, ensure_ascii=False) + "\n")
+    else:
+        record = {key: value for key, value in result.items() if key not in ("type", "index")}
+        if reference is not None:
+            record["reference"] = reference
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+    output.flush()
+
+async def run(args: argparse.Namespace) -> BatchStats:
+    load_dotenv()
+    api_key = os.getenv("HUGGINGFACE_API_KEY")
+    if not api_key:
+        raise SystemExit("HUGGINGFACE_API_KEY environment variable is not set")
+    client = HuggingFaceClient(api_key=api_key)
+    am = AgentManager(client, load_prompts())
+
+    checkpoint_path = args.checkpoint or f"{args.output}.checkpoint"
+    if args.restart:
+        for path in (args.output, checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+    finished = read_checkpoint(checkpoint_path)
+    if finished:
+        logger.info(f"Resuming: {len(finished)} item(s) already finished")
+    references: Dict[str, str] = {}
+    stats = BatchStats()
+    scheduler = BatchScheduler(args.concurrency)
+    try:
+        with open(args.output, "a") as output, open(checkpoint_path, "a") as checkpoint:
+            async for result in scheduler.run(am, read_items(args.input, args, finished, references)):
+                stats.add(result)
+                write_result(output, result, references.pop(result["id"], None), args.format)
+                # The checkpoint is written after the result, so a finished item is never lost
+                checkpoint.write(f"{result['id']}\t{result['status']}\n")
+                checkpoint.flush()
+                if args.progress and stats.succeeded + stats.failed and (stats.succeeded + stats.failed) % args.progress == 0:
+                    logger.info(f"{stats.succeeded + stats.failed} item(s) done, {stats.failed} failed")
+    finally:
+        await client.aclose()
+    return stats
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="questions, one JSON object per line")
+    parser.add_argument("output", help="results file, appended to as items finish")
+    parser.add_argument("--agents", help="comma-separated agent IDs for lines without agent_ids")
+    parser.add_argument("--concurrency", type=int, default=8, help="seminars in flight at once")
+    parser.add_argument("--auto-conversation", action="store_true", help="run follow-up rounds")
+    parser.add_argument("--max-rounds", type=int, default=3)
+    parser.add_argument("--format", choices=("seminar", "prompts"), default="seminar",
+                        help="one record per seminar, or one prompts/*.jsonl-style pair per answer")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: OUTPUT.checkpoint)")
+    parser.add_argument("--retry-failed", action="store_true", help="run items that failed last time again")
+    parser.add_argument("--restart", action="store_true", help="discard the output and checkpoint and start over")
+    parser.add_argument("--progress", type=int, default=50, help="log progress every N items (0 to disable)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        stats = asyncio.run(run(args))
+    except KeyboardInterrupt:
+        sys.exit("Interrupted; run the same command again to resume")
+    print(json.dumps(stats.to_dict(), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+"""
+Seminar orchestration shared by the HTTP endpoints and the WebSocket command channel.
+A runner executes one seminar and yields events as it goes: rounds starting, agents
+answering or failing, and the seminar finishing. A seminar with a deadline stops when it
+runs out of time and keeps what finished, marked partial.
+"""
+
+import asyncio
+import random
+import logging
+from typing import Dict, List, Optional, Any, AsyncIterator
+
+from agent_manager import AgentManager
+from brownout import DegradationPolicy, DEGRADATION_LEVELS
+from deadline import Deadline, deadline_scope
+from huggingface_client import DeadlineExceeded
+from metrics import metrics
+from quotas import estimate_seminar_tokens
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for rounds requested through a round policy update
+MAX_ROUNDS = 10
+
+class SeminarFailed(Exception):
+    """Raised when no agent produced a first-round answer"""
+
+class RoundPolicy:
+    """How a seminar continues after the first round. It may be changed while the seminar runs."""
+    def __init__(self, auto_conversation: bool = False, max_rounds: int = 3, agents_per_round: Optional[int] = None):
+        self.auto_conversation = bool(auto_conversation)
+        self.max_rounds = max_rounds
+        self.agents_per_round = agents_per_round
+
+    def update(self,
+               auto_conversation: Optional[bool] = None,
+               max_rounds: Optional[int] = None,
+               agents_per_round: Optional[int] = None) -> None:
+        """Apply a client-requested change. Raises ValueError for out-of-range values."""
+        if max_rounds is not None and (not isinstance(max_rounds, int) or not 1 <= max_rounds <= MAX_ROUNDS):
+            raise ValueError(f"max_rounds must be between 1 and {MAX_ROUNDS}")
+        if agents_per_round is not None and (not isinstance(agents_per_round, int) or agents_per_round < 1):
+            raise ValueError("agents_per_round must be a positive integer")
+        if auto_conversation is not None:
+            self.auto_conversation = bool(auto_conversation)
+        if max_rounds is not None:
+            self.max_rounds = max_rounds
+        if agents_per_round is not None:
+            self.agents_per_round = agents_per_round
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "auto_conversation": self.auto_conversation,
+            "max_rounds": self.max_rounds,
+            "agents_per_round": self.agents_per_round,
+        }
+
+# Helper function to build conversation context for an agent
+def build_agent_context(conversation_context, agent_id):
+    # Format the conversation context for the agent
+    formatted_context = "Previous conversation:\n\n"
+
+    for message in conversation_context:
+        role = message.get("agent", message.get("role", "unknown"))
+        content = message.get("content", "")
+        formatted_context += f"{role.title()}: {content}\n\n"
+
+    return formatted_context
+
+class SeminarRunner:
+    """
+    The authenticated seminar flow: every agent answers the question concurrently, then,
+    with auto-conversation, 2-3 randomly chosen agents respond to the discussion in each
+    further round.
+    """
+    def __init__(self,
+                 am: AgentManager,
+                 conversation_id: str,
+                 question: str,
+                 agent_ids: List[str],
+                 direct_mention: Optional[str] = None,
+                 policy: Optional[RoundPolicy] = None,
+                 degradation: Optional[DegradationPolicy] = None,
+                 paced: bool = True,
+                 deadline: Optional[Deadline] = None):
+        self.am = am
+        # Pauses between turns make a live discussion read naturally; batch runs skip them
+        self.paced = paced
+        self.conversation_id = conversation_id
+        self.question = question
+        self.policy = policy or RoundPolicy()
+        self.degradation = degradation or DEGRADATION_LEVELS[0]
+        self.deadline = deadline
+        # Set when the deadline cut the seminar short
+        self.partial = False
+
+        # If a specific agent is mentioned, prioritize getting their response first
+        agent_ids = list(agent_ids)
+        if direct_mention and direct_mention in agent_ids:
+            agent_ids.remove(direct_mention)
+            agent_ids.insert(0, direct_mention)
+            logger.info(f"Direct mention detected for agent: {direct_mention}")
+        self.agent_ids = self.degradation.limit_agents(agent_ids)
+
+        # Initial user message
+        self.conversation_context = [{"role": "user", "content": question, "agent": "user"}]
+        self.first_round: List[Dict[str, Any]] = []
+        self.rounds: List[List[Dict[str, Any]]] = []
+        self.closing_message: Optional[Dict[str, Any]] = None
+
+    @property
+    def answers(self) -> List[Dict[str, Any]]:
+        """Every agent answer so far, first round first"""
+        return self.first_round + [answer for round_answers in self.rounds for answer in round_answers]
+
+    def transcript(self) -> List[Dict[str, Any]]:
+        """Answers followed by the closing system message, as returned by /seminar"""
+        return self.answers + ([self.closing_message] if self.closing_message else [])
+
+    def summary(self) -> Dict[str, Any]:
+        """The finished seminar as returned by /seminar"""
+        return {"conversation_id": self.conversation_id, "answers": self.transcript(),
+                "degradation_level": self.degradation.level, "partial": self.partial}
+
+    def follow_up_rounds(self) -> int:
+        """Rounds after the first, as the policy currently allows"""
+        if not self.policy.auto_conversation or len(self.agent_ids) < 2:
+            return 0
+        return self.degradation.limit_follow_up_rounds(self.policy.max_rounds - 1)
+
+    def agents_per_follow_up(self) -> int:
+        count = min(self.policy.agents_per_round or 3, len(self.agent_ids))
+        return len(self.degradation.limit_follow_up_agents(self.agent_ids[:count]))
+
+    def estimated_tokens(self) -> int:
+        """Worst-case token cost, charged against the caller's quota up front"""
+        return estimate_seminar_tokens(self.question, self.agent_ids, self.follow_up_rounds(), self.agents_per_follow_up())
+
+    async def run(self) -> AsyncIterator[Dict[str, Any]]:
+        yield {"type": "seminar_started", "agents": self.agent_ids, "policy": self.policy.to_dict(),
+               "degradation_level": self.degradation.level}
+        async for event in self._first_round():
+            yield event
+        if not self.first_round and not self.partial:
+            raise SeminarFailed("Failed to get any valid responses")
+        if self.first_round:
+            async for event in self._follow_up_rounds():
+                yield event
+        yield {"type": "seminar_completed", "rounds": 1 + len(self.rounds), "answers": len(self.answers),
+               "partial": self.partial}
+
+    async def run_to_end(self) -> None:
+        """Run the whole seminar without following its events"""
+        async for _ in self.run():
+            pass
+
+    def _cut_short(self) -> None:
+        if not self.partial:
+            self.partial = True
+            metrics.increment("deadline_exceeded_total", stage="seminar")
+            logger.info(f"Seminar {self.conversation_id} ran out of time after {len(self.answers)} answer(s)")
+
+    def _out_of_time(self) -> bool:
+        """Whether the seminar must stop now and return what it has"""
+        if self.deadline is not None and self.deadline.expired:
+            self._cut_short()
+        return self.partial
+
+    async def _ask(self, agent_id: str, question: str, **kwargs) -> Dict[str, Any]:
+        """One agent's answer; retries and the upstream timeout are bounded by the seminar's deadline"""
+        with deadline_scope(self.deadline):
+            return await self.am.get_response(agent_id, question, self.conversation_id,
+                                              degradation=self.degradation, **kwargs)
+
+    async def _pause(self, seconds: float) -> None:
+        await asyncio.sleep(self.deadline.bound(seconds) if self.deadline is not None else seconds)
+
+    def _context_entry(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "role": "assistant",
+            "content": f"{response['agent']}: {response['response']}",
+            "agent": response["agent"]
+        }
+
+    async def _first_round(self) -> AsyncIterator[Dict[str, Any]]:
+        """All agents answer concurrently; answers are yielded as they complete"""
+        yield {"type": "round_started", "round": 1, "agents": self.agent_ids}
+        tasks = {asyncio.create_task(self._ask(agent_id, self.question)): agent_id for agent_id in self.agent_ids}
+        for agent_id in self.agent_ids:
+            yield {"type": "agent_started", "round": 1, "agent": agent_id}
+        answers: Dict[str, Dict[str, Any]] = {}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=self.deadline.remaining() if self.deadline else None,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Out of time: agents still working are abandoned
+                    self._cut_short()
+                    for task in pending:
+                        yield {"type": "agent_error", "round": 1, "agent": tasks[task], "error": str(DeadlineExceeded())}
+                    break
+                for task in done:
+                    agent_id = tasks[task]
+                    if task.exception() is not None:
+                        if isinstance(task.exception(), DeadlineExceeded):
+                            self._cut_short()
+                        yield {"type": "agent_error", "round": 1, "agent": agent_id, "error": str(task.exception())}
+                        continue
+                    answers[agent_id] = task.result()
+                    yield {"type": "agent_response", "round": 1, "answer": task.result()}
+        finally:
+            for task in pending:
+                task.cancel()
+
+        # Keep the requested agent order (direct mention first) rather than completion order
+        self.first_round = [answers[agent_id] for agent_id in self.agent_ids if agent_id in answers]
+        for response in self.first_round:
+            self.conversation_context.append(self._context_entry(response))
+        yield {"type": "round_completed", "round": 1}
+
+    def _pick_responders(self) -> List[str]:
+        # In each round, randomly select a subset of agents to respond
+        # This makes the conversation more natural (not everyone responds to everything)
+        responding_agents = self.agent_ids.copy()
+        if self.policy.agents_per_round:
+            responding_agents = random.sample(responding_agents, min(self.policy.agents_per_round, len(responding_agents)))
+        elif len(responding_agents) > 3:
+            # Select 2-3 agents randomly
+            num_to_select = min(random.randint(2, 3), len(responding_agents))
+            responding_agents = random.sample(responding_agents, num_to_select)
+        return self.degradation.limit_follow_up_agents(responding_agents)
+
+    def _continue_prompt(self, agent_id: str) -> str:
+        # Generate prompt for continuing the conversation
+        agent_name = agent_id.replace("_", " ").title()
+        other_agent_names = [aid.replace("_", " ").title() for aid in self.agent_ids if aid != agent_id]
+
+        # Create a reference to other agents for the prompt
+        agents_reference = ""
+        if other_agent_names:
+            if len(other_agent_names) == 1:
+                agents_reference = f"You may directly address {other_agent_names[0]} by name in your response."
+            else:
+                formatted_names = ", ".join(other_agent_names[:-1]) + f" and {other_agent_names[-1]}"
+                agents_reference = f"You may directly address any of these participants by name in your response: {formatted_names}."
+
+        # Improved prompt for more selective, focused replies
+        return (
+            f"You are {agent_name} in a group chat. Please respond to the ongoing discussion ONLY IF you have a valuable perspective or can challenge an idea constructively. "
+            f"{agents_reference}\n\n"
+            f"Be selective about which points you address - you don't need to respond to everything. "
+            f"When appropriate, address specific agents by name. Keep your response brief and focused on making a single strong point. "
+            f"Your response should be 2-3 short paragraphs at most."
+        )
+
+    async def _follow_up_rounds(self) -> AsyncIterator[Dict[str, Any]]:
+        if not self.policy.auto_conversation or len(self.agent_ids) < 2:
+            return
+        logger.info(f"Auto-conversation enabled for {self.policy.max_rounds} rounds with {len(self.agent_ids)} agents")
+        try:
+            # The policy is re-read every round, so a client can stop or extend the discussion
+            while len(self.rounds) < self.follow_up_rounds() and not self._out_of_time():
+                round_number = len(self.rounds) + 2
+                responding_agents = self._pick_responders()
+                logger.info(f"Selected {len(responding_agents)} agents to respond in round {round_number}")
+                round_answers: List[Dict[str, Any]] = []
+                self.rounds.append(round_answers)
+                yield {"type": "round_started", "round": round_number, "agents": responding_agents}
+
+                for agent_id in responding_agents:
+                    if self._out_of_time():
+                        break
+                    yield {"type": "agent_started", "round": round_number, "agent": agent_id}
+                    try:
+                        response = await self._ask(
+                            agent_id,
+                            self._continue_prompt(agent_id),
+                            include_context=False,  # We're providing custom context
+                            custom_context=build_agent_context(self.conversation_context, agent_id)
+                        )
+                    except Exception as agent_error:
+                        logger.error(f"Error processing agent {agent_id} in round {round_number}: {str(agent_error)}")
+                        # Continue with other agents
+                        yield {"type": "agent_error", "round": round_number, "agent": agent_id, "error": str(agent_error)}
+                        if isinstance(agent_error, DeadlineExceeded):
+                            self._cut_short()
+                        continue
+                    round_answers.append(response)
+                    self.conversation_context.append(self._context_entry(response))
+                    yield {"type": "agent_response", "round": round_number, "answer": response}
+
+                    # Add small random delay between responses to make it feel more natural
+                    if self.paced:
+                        await self._pause(random.uniform(0.5, 1.5))
+                yield {"type": "round_completed", "round": round_number}
+
+            # Add final message
+            self.closing_message = {
+                "agent": "system",
+                "response": "The discussion has concluded. You may now respond or ask a follow-up question.",
+                "model": "system",
+                "conversation_id": self.conversation_id
+            }
+            logger.info(f"Auto-conversation completed with {len(self.answers)} total responses")
+        except Exception as auto_convo_error:
+            logger.error(f"Error in auto-conversation: {str(auto_convo_error)}")
+            # We'll still return the initial responses even if auto-conversation fails
+
+class PublicSeminarRunner(SeminarRunner):
+    """
+    The anonymous flow: after the first round, every agent adds a point in each round,
+    prompted with the whole conversation so far. Capped at 5 rounds to prevent abuse.
+    """
+    MAX_FOLLOW_UP_ROUNDS = 5
+
+    def summary(self) -> Dict[str, Any]:
+        """The finished seminar as returned by /public/seminar"""
+        return {
+            "question": self.question,
+            "conversation_id": self.conversation_id,
+            "responses": self.first_round,
+            "additional_rounds": self.rounds,
+            "degradation_level": self.degradation.level,
+            "partial": self.partial
+        }
+
+    def follow_up_rounds(self) -> int:
+        if not self.policy.auto_conversation or len(self.agent_ids) < 2:
+            return 0
+        return self.degradation.limit_follow_up_rounds(min(self.policy.max_rounds, self.MAX_FOLLOW_UP_ROUNDS))
+
+    def agents_per_follow_up(self) -> int:
+        return len(self.degradation.limit_follow_up_agents(self.agent_ids))
+
+    def _context_entry(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        return {"role": "assistant", "content": response["response"], "agent": response["agent"]}
+
+    async def _follow_up_rounds(self) -> AsyncIterator[Dict[str, Any]]:
+        if self.follow_up_rounds():
+            logger.info(f"Auto conversation enabled, generating {self.follow_up_rounds()} rounds")
+        while len(self.rounds) < self.follow_up_rounds() and not self._out_of_time():
+            round_number = len(self.rounds) + 2
+            responding_agents = self.degradation.limit_follow_up_agents(self.agent_ids)
+            logger.info(f"Generating round {round_number - 1} of auto conversation")
+            round_answers: List[Dict[str, Any]] = []
+            self.rounds.append(round_answers)
+            yield {"type": "round_started", "round": round_number, "agents": responding_agents}
+
+            for agent_id in responding_agents:
+                if self._out_of_time():
+                    break
+                yield {"type": "agent_started", "round": round_number, "agent": agent_id}
+                # Prepare context from previous messages
+                agent_context = "\n\n".join([
+                    f"{ctx['agent']}: {ctx['content']}"
+                    for ctx in self.conversation_context
+                ])
+
+                # Formulate a question based on the context
+                meta_prompt = f"""
+                    Based on this ongoing conversation, what would be an interesting and relevant point for you
+                    to add as {agent_id}? It should be in response to what others have said.
+
+                    Conversation so far:
+                    {agent_context}
+                    """
+
+                # Get the response from the agent; running out of time ends the seminar, other errors fail it
+                try:
+                    response = await self._ask(
+                        agent_id,
+                        meta_prompt,
+                        include_context=False  # We're providing our own context
+                    )
+                except DeadlineExceeded as e:
+                    yield {"type": "agent_error", "round": round_number, "agent": agent_id, "error": str(e)}
+                    self._cut_short()
+                    break
+                round_answers.append(response)
+                self.conversation_context.append(self._context_entry(response))
+                yield {"type": "agent_response", "round": round_number, "answer": response}
+            yield {"type": "round_completed", "round": round_number}
+
+            # Small delay to prevent rate limiting
+            if self.paced:
+                await self._pause(0.5)
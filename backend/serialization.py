@@ -0,0 +1,82 @@
+"""
+Serialization for REST responses and WebSocket frames.
+Uses orjson when it is installed, falling back to the standard library, and
+MessagePack for WebSocket clients that negotiate the `msgpack` subprotocol.
+"""
+
+import json
+from datetime import datetime, date
+from typing import Any, Dict, List, Optional, Union
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speed-up
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional wire format
+    msgpack = None
+
+JSON_SUBPROTOCOL = "json"
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+def _default(obj: Any) -> Any:
+    """Encode types the fast paths don't know natively"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+def dumps(obj: Any) -> bytes:
+    """Compact UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def dumps_text(obj: Any) -> str:
+    """Compact JSON as a str, for WebSocket text frames"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":"))
+
+def loads(data: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def pack(obj: Any) -> bytes:
+    return msgpack.packb(obj, default=_default, use_bin_type=True)
+
+def unpack(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
+
+def supported_subprotocols() -> List[str]:
+    return [MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL] if msgpack is not None else [JSON_SUBPROTOCOL]
+
+def negotiate_subprotocol(requested: List[str]) -> Optional[str]:
+    """First subprotocol in the client's preference order that we support; None means plain JSON"""
+    supported = supported_subprotocols()
+    return next((protocol for protocol in requested if protocol in supported), None)
+
+class EncodedMessage:
+    """A message encoded at most once per wire format, however many connections receive it"""
+    __slots__ = ("message", "_encodings")
+
+    def __init__(self, message: Dict[str, Any]):
+        self.message = message
+        self._encodings: Dict[Optional[str], Union[str, bytes]] = {}
+
+    def encode(self, subprotocol: Optional[str] = None) -> Union[str, bytes]:
+        """Text frame for JSON, binary frame for MessagePack"""
+        data = self._encodings.get(subprotocol)
+        if data is None:
+            data = pack(self.message) if subprotocol == MSGPACK_SUBPROTOCOL else dumps_text(self.message)
+            self._encodings[subprotocol] = data
+        return data
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with the fast encoder"""
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
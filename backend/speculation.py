@@ -0,0 +1,164 @@
+"""
+Speculative pre-generation of the next round.
+When a client opts in, the round a plain "continue" would produce is generated in the
+background right after a seminar or continue finishes, while the user reads the answers.
+It runs only in idle capacity, is cancelled as soon as anything else happens in the
+conversation, and is capped in tokens per conversation. A matching /continue is then
+answered from it straight away.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Any
+
+from admission import admission_controller, AdmissionRejected
+from agent_manager import AgentManager
+from brownout import DegradationPolicy
+from deadline import Deadline
+from memory import memory_manager
+from metrics import metrics
+from quotas import TokenBudget, estimate_seminar_tokens, total_usage
+from task_registry import conversation_tasks
+
+logger = logging.getLogger(__name__)
+
+def memory_size(conversation_id: str) -> int:
+    """Exchanges stored for a conversation, across all its agents"""
+    return sum(len(exchanges) for exchanges in memory_manager.conversations.get(conversation_id, {}).values())
+
+class Speculation:
+    """The next round for one conversation, generated ahead of the request for it"""
+    def __init__(self, conversation_id: str, question: str, agent_ids: List[str], estimated_tokens: int):
+        self.conversation_id = conversation_id
+        self.question = question
+        self.agent_ids = agent_ids
+        self.estimated_tokens = estimated_tokens
+        self.created_at = time.monotonic()
+        # Anything added to the conversation's memory since makes the speculation stale
+        self.memory_size = memory_size(conversation_id)
+        self.responses: List[Dict[str, Any]] = []
+        self.task: Optional[asyncio.Task] = None
+
+    def matches(self, question: str, agent_ids: List[str]) -> bool:
+        return (question == self.question and sorted(agent_ids) == sorted(self.agent_ids)
+                and memory_size(self.conversation_id) == self.memory_size)
+
+class SpeculationManager:
+    def __init__(self):
+        # Tokens a conversation may spend on speculation at once, enough for a five-agent round;
+        # 0 turns speculation off
+        self.max_tokens = int(os.getenv("SPECULATION_MAX_TOKENS_PER_CONVERSATION", "8000"))
+        # The budget refills completely over this many seconds
+        self.budget_period = float(os.getenv("SPECULATION_BUDGET_PERIOD_SECONDS", "600"))
+        # A finished speculation older than this is stale and discarded
+        self.ttl = float(os.getenv("SPECULATION_TTL", "300"))
+        self.max_conversations = int(os.getenv("SPECULATION_MAX_CONVERSATIONS", "10000"))
+        # Structure: {conversation_id: Speculation}, at most one per conversation
+        self.speculations: Dict[str, Speculation] = {}
+        # Per-conversation buckets, least recently used forgotten first
+        self.budget = TokenBudget("speculation", self.max_tokens, self.budget_period, self.max_conversations)
+
+    def schedule(self, am: AgentManager, conversation_id: str, question: str, agent_ids: List[str],
+                 degradation: Optional[DegradationPolicy] = None) -> bool:
+        """Start generating the round `question` would get from `agent_ids`; False if over budget"""
+        self.discard(conversation_id)
+        self._evict_expired()
+        estimated = estimate_seminar_tokens(question, agent_ids)
+        now = time.monotonic()
+        if self.max_tokens <= 0 or self.budget.shortfall_wait(conversation_id, estimated, now) > 0:
+            metrics.increment("speculations_total", outcome="over_budget")
+            return False
+        # Charge the estimate up front; it is corrected to the actual spend when the round finishes
+        self.budget.adjust(conversation_id, estimated, now)
+        speculation = Speculation(conversation_id, question, list(agent_ids), estimated)
+        speculation.task = asyncio.create_task(self._generate(am, speculation, degradation))
+        self.speculations[conversation_id] = speculation
+        metrics.set_gauge("speculations_pending", len(self.speculations))
+        return True
+
+    async def claim(self, conversation_id: str, question: str, agent_ids: List[str],
+                    deadline: Optional[Deadline] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        The speculated answers, if they match the request, waiting for them if still being
+        generated, but no longer than `deadline`. They are written to memory as if the request
+        had produced them. Returns None on a miss.
+        """
+        speculation = self.speculations.get(conversation_id)
+        if speculation is None or not speculation.matches(question, agent_ids) \
+                or time.monotonic() - speculation.created_at > self.ttl:
+            self.discard(conversation_id)
+            return None
+        del self.speculations[conversation_id]
+        metrics.set_gauge("speculations_pending", len(self.speculations))
+        try:
+            await asyncio.wait_for(asyncio.shield(speculation.task),
+                                   deadline.remaining() if deadline is not None else None)
+        except asyncio.TimeoutError:
+            # Stuck (in upstream retries, say); the request is better off generating its own round
+            speculation.task.cancel()
+            return None
+        except asyncio.CancelledError:
+            if not speculation.task.cancelled():
+                # The request went away; nobody else will claim the round
+                speculation.task.cancel()
+                raise
+        if speculation.task.cancelled() or not speculation.responses:
+            return None
+        # In the order the request named the agents, as the request itself would have answered
+        responses = sorted(speculation.responses, key=lambda response: agent_ids.index(response["agent"]))
+        for response in responses:
+            memory_manager.add_exchange(conversation_id, response["agent"], question, response["response"])
+        metrics.increment("speculations_total", outcome="served")
+        logger.info(f"Served {len(responses)} speculated answer(s) in conversation {conversation_id}")
+        return responses
+
+    def discard(self, conversation_id: str) -> None:
+        """Drop the conversation's speculation, cancelling it if it is still running"""
+        speculation = self.speculations.pop(conversation_id, None)
+        if speculation is not None:
+            if speculation.task.done():
+                metrics.increment("speculations_total", outcome="unused")
+            else:
+                speculation.task.cancel()
+            metrics.set_gauge("speculations_pending", len(self.speculations))
+
+    async def _generate(self, am: AgentManager, speculation: Speculation,
+                        degradation: Optional[DegradationPolicy]) -> None:
+        conversation_id = speculation.conversation_id
+        try:
+            async with admission_controller.admit_speculative():
+                # Registered without superseding anything, so any new seminar in the conversation cancels it
+                with conversation_tasks.track(conversation_id, supersede=False):
+                    results = await asyncio.gather(*[
+                        am.get_response(agent_id, speculation.question, conversation_id,
+                                        degradation=degradation, remember=False)
+                        for agent_id in speculation.agent_ids
+                    ], return_exceptions=True)
+            speculation.responses = [result for result in results if isinstance(result, dict)]
+            self.budget.adjust(conversation_id, total_usage(speculation.responses) - speculation.estimated_tokens,
+                               time.monotonic())
+            metrics.increment("speculative_tokens_total", total_usage(speculation.responses))
+            metrics.increment("speculations_total", outcome="generated")
+        except AdmissionRejected:
+            self.budget.adjust(conversation_id, -speculation.estimated_tokens, time.monotonic())
+            metrics.increment("speculations_total", outcome="no_capacity")
+        except asyncio.CancelledError:
+            # Interjected, superseded or preempted; the estimate stays charged for what was generated
+            metrics.increment("speculations_total", outcome="cancelled")
+            if self.speculations.get(conversation_id) is speculation:
+                del self.speculations[conversation_id]
+                metrics.set_gauge("speculations_pending", len(self.speculations))
+        except Exception as e:
+            logger.warning(f"Speculation failed in conversation {conversation_id}: {str(e)}")
+            metrics.increment("speculations_total", outcome="failed")
+
+    def _evict_expired(self) -> None:
+        cutoff = time.monotonic() - self.ttl
+        for conversation_id in [conversation_id for conversation_id, speculation in self.speculations.items()
+                                if speculation.created_at < cutoff]:
+            self.discard(conversation_id)
+
+# Global speculation manager instance
+speculation_manager = SpeculationManager()
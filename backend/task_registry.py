@@ -0,0 +1,171 @@
+"""
+Cooperative cancellation of seminars.
+Every running seminar is registered under its conversation, so its outstanding agent
+generations and remaining rounds can be cancelled when nobody will read the answers:
+the HTTP client disconnected, the last WebSocket subscriber left, a newer question
+superseded it, or the conversation was deleted.
+"""
+
+import os
+import asyncio
+import logging
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Optional, Any, AsyncGenerator, AsyncIterator, Awaitable
+
+from fastapi import Request
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Cancellation reasons, as reported in metrics and to clients
+CLIENT_DISCONNECTED = "client_disconnected"
+UNWATCHED = "unwatched"
+SUPERSEDED = "superseded"
+DELETED = "deleted"
+CANCELLED = "cancelled"
+
+class SeminarCancelled(Exception):
+    """Raised by ConversationTaskRegistry.run when the registry cancelled the work"""
+    def __init__(self, reason: str):
+        super().__init__(f"Seminar cancelled: {reason}")
+        self.reason = reason
+
+class ConversationTaskRegistry:
+    def __init__(self):
+        # Structure: {conversation_id: {task: cancel when the last WebSocket subscriber leaves}}
+        self.tasks: Dict[str, Dict[asyncio.Task, bool]] = {}
+        # Structure: {task: reason}, for tasks this registry cancelled; kept until the task is gone
+        self.reasons: "weakref.WeakKeyDictionary[asyncio.Task, str]" = weakref.WeakKeyDictionary()
+        # A subscriber that drops has this long to reconnect (and resume) before its seminar is cancelled
+        self.unwatched_grace = float(os.getenv("CANCEL_UNWATCHED_GRACE_SECONDS", "10"))
+        # Structure: {conversation_id: pending unwatched cancellation}
+        self._grace_timers: Dict[str, asyncio.TimerHandle] = {}
+
+    @contextmanager
+    def track(self, conversation_id: str, supersede: bool = True, cancel_when_unwatched: bool = False):
+        """
+        Register the current task for the duration of the block. With `supersede`,
+        seminars already running in the conversation are cancelled first.
+        """
+        task = asyncio.current_task()
+        self.reasons.pop(task, None)
+        if supersede:
+            self.cancel(conversation_id, SUPERSEDED)
+        self.tasks.setdefault(conversation_id, {})[task] = cancel_when_unwatched
+        metrics.set_gauge("conversation_tasks", sum(len(tasks) for tasks in self.tasks.values()))
+        try:
+            yield
+        finally:
+            tasks = self.tasks.get(conversation_id, {})
+            tasks.pop(task, None)
+            if not tasks:
+                self.tasks.pop(conversation_id, None)
+            metrics.set_gauge("conversation_tasks", sum(len(tasks) for tasks in self.tasks.values()))
+
+    async def run(self, conversation_id: str, work: Awaitable[Any], request: Optional[Request] = None,
+                  supersede: bool = True) -> Any:
+        """
+        Run `work` as a registered task and return its result. With `request`, the work is
+        cancelled if the HTTP client disconnects. Raises SeminarCancelled if it was cancelled.
+        """
+        async def tracked():
+            with self.track(conversation_id, supersede):
+                return await work
+
+        task = asyncio.create_task(tracked())
+        watcher = asyncio.create_task(self._watch_disconnect(request, task)) if request is not None else None
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                # We were cancelled ourselves, not the work
+                task.cancel()
+                raise
+            raise SeminarCancelled(self.reasons.get(task, CANCELLED))
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+    async def stream(self, conversation_id: str, events: AsyncIterator[Dict[str, Any]],
+                     supersede: bool = True) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Re-yield `events`, produced in a registered task of their own so the registry can
+        cancel them. Raises SeminarCancelled if it did. Closing the stream cancels the work.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        finished = object()
+
+        async def produce():
+            with self.track(conversation_id, supersede):
+                async for event in events:
+                    queue.put_nowait(event)
+
+        task = asyncio.create_task(produce())
+        task.add_done_callback(lambda _: queue.put_nowait(finished))
+        try:
+            while True:
+                event = await queue.get()
+                if event is finished:
+                    break
+                yield event
+            if task.cancelled():
+                raise SeminarCancelled(self.reasons.get(task, CANCELLED))
+            task.result()
+        finally:
+            # The consumer went away (a streaming client disconnected) before the work finished
+            self.cancel_task(task, CLIENT_DISCONNECTED)
+
+    async def _watch_disconnect(self, request: Request, task: asyncio.Task) -> None:
+        # Wait on the ASGI channel itself: behind BaseHTTPMiddleware (the rate limiter),
+        # request.is_disconnected() never reports a disconnect
+        while not task.done():
+            message = await request.receive()
+            if message["type"] == "http.disconnect":
+                self.cancel_task(task, CLIENT_DISCONNECTED)
+                return
+
+    def cancel_task(self, task: asyncio.Task, reason: str) -> bool:
+        if task.done() or task in self.reasons:
+            return False
+        self.reasons[task] = reason
+        task.cancel()
+        metrics.increment("seminar_cancellations_total", reason=reason)
+        return True
+
+    def cancel(self, conversation_id: str, reason: str, only_unwatched: bool = False) -> int:
+        """Cancel the conversation's seminars (other than the caller); returns how many"""
+        current = asyncio.current_task()
+        cancelled = sum(
+            self.cancel_task(task, reason)
+            for task, cancel_when_unwatched in list(self.tasks.get(conversation_id, {}).items())
+            if task is not current and (cancel_when_unwatched or not only_unwatched)
+        )
+        if cancelled:
+            logger.info(f"Cancelled {cancelled} seminar(s) in conversation {conversation_id}: {reason}")
+        return cancelled
+
+    def cancel_reason(self, task: Optional[asyncio.Task] = None) -> Optional[str]:
+        """Why the registry cancelled `task` (default: the current task), or None if it didn't"""
+        return self.reasons.get(task or asyncio.current_task())
+
+    def unwatched(self, conversation_id: str) -> None:
+        """The last WebSocket subscriber left; cancel the seminars it was driving after the grace period"""
+        if not any(self.tasks.get(conversation_id, {}).values()) or conversation_id in self._grace_timers:
+            return
+        loop = asyncio.get_running_loop()
+        self._grace_timers[conversation_id] = loop.call_later(self.unwatched_grace, self._expire, conversation_id)
+
+    def watched(self, conversation_id: str) -> None:
+        """A subscriber (re)joined within the grace period"""
+        timer = self._grace_timers.pop(conversation_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _expire(self, conversation_id: str) -> None:
+        self._grace_timers.pop(conversation_id, None)
+        self.cancel(conversation_id, UNWATCHED, only_unwatched=True)
+
+# Global conversation task registry instance
+conversation_tasks = ConversationTaskRegistry()
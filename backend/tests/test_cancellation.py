@@ -0,0 +1,61 @@
+"""HTTP client disconnects cancel the seminar they started"""
+
+import asyncio
+import json
+import os
+import sys
+
+from fastapi import FastAPI, Request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from task_registry import ConversationTaskRegistry, SeminarCancelled, CLIENT_DISCONNECTED
+
+def build_app(registry: ConversationTaskRegistry, outcome: dict) -> FastAPI:
+    app = FastAPI()
+
+    # The service's rate limiter is an http middleware like this one
+    @app.middleware("http")
+    async def passthrough(request: Request, call_next):
+        return await call_next(request)
+
+    @app.post("/seminar")
+    async def seminar(request: Request, payload: dict):
+        async def work():
+            await asyncio.sleep(30)
+        try:
+            await registry.run(payload["conversation_id"], work(), request)
+        except SeminarCancelled as e:
+            outcome["reason"] = e.reason
+        return {}
+
+    return app
+
+def test_client_disconnect_cancels_seminar():
+    registry = ConversationTaskRegistry()
+    outcome = {}
+    app = build_app(registry, outcome)
+    body = json.dumps({"conversation_id": "c1"}).encode()
+
+    async def call():
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            # The client hangs up while the seminar is still running
+            await asyncio.sleep(0.2)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            pass
+
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+                 "scheme": "http", "path": "/seminar", "raw_path": b"/seminar", "query_string": b"",
+                 "root_path": "", "headers": [(b"content-type", b"application/json")],
+                 "client": ("127.0.0.1", 1234), "server": ("testserver", 80)}
+        await asyncio.wait_for(app(scope, receive, send), timeout=5)
+
+    asyncio.run(call())
+    assert outcome.get("reason") == CLIENT_DISCONNECTED
+    assert not registry.tasks
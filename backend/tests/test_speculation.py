@@ -0,0 +1,46 @@
+"""Speculative rounds under the default token budget"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory import memory_manager
+from speculation import SpeculationManager
+
+CONTINUE_QUESTION = "Continue the discussion."
+PANEL = ["socrates", "ada_lovelace", "nikola_tesla"]
+
+class FakeAgentManager:
+    def __init__(self):
+        self.calls = 0
+
+    async def get_response(self, agent_id, question, conversation_id, degradation=None, remember=True):
+        self.calls += 1
+        return {"agent": agent_id, "response": f"{agent_id} answers", "conversation_id": conversation_id,
+                "usage": {"total_tokens": 400}}
+
+def test_default_budget_speculates_every_round_for_a_three_agent_panel():
+    manager = SpeculationManager()
+    am = FakeAgentManager()
+
+    async def rounds():
+        served = []
+        for _ in range(3):
+            assert manager.schedule(am, "c1", CONTINUE_QUESTION, PANEL)
+            served.append(await manager.claim("c1", CONTINUE_QUESTION, list(reversed(PANEL))))
+        return served
+
+    try:
+        served = asyncio.run(rounds())
+    finally:
+        memory_manager.clear_conversation("c1")
+    assert am.calls == 9
+    for responses in served:
+        assert [response["agent"] for response in responses] == list(reversed(PANEL))
+
+def test_zero_budget_disables_speculation(monkeypatch):
+    monkeypatch.setenv("SPECULATION_MAX_TOKENS_PER_CONVERSATION", "0")
+    manager = SpeculationManager()
+    assert not manager.schedule(FakeAgentManager(), "c2", CONTINUE_QUESTION, PANEL)
@@ -0,0 +1,111 @@
+"""
+Background model warm-up and keep-warm pinging.
+Loads every configured model endpoint after startup, keeps serverless endpoints
+from going cold and reports per-model readiness for the health probes.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Optional, Any, List
+
+from huggingface_client import HuggingFaceClient, HuggingFaceError, map_huggingface_error
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class ModelWarmState:
+    """Warm-up status of one endpoint URL"""
+    def __init__(self, model: str, url: str):
+        self.model = model
+        self.url = url
+        self.warm = False
+        self.attempts = 0
+        self.last_ping: Optional[float] = None
+        self.last_latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "url": self.url,
+            "warm": self.warm,
+            "attempts": self.attempts,
+            "last_latency": self.last_latency,
+            "last_error": self.last_error,
+        }
+
+class WarmupManager:
+    def __init__(self):
+        # Structure: {url: ModelWarmState}
+        self.models: Dict[str, ModelWarmState] = {}
+        self.keep_warm_interval = float(os.getenv("HF_KEEP_WARM_INTERVAL", "240"))
+        self.initial_retry_delay = float(os.getenv("HF_WARMUP_RETRY_DELAY", "5"))
+        self.max_retry_delay = float(os.getenv("HF_WARMUP_MAX_RETRY_DELAY", "120"))
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self, client: HuggingFaceClient) -> None:
+        """Warm every configured endpoint in the background, then keep it warm"""
+        self.stop()
+        for url in client.balancer.urls():
+            model = client.balancer.endpoints_for_url(url)[0].model
+            self.models[url] = ModelWarmState(model, url)
+            self._tasks.append(asyncio.create_task(self._run(client, self.models[url])))
+        logger.info(f"Started warm-up for {len(self.models)} model endpoint(s)")
+
+    def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def is_ready(self) -> bool:
+        return bool(self.models) and all(state.warm for state in self.models.values())
+
+    def report(self) -> List[Dict[str, Any]]:
+        return [state.to_dict() for state in self.models.values()]
+
+    async def _ping(self, client: HuggingFaceClient, state: ModelWarmState) -> Optional[HuggingFaceError]:
+        state.attempts += 1
+        state.last_ping = time.monotonic()
+        try:
+            await client.ping(state.url)
+        except Exception as e:
+            error = map_huggingface_error(e)
+            state.warm = False
+            state.last_error = str(error)
+            metrics.increment("model_warmup_pings_total", model=state.model, outcome="failure")
+            return error
+
+        state.last_latency = time.monotonic() - state.last_ping
+        state.last_error = None
+        if not state.warm:
+            logger.info(f"Model {state.model} is warm ({state.last_latency:.2f}s)")
+        state.warm = True
+        metrics.increment("model_warmup_pings_total", model=state.model, outcome="success")
+        return None
+
+    async def _run(self, client: HuggingFaceClient, state: ModelWarmState) -> None:
+        retry_delay = self.initial_retry_delay
+        while True:
+            # Real traffic keeps the model loaded just as well as a ping does
+            idle_for = time.monotonic() - client.balancer.last_success(state.url)
+            if state.warm and idle_for < self.keep_warm_interval:
+                await asyncio.sleep(self.keep_warm_interval - idle_for)
+                continue
+
+            error = await self._ping(client, state)
+            metrics.set_gauge("model_warm", 1 if state.warm else 0, model=state.model)
+            if error is None:
+                retry_delay = self.initial_retry_delay
+                await asyncio.sleep(self.keep_warm_interval)
+                continue
+
+            # Cold or failing: retry, waiting at least as long as the upstream asked
+            wait_time = max(retry_delay, error.retry_after or 0)
+            logger.warning(f"Warm-up ping for {state.model} failed, retrying in {wait_time:.0f}s: {error}")
+            await asyncio.sleep(min(wait_time, self.max_retry_delay))
+            retry_delay = min(retry_delay * 2, self.max_retry_delay)
+
+# Global warm-up manager instance
+warmup_manager = WarmupManager()
@@ -1,94 +1,554 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict, Set, List, Any
-import json
+from typing import Dict, Set, List, Any, Optional, Callable, Union, Deque
+from collections import OrderedDict, deque
+import os
+import time
+import zlib
+import uuid
 import logging
 from datetime import datetime
 import asyncio
 
+from metrics import metrics
+from task_registry import conversation_tasks
+from serialization import EncodedMessage, negotiate_subprotocol, loads, unpack, MSGPACK_SUBPROTOCOL
+
 logger = logging.getLogger(__name__)
 
+# Frames that can be skipped for a lagging client without losing state: a later frame supersedes them
+DROPPABLE_TYPES = {"typing_indicator", "heartbeat"}
+
+# Close code for clients that cannot keep up ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+class ClientConnection:
+    """
+    One WebSocket with its own bounded send queue and writer task, so a slow or
+    half-dead client only ever delays itself. The writer also sends the heartbeat,
+    and only when nothing else has been sent for a whole interval.
+    A connection can subscribe to several conversations (channels); each subscription
+    is reference-counted and each channel has its own share of the queue.
+    """
+    def __init__(self, websocket: WebSocket, queue_size: int, send_timeout: float,
+                 heartbeat_interval: float, subprotocol: Optional[str] = None, multiplexed: bool = False):
+        self.websocket = websocket
+        self.send_timeout = send_timeout
+        self.heartbeat_interval = heartbeat_interval
+        # Negotiated wire format: None/"json" for text frames, "msgpack" for binary frames
+        self.subprotocol = subprotocol
+        # Legacy /ws/{conversation_id} sockets carry one conversation; /ws sockets subscribe to many
+        self.multiplexed = multiplexed
+        # Structure: {conversation_id: subscription count}
+        self.subscriptions: Dict[str, int] = {}
+        # Structure: {conversation_id: frames queued for that channel}
+        self.backlog: Dict[str, int] = {}
+        # Structure: (conversation_id or None, encoded frame)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+        # When a frame other than a heartbeat was last written
+        self.last_frame_at = time.monotonic()
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self, on_failure: Callable[["ClientConnection", str], None]) -> None:
+        self._writer = asyncio.create_task(self._write_loop(on_failure))
+
+    def offer(self, message: EncodedMessage, channel: Optional[str] = None, droppable: bool = False) -> bool:
+        """
+        Queue a message in this connection's wire format without waiting. Returns False when
+        the queue is full and the frame must not be dropped, i.e. the client has fallen too far behind.
+        """
+        if self.closed:
+            return True
+        try:
+            self.queue.put_nowait((channel, message.encode(self.subprotocol)))
+        except asyncio.QueueFull:
+            if not droppable:
+                return False
+            metrics.increment("ws_frames_dropped_total")
+            return True
+        if channel is not None:
+            self.backlog[channel] = self.backlog.get(channel, 0) + 1
+        return True
+
+    async def _write_loop(self, on_failure: Callable[["ClientConnection", str], None]) -> None:
+        while True:
+            try:
+                channel, frame = await asyncio.wait_for(self.queue.get(), timeout=self.heartbeat_interval)
+            except asyncio.TimeoutError:
+                # Idle for a whole interval: keep proxies and load balancers from timing the connection out
+                channel = None
+                frame = EncodedMessage({"type": "heartbeat", "timestamp": datetime.utcnow().isoformat()}).encode(self.subprotocol)
+                metrics.increment("ws_heartbeats_sent_total")
+            else:
+                self.last_frame_at = time.monotonic()
+            if channel is not None:
+                remaining = self.backlog.get(channel, 1) - 1
+                if remaining > 0:
+                    self.backlog[channel] = remaining
+                else:
+                    self.backlog.pop(channel, None)
+            send = self.websocket.send_bytes(frame) if isinstance(frame, bytes) else self.websocket.send_text(frame)
+            try:
+                await asyncio.wait_for(send, timeout=self.send_timeout)
+            except asyncio.TimeoutError:
+                metrics.increment("ws_send_timeouts_total")
+                on_failure(self, "send timeout")
+                return
+            except Exception as e:
+                on_failure(self, f"send failed: {str(e)}")
+                return
+
+    def stop(self) -> None:
+        """Stop accepting and writing frames"""
+        self.closed = True
+        if self._writer and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+
+    async def close(self, code: int = 1000) -> None:
+        """Stop the writer and close the socket (best effort: the peer may already be gone)"""
+        self.stop()
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), timeout=self.send_timeout)
+        except Exception:
+            pass
+
+class PartialStream:
+    """
+    Delivery state of one answer being streamed: how much text has been accepted,
+    the CRC-32 of that text, and the deltas not yet sent.
+    """
+    __slots__ = ("agent_id", "length", "crc", "flushed_length", "pending")
+
+    def __init__(self, agent_id: str):
+        self.agent_id = agent_id
+        self.length = 0
+        self.crc = 0
+        self.flushed_length = 0
+        self.pending: List[str] = []
+
+    def append(self, delta: str) -> None:
+        self.length += len(delta)
+        self.crc = zlib.crc32(delta.encode("utf-8"), self.crc)
+        self.pending.append(delta)
+
+    def take_delta(self) -> Optional[Dict[str, Any]]:
+        """Pending text as one append-only delta, or None if nothing is pending"""
+        if not self.pending:
+            return None
+        delta = {
+            "agent_id": self.agent_id,
+            "offset": self.flushed_length,
+            "text": "".join(self.pending),
+            "crc32": self.crc,
+        }
+        self.pending = []
+        self.flushed_length = self.length
+        return delta
+
+class RoundState:
+    """Typing changes and streamed deltas of one conversation, coalesced into round_state frames"""
+    def __init__(self):
+        # Structure: {message_id: PartialStream}
+        self.streams: Dict[str, PartialStream] = {}
+        self.typing_changes: Dict[str, bool] = {}
+        self.last_flush = 0.0
+        self.flush_task: Optional[asyncio.Task] = None
+
+class ReplayBuffer:
+    """
+    The latest frames of one conversation, each stamped with the conversation's next
+    sequence number, so a client that reconnects can be sent just what it missed.
+    """
+    __slots__ = ("seq", "frames", "updated_at")
+
+    def __init__(self, size: int):
+        self.seq = 0
+        self.frames: Deque[EncodedMessage] = deque(maxlen=size)
+        self.updated_at = time.monotonic()
+
+    def append(self, message: Dict[str, Any]) -> EncodedMessage:
+        self.seq += 1
+        message["seq"] = self.seq
+        frame = EncodedMessage(message)
+        self.frames.append(frame)
+        self.updated_at = time.monotonic()
+        return frame
+
+    def since(self, last_seq: int) -> Optional[List[Dict[str, Any]]]:
+        """Messages after `last_seq`, or None if some have already left the buffer"""
+        if last_seq > self.seq:
+            return None  # The client saw a stream we no longer know about (e.g. before a restart)
+        oldest = self.seq - len(self.frames) + 1
+        if last_seq + 1 < oldest:
+            return None
+        return [frame.message for frame in list(self.frames)[last_seq + 1 - oldest:]]
+
 class ConnectionManager:
     def __init__(self):
         # Store active connections by conversation_id
-        self.active_connections: Dict[str, Set[WebSocket]] = {}
+        self.active_connections: Dict[str, Set[ClientConnection]] = {}
+        # Structure: {websocket: ClientConnection}
+        self.connections: Dict[WebSocket, ClientConnection] = {}
         # Store typing status by conversation_id and agent_id
         self.typing_status: Dict[str, Dict[str, bool]] = {}
+        self.send_queue_size = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+        # Frames one conversation may have queued on a connection before that subscription is shed
+        self.channel_queue_size = int(os.getenv("WS_CHANNEL_QUEUE_SIZE", "32"))
+        self.max_subscriptions = int(os.getenv("WS_MAX_SUBSCRIPTIONS", "50"))
+        self.send_timeout = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+        self.heartbeat_interval = float(os.getenv("WS_HEARTBEAT_INTERVAL", "30"))
+        # Connections that send nothing (not even a ping message) for this long are closed,
+        # unless they are still being sent a seminar
+        self.idle_timeout = float(os.getenv("WS_IDLE_TIMEOUT", "120"))
+        # Round-state frames per conversation are capped at this rate
+        self.frame_interval = 1.0 / float(os.getenv("WS_MAX_FRAME_RATE", "10"))
+        # Structure: {conversation_id: RoundState}
+        self.round_states: Dict[str, RoundState] = {}
+        # Frames kept per conversation for clients that reconnect
+        self.replay_buffer_size = int(os.getenv("WS_REPLAY_BUFFER_SIZE", "256"))
+        self.replay_max_conversations = int(os.getenv("WS_REPLAY_MAX_CONVERSATIONS", "1000"))
+        # Buffers of conversations with no new frames for this long are discarded
+        self.replay_ttl = float(os.getenv("WS_REPLAY_TTL", "600"))
+        # Structure: {conversation_id: ReplayBuffer}, least recently updated first
+        self.replay_buffers: "OrderedDict[str, ReplayBuffer]" = OrderedDict()
+
+    async def accept(self, websocket: WebSocket, multiplexed: bool = True) -> ClientConnection:
+        """Accept a new WebSocket connection, negotiating its wire format"""
+        subprotocol = negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        connection = ClientConnection(websocket, self.send_queue_size, self.send_timeout,
+                                      self.heartbeat_interval, subprotocol, multiplexed)
+        connection.start(self._on_send_failure)
+        self.connections[websocket] = connection
+        metrics.set_gauge("ws_connections", len(self.connections))
+        return connection
         
-    async def connect(self, websocket: WebSocket, conversation_id: str):
-        """Accept a new WebSocket connection for a specific conversation"""
-        await websocket.accept()
-        if conversation_id not in self.active_connections:
-            self.active_connections[conversation_id] = set()
-        self.active_connections[conversation_id].add(websocket)
+    async def connect(self, websocket: WebSocket, conversation_id: str, last_seq: Optional[int] = None):
+        """Accept a new WebSocket connection for a specific conversation, resuming after `last_seq` if given"""
+        await self.accept(websocket, multiplexed=False)
+        replay = self.subscribe(websocket, conversation_id, last_seq)
+        if last_seq is not None:
+            self.send_to(websocket, dict(replay, type="resumed", conversation_id=conversation_id))
         logger.info(f"New WebSocket connection for conversation {conversation_id}")
-        
-        # Send the current typing status for this conversation
-        if conversation_id in self.typing_status:
-            for agent_id, is_typing in self.typing_status[conversation_id].items():
-                await websocket.send_json({
+
+    def subscribe(self, websocket: WebSocket, conversation_id: str, last_seq: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Add a subscription to a conversation. With `last_seq`, the frames the client missed
+        since then are queued ahead of any new ones. Returns the connection's count for the
+        conversation, its latest sequence number and how the resume went.
+        """
+        connection = self.connections[websocket]
+        count = connection.subscriptions.get(conversation_id, 0)
+        if count == 0:
+            if len(connection.subscriptions) >= self.max_subscriptions:
+                raise ValueError(f"At most {self.max_subscriptions} subscriptions per connection")
+            self.active_connections.setdefault(conversation_id, set()).add(connection)
+            conversation_tasks.watched(conversation_id)
+            metrics.set_gauge("ws_subscriptions", sum(len(c) for c in self.active_connections.values()))
+        connection.subscriptions[conversation_id] = count + 1
+        buffer = self.replay_buffers.get(conversation_id)
+        result: Dict[str, Any] = {"subscriptions": count + 1, "seq": buffer.seq if buffer else 0}
+        if last_seq is not None:
+            result.update(self._replay(connection, conversation_id, last_seq))
+        if count == 0:
+            # Send the agents currently typing in this conversation
+            for agent_id, is_typing in self.typing_status.get(conversation_id, {}).items():
+                connection.offer(EncodedMessage({
                     "type": "typing_indicator",
+                    "conversation_id": conversation_id,
                     "agent_id": agent_id,
                     "is_typing": is_typing
-                })
+                }), conversation_id, droppable=True)
+        return result
+
+    def _replay(self, connection: ClientConnection, conversation_id: str, last_seq: int) -> Dict[str, Any]:
+        """Queue the frames after `last_seq` as one replay frame; flag a resync if they are gone"""
+        buffer = self.replay_buffers.get(conversation_id)
+        missed = buffer.since(last_seq) if buffer else ([] if last_seq == 0 else None)
+        if missed is None:
+            metrics.increment("ws_replays_total", outcome="resync")
+            return {"replayed": 0, "resync": True}
+        metrics.increment("ws_replays_total", outcome="replayed")
+        if missed:
+            replay = EncodedMessage({"type": "replay", "conversation_id": conversation_id, "events": missed})
+            if not connection.offer(replay, conversation_id):
+                self._drop(connection, "send queue full")
+        return {"replayed": len(missed), "resync": False}
+
+    def unsubscribe(self, websocket: WebSocket, conversation_id: str) -> int:
+        """Release one subscription; the channel is left when the count reaches zero"""
+        connection = self.connections.get(websocket)
+        if connection is None or conversation_id not in connection.subscriptions:
+            return 0
+        count = connection.subscriptions[conversation_id] - 1
+        if count > 0:
+            connection.subscriptions[conversation_id] = count
+        else:
+            self._leave(connection, conversation_id)
+        return count
+
+    def send_to(self, websocket: WebSocket, message: dict) -> None:
+        """Queue a reply to one client (acks, pongs, command results)"""
+        connection = self.connections.get(websocket)
+        if connection is not None and not connection.offer(EncodedMessage(message)):
+            self._drop(connection, "send queue full")
+
+    def decode(self, websocket: WebSocket, data: Union[str, bytes]) -> Any:
+        """Parse a client frame in the connection's wire format. Raises ValueError if malformed."""
+        connection = self.connections.get(websocket)
+        try:
+            if isinstance(data, bytes) and connection is not None and connection.subprotocol == MSGPACK_SUBPROTOCOL:
+                return unpack(data)
+            return loads(data)
+        except Exception as e:
+            raise ValueError(f"Malformed message: {str(e)}")
+
+    async def handle_control(self, websocket: WebSocket, message: Dict[str, Any]) -> bool:
+        """
+        Handle subscription and keep-alive messages. Returns False for anything else,
+        which is left to the endpoint.
+        """
+        message_type = message.get("type")
+        if message_type == "ping":
+            self.send_to(websocket, {"type": "pong", "timestamp": datetime.utcnow().isoformat()})
+            return True
+        if message_type not in ("subscribe", "unsubscribe"):
+            return False
+
+        conversation_id = message.get("conversation_id")
+        if not isinstance(conversation_id, str) or not conversation_id:
+            self.send_to(websocket, {"type": "error", "error": "conversation_id is required"})
+            return True
+        last_seq = message.get("last_seq")
+        if last_seq is not None and (not isinstance(last_seq, int) or last_seq < 0):
+            self.send_to(websocket, {"type": "error", "conversation_id": conversation_id, "error": "last_seq must be a non-negative integer"})
+            return True
+        if message_type == "unsubscribe":
+            count = self.unsubscribe(websocket, conversation_id)
+            self.send_to(websocket, {"type": "unsubscribed", "conversation_id": conversation_id, "subscriptions": count})
+            return True
+        try:
+            result = self.subscribe(websocket, conversation_id, last_seq)
+        except ValueError as e:
+            self.send_to(websocket, {"type": "error", "conversation_id": conversation_id, "error": str(e)})
+            return True
+        self.send_to(websocket, dict(result, type="subscribed", conversation_id=conversation_id))
+        return True
         
-    async def disconnect(self, websocket: WebSocket, conversation_id: str):
-        """Remove a WebSocket connection when it's closed"""
+    async def receive(self, websocket: WebSocket) -> Union[str, bytes]:
+        """
+        Wait for the next client frame (text or binary) within the idle deadline.
+        Raises WebSocketDisconnect when the client goes away or stays silent too long.
+        """
+        connection = self.connections.get(websocket)
+        receiving = asyncio.ensure_future(websocket.receive())
+        try:
+            while True:
+                done, _ = await asyncio.wait({receiving}, timeout=self.idle_timeout)
+                if done:
+                    message = receiving.result()
+                    break
+                # A client that only listens is not idle while it is being sent a seminar
+                if connection is not None and self._busy(connection):
+                    continue
+                metrics.increment("ws_idle_closes_total")
+                if connection is not None:
+                    await connection.close(1001)
+                raise WebSocketDisconnect(code=1001)
+        finally:
+            receiving.cancel()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(code=message.get("code", 1000))
+        return message["text"] if message.get("text") is not None else message.get("bytes", b"")
+
+    def _busy(self, connection: ClientConnection) -> bool:
+        """Frames went out within the idle deadline, or a seminar is running in a subscribed conversation"""
+        if time.monotonic() - connection.last_frame_at < self.idle_timeout:
+            return True
+        return any(conversation_id in conversation_tasks.tasks for conversation_id in connection.subscriptions)
+
+    async def disconnect(self, websocket: WebSocket, conversation_id: Optional[str] = None):
+        """Remove a WebSocket connection, and all its subscriptions, when it's closed"""
+        connection = self.connections.get(websocket)
+        if connection is None:
+            return
+        channels = ", ".join(connection.subscriptions) or "none"
+        connection.stop()
+        self._remove(connection)
+        logger.info(f"Closed WebSocket connection for conversation(s) {channels}")
+
+    def _remove(self, connection: ClientConnection) -> None:
+        self.connections.pop(connection.websocket, None)
+        metrics.set_gauge("ws_connections", len(self.connections))
+        for conversation_id in list(connection.subscriptions):
+            self._leave(connection, conversation_id)
+
+    def _leave(self, connection: ClientConnection, conversation_id: str) -> None:
+        connection.subscriptions.pop(conversation_id, None)
         if conversation_id in self.active_connections:
-            if websocket in self.active_connections[conversation_id]:
-                self.active_connections[conversation_id].remove(websocket)
+            self.active_connections[conversation_id].discard(connection)
             if not self.active_connections[conversation_id]:
                 del self.active_connections[conversation_id]
+                # Seminars driven from a WebSocket stop if nobody comes back to watch them
+                conversation_tasks.unwatched(conversation_id)
                 # Clean up typing status for this conversation
                 if conversation_id in self.typing_status:
                     del self.typing_status[conversation_id]
-            logger.info(f"Closed WebSocket connection for conversation {conversation_id}")
+                self._discard_round_state(conversation_id)
+        metrics.set_gauge("ws_subscriptions", sum(len(c) for c in self.active_connections.values()))
+
+    def _drop(self, connection: ClientConnection, reason: str, code: int = SLOW_CONSUMER_CLOSE_CODE) -> None:
+        """Detach a connection that cannot keep up and close it in the background"""
+        if connection.closed:
+            return
+        logger.warning(f"Dropping WebSocket client ({', '.join(connection.subscriptions) or 'no subscriptions'}): {reason}")
+        metrics.increment("ws_slow_consumers_dropped_total")
+        connection.stop()
+        self._remove(connection)
+        asyncio.create_task(connection.close(code))
+
+    def _shed_channel(self, connection: ClientConnection, conversation_id: str) -> None:
+        """
+        A multiplexed client is too far behind on one conversation: end that subscription
+        and tell the client, instead of dropping its other channels with it.
+        """
+        if not connection.multiplexed:
+            self._drop(connection, "send queue full")
+            return
+        logger.warning(f"Shedding subscription to {conversation_id}: channel backlog full")
+        metrics.increment("ws_channel_overflows_total")
+        self._leave(connection, conversation_id)
+        notice = EncodedMessage({"type": "unsubscribed", "conversation_id": conversation_id,
+                                 "subscriptions": 0, "reason": "backpressure"})
+        if not connection.offer(notice):
+            self._drop(connection, "send queue full")
+
+    def _on_send_failure(self, connection: ClientConnection, reason: str) -> None:
+        self._drop(connection, reason)
         
     async def send_agent_typing(self, conversation_id: str, agent_id: str, is_typing: bool):
-        """Send typing indicator status for an agent"""
-        if conversation_id not in self.typing_status:
-            self.typing_status[conversation_id] = {}
+        """Record typing indicator status for an agent; it goes out with the next round_state frame"""
+        typing = self.typing_status.get(conversation_id, {})
         
         # Only send if status changed
-        if conversation_id not in self.typing_status or \
-           agent_id not in self.typing_status[conversation_id] or \
-           self.typing_status[conversation_id].get(agent_id) != is_typing:
-            
-            self.typing_status[conversation_id][agent_id] = is_typing
-            
-            await self.broadcast_to_conversation(conversation_id, {
-                "type": "typing_indicator",
-                "agent_id": agent_id,
-                "is_typing": is_typing
-            })
+        if typing.get(agent_id, False) != is_typing:
+            # Only agents that are typing are kept, so finished conversations leave nothing behind
+            if is_typing:
+                self.typing_status.setdefault(conversation_id, {})[agent_id] = True
+            else:
+                del typing[agent_id]
+                if not typing:
+                    self.typing_status.pop(conversation_id, None)
+            state = self._round_state(conversation_id)
+            state.typing_changes[agent_id] = is_typing
+            self._schedule_flush(conversation_id, state)
             
             logger.debug(f"Agent {agent_id} {'started' if is_typing else 'stopped'} typing in conversation {conversation_id}")
         
     async def send_partial_response(self, conversation_id: str, agent_id: str, partial_response: str, message_id: str):
-        """Send partial response as it's being generated"""
-        message = {
-            "type": "partial_response",
-            "agent_id": agent_id,
-            "content": partial_response,
-            "message_id": message_id,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        await self.broadcast_to_conversation(conversation_id, message)
+        """
+        Send a partial response as it's being generated. `partial_response` is the whole
+        text so far and must extend the previous one; only the new suffix is sent.
+        """
+        stream = self._round_state(conversation_id).streams.get(message_id)
+        already_sent = stream.length if stream else 0
+        await self.append_partial_response(conversation_id, agent_id, partial_response[already_sent:], message_id)
+
+    async def append_partial_response(self, conversation_id: str, agent_id: str, delta: str, message_id: str):
+        """Stream newly generated text; deltas are coalesced and sent at most at the frame rate"""
+        if not delta:
+            return
+        state = self._round_state(conversation_id)
+        stream = state.streams.get(message_id)
+        if stream is None:
+            stream = state.streams[message_id] = PartialStream(agent_id)
+        stream.append(delta)
+        self._schedule_flush(conversation_id, state)
         
-    async def send_agent_response(self, conversation_id: str, agent_id: str, response: str, message_id: str):
-        """Send complete agent response"""
+    async def send_agent_response(self, conversation_id: str, agent_id: str, response: str, message_id: str, **extra: Any):
+        """
+        Send complete agent response, with its length and CRC-32 for checking streamed reassembly.
+        `extra` adds fields such as the round and model.
+        """
+        # Deltas still pending for this conversation must arrive before the final message
+        await self._flush(conversation_id)
+        state = self.round_states.get(conversation_id)
+        stream = state.streams.pop(message_id, None) if state else None
         message = {
             "type": "agent_response",
             "agent_id": agent_id,
             "content": response,
             "message_id": message_id,
             "timestamp": datetime.utcnow().isoformat(),
-            "is_complete": True
+            "is_complete": True,
+            "length": len(response),
+            "crc32": stream.crc if stream and stream.length == len(response) else zlib.crc32(response.encode("utf-8")),
+            **extra
         }
         await self.broadcast_to_conversation(conversation_id, message)
         logger.info(f"Sent complete response from agent {agent_id} in conversation {conversation_id}")
+
+    def _round_state(self, conversation_id: str) -> RoundState:
+        state = self.round_states.get(conversation_id)
+        if state is None:
+            state = self.round_states[conversation_id] = RoundState()
+        return state
+
+    def _schedule_flush(self, conversation_id: str, state: RoundState) -> None:
+        """Flush now if the frame budget allows, otherwise once the interval has passed"""
+        if state.flush_task is not None:
+            return
+        delay = max(0.0, state.last_flush + self.frame_interval - time.monotonic())
+        state.flush_task = asyncio.create_task(self._flush_after(conversation_id, delay))
+
+    async def _flush_after(self, conversation_id: str, delay: float) -> None:
+        if delay:
+            await asyncio.sleep(delay)
+        state = self.round_states.get(conversation_id)
+        if state is not None:
+            state.flush_task = None
+        await self._flush(conversation_id)
+
+    async def _flush(self, conversation_id: str) -> None:
+        """Send everything pending for the conversation as a single round_state frame"""
+        state = self.round_states.get(conversation_id)
+        if state is None:
+            return
+        if state.flush_task is not None and state.flush_task is not asyncio.current_task():
+            state.flush_task.cancel()
+            state.flush_task = None
+
+        deltas = {}
+        for message_id, stream in state.streams.items():
+            delta = stream.take_delta()
+            if delta is not None:
+                deltas[message_id] = delta
+        if not deltas and not state.typing_changes:
+            return
+
+        state.last_flush = time.monotonic()
+        frame = {"type": "round_state"}
+        if state.typing_changes:
+            frame["typing"] = state.typing_changes
+            state.typing_changes = {}
+        if deltas:
+            frame["deltas"] = [dict(delta, message_id=message_id) for message_id, delta in deltas.items()]
+        await self.broadcast_to_conversation(conversation_id, frame)
+        self._discard_round_state(conversation_id)
+
+    def _discard_round_state(self, conversation_id: str) -> None:
+        """Forget round state once nothing is streaming and nobody is watching"""
+        state = self.round_states.get(conversation_id)
+        if state and not state.streams and state.flush_task is None and conversation_id not in self.active_connections:
+            del self.round_states[conversation_id]
         
     async def send_error(self, conversation_id: str, agent_id: str, error_message: str):
         """Send error message for an agent"""
+        # The agent's unfinished streams will never complete
+        state = self.round_states.get(conversation_id)
+        if state:
+            for message_id in [mid for mid, stream in state.streams.items() if stream.agent_id == agent_id]:
+                del state.streams[message_id]
         message = {
             "type": "error",
             "agent_id": agent_id,
@@ -99,19 +559,61 @@ class ConnectionManager:
         logger.error(f"Error from agent {agent_id} in conversation {conversation_id}: {error_message}")
         
     async def broadcast_to_conversation(self, conversation_id: str, message: dict):
-        """Broadcast message to all connections in a conversation"""
-        if conversation_id in self.active_connections:
-            dead_connections = set()
-            for connection in self.active_connections[conversation_id]:
-                try:
-                    await connection.send_json(message)
-                except Exception as e:
-                    logger.error(f"Error sending WebSocket message: {str(e)}")
-                    dead_connections.add(connection)
-            
-            # Clean up dead connections
-            for dead in dead_connections:
-                await self.disconnect(dead, conversation_id)
+        """
+        Broadcast message to all connections in a conversation. The message is stamped with the
+        conversation's next sequence number and kept for replay, encoded once per wire format
+        and queued on every connection; each connection's writer task delivers it, so the
+        broadcast never waits on a socket.
+        """
+        # Multiplexed clients need to know which conversation a frame belongs to
+        message.setdefault("conversation_id", conversation_id)
+        droppable = message.get("type") in DROPPABLE_TYPES
+        # Droppable frames are superseded by later ones, so they are neither numbered nor replayed
+        frame = EncodedMessage(message) if droppable else self._replay_buffer(conversation_id).append(message)
+        connections = self.active_connections.get(conversation_id)
+        if not connections:
+            return
+        for connection in list(connections):
+            if connection.backlog.get(conversation_id, 0) >= self.channel_queue_size:
+                if droppable:
+                    metrics.increment("ws_frames_dropped_total")
+                else:
+                    self._shed_channel(connection, conversation_id)
+            elif not connection.offer(frame, conversation_id, droppable):
+                self._drop(connection, "send queue full")
+
+    def _replay_buffer(self, conversation_id: str) -> ReplayBuffer:
+        """The conversation's buffer, created on first use; stale and surplus buffers are evicted"""
+        buffer = self.replay_buffers.get(conversation_id)
+        if buffer is None:
+            buffer = self.replay_buffers[conversation_id] = ReplayBuffer(self.replay_buffer_size)
+        else:
+            self.replay_buffers.move_to_end(conversation_id)
+        # Least recently updated first, so eviction only ever looks at the front
+        cutoff = time.monotonic() - self.replay_ttl
+        while len(self.replay_buffers) > 1:
+            oldest_id, oldest = next(iter(self.replay_buffers.items()))
+            if len(self.replay_buffers) <= self.replay_max_conversations and oldest.updated_at >= cutoff:
+                break
+            del self.replay_buffers[oldest_id]
+        metrics.set_gauge("ws_replay_buffers", len(self.replay_buffers))
+        return buffer
+
+    async def publish_seminar_event(self, conversation_id: str, event: Dict[str, Any]):
+        """Deliver a seminar runner event: agent activity maps onto typing, response and error frames"""
+        event_type = event["type"]
+        if event_type == "agent_started":
+            await self.send_agent_typing(conversation_id, event["agent"], True)
+        elif event_type == "agent_response":
+            answer = event["answer"]
+            await self.send_agent_typing(conversation_id, answer["agent"], False)
+            await self.send_agent_response(conversation_id, answer["agent"], answer["response"], str(uuid.uuid4()),
+                                           round=event["round"], model=answer.get("model"))
+        elif event_type == "agent_error":
+            await self.send_agent_typing(conversation_id, event["agent"], False)
+            await self.send_error(conversation_id, event["agent"], event["error"])
+        else:
+            await self.broadcast_to_conversation(conversation_id, dict(event, timestamp=datetime.utcnow().isoformat()))
 
     async def broadcast_conversation_update(self, conversation_id: str, agents_data: List[Dict[str, Any]]):
         """Broadcast when conversation has a new message or update"""
@@ -122,25 +624,6 @@ class ConnectionManager:
             "timestamp": datetime.utcnow().isoformat()
         }
         await self.broadcast_to_conversation(conversation_id, message)
-        
-    async def send_heartbeat(self):
-        """Send periodic heartbeats to keep connections alive"""
-        while True:
-            for conversation_id, connections in list(self.active_connections.items()):
-                dead_connections = set()
-                for connection in connections:
-                    try:
-                        await connection.send_json({"type": "heartbeat", "timestamp": datetime.utcnow().isoformat()})
-                    except Exception as e:
-                        logger.error(f"Error sending heartbeat: {str(e)}")
-                        dead_connections.add(connection)
-                
-                # Clean up dead connections
-                for dead in dead_connections:
-                    await self.disconnect(dead, conversation_id)
-            
-            # Send heartbeat every 30 seconds
-            await asyncio.sleep(30)
 
 # Create a global connection manager
 manager = ConnectionManager() 
\ No newline at end of file
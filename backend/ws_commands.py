@@ -0,0 +1,218 @@
+"""
+Seminar commands sent over a WebSocket connection.
+A client starts seminars, asks follow-ups, mentions agents, cancels and changes the
+round policy on the socket it already holds; results stream back on the same connection.
+"""
+
+import math
+import uuid
+import asyncio
+import logging
+from typing import Dict, Optional, Any, Callable
+
+from fastapi import WebSocket
+
+from agent_manager import AgentManager
+from admission import admission_controller, AdmissionRejected, AUTHENTICATED, ANONYMOUS
+from brownout import brownout_controller
+from deadline import Deadline, request_deadline
+from metrics import metrics
+from quotas import quota_engine, QuotaExceededError, total_usage
+from rate_limit import rate_limit_policy, rate_limit_key
+from seminar import SeminarRunner, PublicSeminarRunner, RoundPolicy, SeminarFailed
+from task_registry import conversation_tasks, CANCELLED
+from websocket_manager import manager
+
+logger = logging.getLogger(__name__)
+
+class CommandError(Exception):
+    """A command that cannot be carried out; reported to the client as command_error"""
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CommandSession:
+    """
+    Commands from one WebSocket connection. Each seminar runs as a task; its events are
+    published to the conversation, and the issuing connection is subscribed to it. A new
+    seminar supersedes the one running in the conversation, and a seminar is cancelled
+    once nobody has been subscribed to its conversation for the grace period.
+    """
+    def __init__(self,
+                 websocket: WebSocket,
+                 agent_manager_provider: Callable[[], Optional[AgentManager]],
+                 default_conversation_id: Optional[str] = None):
+        self.websocket = websocket
+        # Commands on a per-conversation socket need not name the conversation
+        self.default_conversation_id = default_conversation_id
+        self.agent_manager_provider = agent_manager_provider
+        # Structure: {conversation_id: running seminar task}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        # Structure: {conversation_id: RoundPolicy}, shared with the running seminar so changes apply live
+        self.policies: Dict[str, RoundPolicy] = {}
+        self.handlers = {
+            "start_seminar": self.start_seminar,
+            "follow_up": self.follow_up,
+            "mention": self.mention,
+            "cancel": self.cancel,
+            "set_round_policy": self.set_round_policy,
+        }
+
+    async def handle(self, message: Dict[str, Any]) -> bool:
+        """Carry out a command. Returns False if the message isn't one."""
+        handler = self.handlers.get(message.get("type"))
+        if handler is None:
+            return False
+        metrics.increment("ws_commands_total", command=message["type"])
+        try:
+            result = await handler(message)
+        except CommandError as e:
+            reply = {"type": "command_error", "id": message.get("id"), "command": message["type"], "error": str(e)}
+            if e.retry_after is not None:
+                reply["retry_after"] = max(1, math.ceil(e.retry_after))
+            manager.send_to(self.websocket, reply)
+            return True
+        manager.send_to(self.websocket, dict(result, type="command_accepted", id=message.get("id"), command=message["type"]))
+        return True
+
+    async def start_seminar(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        conversation_id = message.get("conversation_id") or self.default_conversation_id or str(uuid.uuid4())
+        question, agent_ids = self._question(message), self._agent_ids(message)
+        policy = self._policy(conversation_id)
+        self._update_policy(policy, message)
+        return self._launch(conversation_id, question, agent_ids, policy, self._deadline(message), message.get("direct_mention"))
+
+    async def follow_up(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        conversation_id = self._conversation_id(message)
+        return self._launch(conversation_id, self._question(message), self._agent_ids(message), self._policy(conversation_id),
+                            self._deadline(message))
+
+    async def mention(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Ask one agent directly; nobody else joins in"""
+        conversation_id = self._conversation_id(message)
+        agent_id = message.get("agent_id")
+        if not isinstance(agent_id, str) or not agent_id:
+            raise CommandError("agent_id is required")
+        return self._launch(conversation_id, self._question(message), [agent_id], RoundPolicy(auto_conversation=False),
+                            self._deadline(message), agent_id)
+
+    async def cancel(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        conversation_id = self._conversation_id(message)
+        task = self.tasks.get(conversation_id)
+        if task is None:
+            raise CommandError("No seminar is running in this conversation")
+        conversation_tasks.cancel_task(task, CANCELLED)
+        return {"conversation_id": conversation_id}
+
+    async def set_round_policy(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        conversation_id = self._conversation_id(message)
+        policy = self._policy(conversation_id)
+        self._update_policy(policy, message)
+        return {"conversation_id": conversation_id, "policy": policy.to_dict()}
+
+    def _conversation_id(self, message: Dict[str, Any]) -> str:
+        conversation_id = message.get("conversation_id") or self.default_conversation_id
+        if not isinstance(conversation_id, str) or not conversation_id:
+            raise CommandError("conversation_id is required")
+        return conversation_id
+
+    def _question(self, message: Dict[str, Any]) -> str:
+        question = message.get("question")
+        if not isinstance(question, str) or not question.strip():
+            raise CommandError("question is required")
+        return question
+
+    def _agent_ids(self, message: Dict[str, Any]) -> list:
+        agent_ids = message.get("agent_ids")
+        if not isinstance(agent_ids, list) or not agent_ids or not all(isinstance(a, str) for a in agent_ids):
+            raise CommandError("agent_ids must be a non-empty list of agent IDs")
+        return agent_ids
+
+    def _deadline(self, message: Dict[str, Any]) -> Deadline:
+        """The seminar's deadline, from the command's optional `timeout` in seconds"""
+        try:
+            return request_deadline(message.get("timeout"))
+        except ValueError as e:
+            raise CommandError(str(e))
+
+    def _policy(self, conversation_id: str) -> RoundPolicy:
+        policy = self.policies.get(conversation_id)
+        if policy is None:
+            policy = self.policies[conversation_id] = RoundPolicy()
+        return policy
+
+    def _update_policy(self, policy: RoundPolicy, message: Dict[str, Any]) -> None:
+        try:
+            policy.update(message.get("auto_conversation"), message.get("max_rounds"), message.get("agents_per_round"))
+        except ValueError as e:
+            raise CommandError(str(e))
+
+    def _launch(self, conversation_id: str, question: str, agent_ids: list, policy: RoundPolicy,
+                deadline: Deadline, direct_mention: Optional[str] = None) -> Dict[str, Any]:
+        """Admit, rate-limit and charge a seminar, then run it in the background"""
+        am = self.agent_manager_provider()
+        if am is None:
+            raise CommandError("AI service is currently unavailable. Please try again later.")
+
+        decision = rate_limit_policy.check(self.websocket)
+        if not decision.allowed:
+            raise CommandError("Rate limit exceeded. Please try again later.", decision.retry_after)
+
+        kind, key = rate_limit_key(self.websocket)
+        # Anonymous callers get the capped public flow, as over HTTP
+        runner_class = SeminarRunner if kind == "user" else PublicSeminarRunner
+        runner = runner_class(am, conversation_id, question, agent_ids, direct_mention, policy,
+                              brownout_controller.current_policy(), deadline=deadline)
+        try:
+            reservation = quota_engine.reserve(kind, key, runner.estimated_tokens())
+        except QuotaExceededError as e:
+            raise CommandError(f"{str(e)}. Please try again later.", e.retry_after)
+
+        try:
+            manager.subscribe(self.websocket, conversation_id)
+        except ValueError as e:
+            quota_engine.reconcile(reservation, 0)
+            raise CommandError(str(e))
+        lane = AUTHENTICATED if kind == "user" else ANONYMOUS
+        task = asyncio.create_task(self._run(runner, lane, reservation))
+        self.tasks[conversation_id] = task
+        task.add_done_callback(lambda _: self._finished(conversation_id, task))
+        return {"conversation_id": conversation_id, "policy": policy.to_dict()}
+
+    def _finished(self, conversation_id: str, task: asyncio.Task) -> None:
+        if self.tasks.get(conversation_id) is task:
+            del self.tasks[conversation_id]
+        # Release the subscription taken for this seminar
+        manager.unsubscribe(self.websocket, conversation_id)
+
+    async def _run(self, runner: SeminarRunner, lane: str, reservation) -> None:
+        conversation_id = runner.conversation_id
+        try:
+            with conversation_tasks.track(conversation_id, cancel_when_unwatched=True):
+                async with admission_controller.admit(lane, runner.deadline):
+                    async for event in runner.run():
+                        await manager.publish_seminar_event(conversation_id, event)
+        except AdmissionRejected as e:
+            await manager.broadcast_to_conversation(conversation_id, {
+                "type": "seminar_failed",
+                "error": "The service is busy. Please try again shortly.",
+                "retry_after": max(1, math.ceil(e.retry_after))
+            })
+        except asyncio.CancelledError:
+            reason = conversation_tasks.cancel_reason() or CANCELLED
+            logger.info(f"Seminar in conversation {conversation_id} cancelled: {reason}")
+            await manager.broadcast_to_conversation(conversation_id, {
+                "type": "seminar_cancelled",
+                "reason": reason,
+                "answers": len(runner.answers)
+            })
+        except SeminarFailed as e:
+            await manager.broadcast_to_conversation(conversation_id, {"type": "seminar_failed", "error": str(e)})
+        except Exception as e:
+            logger.error(f"Error in WebSocket seminar for conversation {conversation_id}: {str(e)}")
+            await manager.broadcast_to_conversation(conversation_id, {
+                "type": "seminar_failed",
+                "error": "An unexpected error occurred. Please try again later."
+            })
+        finally:
+            quota_engine.reconcile(reservation, total_usage(runner.answers))
@@ -37,7 +37,7 @@ def start_backend():
     """Start the backend server"""
     global backend_process
     print(f"\n{BLUE}➡️ Starting backend server on http://localhost:8001{RESET}")
-    backend_cmd = f"cd {BACKEND_DIR} && source venv/bin/activate && uvicorn app:app --reload --port 8001"
+    backend_cmd = f"cd {BACKEND_DIR} && source venv/bin/activate && uvicorn app:app --reload --port 8001 --ws-ping-interval 20 --ws-ping-timeout 20"
     backend_process = subprocess.Popen(backend_cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
     return backend_process
 